@@ -0,0 +1,389 @@
+import asyncio
+import contextlib
+import os
+import threading
+import time
+
+import aiohttp
+
+# Import custom logic modules
+import class_process
+import downloader
+import integrity
+import retry
+import storage
+from class_process import Process, SegmentWriter
+from partfile import remove_files
+
+"""
+AsyncDownloadEngine: an asyncio alternative to the thread-pool DownloadEngine.
+- Same start_download / pause_download / cancel_download API and the same callback dict.
+- Every download and every segment is a coroutine on one event-loop thread, so hundreds of
+  concurrent transfers don't each hold an OS thread blocked on a socket.
+- File I/O and hashing (preallocation, flushing write buffers, journal records, checksum
+  verification) run on the loop's default executor, so a slow disk or a multi-GB verify never
+  stalls the other transfers.
+"""
+
+class AsyncProcess(Process):
+    """
+    A Process whose transfers run as coroutines on AsyncDownloadEngine's loop, which awaits run().
+    The retry, probe and segment decisions are Process's; only the HTTP and file calls differ.
+    """
+
+    TRANSIENT_ERRORS = Process.TRANSIENT_ERRORS + (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+                                                   asyncio.TimeoutError)
+
+    def __init__(self, url, callbacks, session, global_bucket=None, rate_limit=0, checksum=None, mirrors=None,
+                 loop=None):
+        super().__init__(url, callbacks, global_bucket=global_bucket, rate_limit=rate_limit, checksum=checksum,
+                         mirrors=mirrors)
+        # aiohttp.ClientSession owned by the engine
+        self.http = session
+        # Loop running the transfers (the session's); pause and cancel close responses through it
+        self._loop = loop
+
+    def start(self):
+        """
+        Runs the download to its end on the engine's loop, blocking the calling thread like Process.start.
+        The engine itself awaits run(); this is for callers holding a process outside of it.
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is None or running is self._loop:
+            raise RuntimeError("AsyncProcess.start needs the engine's loop and a thread other than it; "
+                               "await run() on the loop instead")
+        asyncio.run_coroutine_threadsafe(self.run(), self._loop).result()
+
+    async def run(self):
+        # 1. Set downloading flag
+        self.downloading = True
+        self.stop_requested = False
+        self.cancel_requested = False
+        self.stats.started()
+        self._loop = asyncio.get_running_loop()
+
+        try:
+            # 2. Obtain download parameters
+            filename, save_path, part_path, journal_path, segments = self._prepare()
+            self.part_path = part_path
+            if self.checksum is None and self.checksum_sidecar:
+                self.checksum = await self._fetch_sidecar(filename)
+
+            # 3. Same choice between ranged and single-stream downloads as Process.start
+            total_size, accepts_ranges, validator = (0, False, "")
+            if not os.path.exists(save_path) or os.path.exists(part_path):
+                total_size, accepts_ranges, validator = await self._probe()
+
+            if self.stop_requested or self.cancel_requested:
+                total_size = 0
+            elif accepts_ranges and total_size > 0:
+                await self._download_ranged(part_path, journal_path, total_size, validator, segments)
+            else:
+                if os.path.exists(journal_path):
+                    remove_files(part_path, journal_path)
+                total_size = await self._download_single(save_path, part_path)
+
+            # 4. Handle completion, pause, or cancellation requests (may verify a whole existing file)
+            await self._blocking(self._finish, filename, save_path, part_path, journal_path, total_size)
+
+        except Exception as e:
+            self._ended("error", str(e) or type(e).__name__)
+            self.callbacks['on_error'](str(e) or type(e).__name__)
+        finally:
+            self._close_verifier()
+            self.downloading = False
+            self._cancelled_after_end()
+
+    async def _blocking(self, function, *args):
+        """Runs file I/O or hashing on a worker thread, so the other transfers on the loop keep going."""
+        return await self._loop.run_in_executor(None, function, *args)
+
+    async def _write(self, writer, chunk):
+        """writer.write(chunk); on a worker thread when the chunk reaches the disk rather than the buffer."""
+        if writer.flushes(len(chunk)):
+            return await self._blocking(writer.write, chunk)
+        return writer.write(chunk)
+
+    async def _fetch_sidecar(self, filename):
+        for suffix, url in integrity.sidecar_urls(self.url):
+            try:
+                async with self.http.get(url) as response:
+                    if response.status != 200:
+                        continue
+                    text = await response.text(errors="replace")
+            except aiohttp.ClientError:
+                return None
+            checksum = integrity.parse_sidecar(suffix, text, filename)
+            if checksum is not None:
+                return checksum
+        return None
+
+    @contextlib.asynccontextmanager
+    async def _get(self, headers, url=None):
+        # trace_request_ctx lets the engine's trace hooks attribute connection setup to this download
+        began = time.perf_counter()
+        async with self.http.get(url or self.url, headers=headers, trace_request_ctx=self) as response:
+            self._responded(time.perf_counter() - began)
+            with self._lock:
+                self._responses.add(response)
+            try:
+                yield response
+            finally:
+                with self._lock:
+                    self._responses.discard(response)
+
+    def _close_responses(self):
+        """Closes the open responses on the loop thread (aiohttp objects aren't thread-safe)."""
+        with self._lock:
+            responses = list(self._responses)
+        for response in responses:
+            try:
+                self._loop.call_soon_threadsafe(response.close)
+            except RuntimeError:
+                # Engine closed: its loop is gone, and the connections with it
+                pass
+
+    async def _backoff(self, delay):
+        deadline = asyncio.get_running_loop().time() + delay
+        while not self._halted():
+            left = deadline - asyncio.get_running_loop().time()
+            if left <= 0:
+                return
+            await asyncio.sleep(min(left, Process.BACKOFF_SLICE))
+
+    async def _probe(self):
+        state = retry.RetryState(self.retry_policy)
+        while not (self.stop_requested or self.cancel_requested):
+            try:
+                return await self._probe_once()
+            except Exception as e:
+                await self._backoff(self._retry_delay(state, e, False))
+        return 0, False, ""
+
+    async def _probe_once(self, url=None):
+        async with self._get({"Range": "bytes=0-0"}, url) as response:
+            result = Process.probe_reply(response.status, response.headers)
+            if result[1]:
+                # Reading the one-byte body lets the connection go back to the pool
+                await response.read()
+            return result
+
+    async def _probe_mirrors(self, total_size, validator):
+        # All mirrors at once; a failed probe comes back as its exception and the mirror is left out
+        results = await asyncio.gather(*(self._probe_once(url) for url in self.mirrors), return_exceptions=True)
+        return self._mirror_sources(total_size, validator, results)
+
+    async def _download_single(self, save_path, part_path, resume=True):
+        source, existing_size = self._single_resume_point(save_path, part_path) if resume else (part_path, 0)
+        state = retry.RetryState(self.retry_policy)
+        writer = None
+        total_size = 0
+        try:
+            while not (self.stop_requested or self.cancel_requested):
+                position = existing_size if writer is None else writer.position
+                try:
+                    async with self._get({"Range": f"bytes={position}-"}) as response:
+                        action, size = self._single_reply(writer, existing_size, response.status, response.headers)
+                        if action == "complete":
+                            return None
+                        if action == "end":
+                            break
+                        if action == "restart":
+                            await self._blocking(writer.close)
+                            writer, source, existing_size = None, part_path, 0
+                        if writer is None:
+                            total_size = size
+                            writer = await self._blocking(self._open_single, source, part_path,
+                                                          response.status == 206, existing_size, total_size)
+                        self.callbacks['on_status']("Downloading...")
+
+                        async for chunk in self._iter_body(response):
+                            if self.stop_requested or self.cancel_requested:
+                                break
+                            delay = await self._write(writer, chunk)
+                            if delay:
+                                await asyncio.sleep(delay)
+                        else:
+                            break
+                except Exception as e:
+                    await self._backoff(self._retry_delay(state, e, writer is not None and writer.position > position))
+        finally:
+            if writer is not None:
+                await self._blocking(writer.close)
+        if writer is None:
+            # Paused or cancelled before the server sent anything
+            return 0
+        if not await self._blocking(self._verify_single, part_path, writer.position):
+            return await self._download_single(save_path, part_path, resume=False)
+        return total_size or writer.position
+
+    async def _iter_body(self, response):
+        """Yields the body in reads sized by a ChunkSizer (read() returns what is buffered, up to that size)."""
+        sizer = self.chunk_sizer()
+        while True:
+            chunk = await response.content.read(sizer.size)
+            if not chunk:
+                return
+            sizer.update(len(chunk))
+            yield chunk
+
+    async def _download_ranged(self, part_path, journal_path, total_size, validator, segments):
+        # Preallocating a large file can take seconds on filesystems without fallocate
+        journal, part_file = await self._blocking(self._open_journal, part_path, journal_path, total_size, validator)
+        damaged = False
+        try:
+            sources = await self._probe_mirrors(total_size, validator)
+            self._report_sources(sources)
+            verifier = await self._blocking(self._open_verifier, part_path, total_size, journal.completed)
+            verified = False
+            while not verified:
+                planner, connections = self._plan_round(journal, sources, segments, verifier)
+                results = await asyncio.gather(
+                    *(self._run_connection(planner, part_file, journal) for _ in range(connections)),
+                    return_exceptions=True)
+                self._end_round(journal, [r for r in results if isinstance(r, BaseException)])
+                verified = await self._blocking(self._verify_ranged, journal)
+        except integrity.ChecksumMismatch:
+            damaged = True
+            raise
+        finally:
+            await self._blocking(part_file.close)
+            await self._blocking(journal.close)
+            if damaged:
+                await self._blocking(remove_files, part_path, journal_path)
+
+    async def _run_connection(self, planner, part_file, journal):
+        try:
+            assignment = None
+            while not self._halted():
+                assignment = planner.take(assignment)
+                if assignment is None:
+                    return
+                await self._fetch_segment(planner, assignment, part_file, journal)
+        except Exception:
+            # Tell the sibling segments to stop early
+            self._segment_failed = True
+            raise
+
+    async def _fetch_segment(self, planner, assignment, part_file, journal):
+        state = retry.RetryState(self.retry_policy)
+        writer = SegmentWriter(self, part_file, journal, assignment.start, assignment.stop)
+        try:
+            planner.begin(assignment, writer)
+            try:
+                while writer.position < writer.stop and not self._halted():
+                    position = writer.position
+                    try:
+                        await self._stream_range(writer, assignment.source)
+                    except Exception as e:
+                        await self._backoff(self._retry_delay(state, e, writer.position > position))
+            except Exception as e:
+                self._source_failed(planner, assignment, e)
+            else:
+                planner.finish(assignment)
+        finally:
+            # Flushes the buffer and journals it
+            await self._blocking(writer.close)
+
+    async def _stream_range(self, writer, source):
+        start, stop = writer.position, writer.stop
+        async with self._get(Process.range_headers(start, stop, source.validator), source.url) as response:
+            Process.range_reply(start, stop, response.status, response.headers)
+            async for chunk in self._iter_body(response):
+                if self._halted():
+                    return
+                delay = await self._write(writer, chunk)
+                if Process.range_taken(writer, stop):
+                    # Another connection took over the rest: drop the connection rather than read it out
+                    response.close()
+                    return
+                if delay:
+                    await asyncio.sleep(delay)
+        Process.check_range_end(writer, start, stop)
+
+
+class AsyncDownloadEngine(downloader.DownloadEngine):
+    """
+    Runs an asyncio event loop on a background thread (Tk keeps the main thread) and schedules
+    AsyncProcess coroutines on it. Duplicate handling is inherited from DownloadEngine.
+    """
+
+    def __init__(self, connections_per_host=None):
+        self.processes: dict[int, class_process.Process] = {}
+        self._by_url = {}
+        settings = storage.settings.snapshot()
+        if connections_per_host is None:
+            connections_per_host = settings.get('connections_per_host', 16)
+
+        self._requests = 0
+        self._connections = 0
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="aspu-async-engine", daemon=True)
+        self._thread.start()
+        # aiohttp sessions must be created on the loop that uses them
+        self.session = asyncio.run_coroutine_threadsafe(
+            self._create_session(connections_per_host), self.loop).result()
+        self._init_lifecycle(settings)
+        self._init_scheduler(settings)
+        self._init_rate_limits(settings)
+        self._init_metrics(settings)
+        storage.settings.subscribe(self._on_settings_changed)
+
+    async def _create_session(self, connections_per_host):
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(self._count_request)
+        trace.on_connection_create_start.append(self._connection_started)
+        trace.on_connection_create_end.append(self._count_connection)
+        # limit=0: no global cap, only the per-host one
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=connections_per_host)
+        timeout = aiohttp.ClientTimeout(sock_connect=15, sock_read=15)
+        # A larger read buffer lets ChunkSizer's bigger reads actually return more than 64 KB
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=[trace],
+                                     read_bufsize=SegmentWriter.BUFFER_SIZE)
+
+    async def _count_request(self, session, context, params):
+        self._requests += 1
+
+    async def _connection_started(self, session, context, params):
+        context.connect_began = time.perf_counter()
+
+    async def _count_connection(self, session, context, params):
+        self._connections += 1
+        process = context.trace_request_ctx
+        if isinstance(process, AsyncProcess):
+            process.connected(time.perf_counter() - context.connect_began)
+
+    def _create_process(self, url, callbacks, rate_limit, checksum=None, mirrors=None):
+        return AsyncProcess(url, callbacks, self.session, self.global_bucket, rate_limit, checksum, mirrors,
+                            loop=self.loop)
+
+    def _clamp_active(self, max_active):
+        # Coroutines are cheap, so there is no worker ceiling here
+        return max_active
+
+    def _submit(self, process):
+        asyncio.run_coroutine_threadsafe(self._run_async(process), self.loop)
+
+    async def _run_async(self, process):
+        try:
+            await process.run()
+        finally:
+            self.metrics.run_finished(process.stats)
+            self.lifecycle.ended(process)
+            self.scheduler.job_done(process.pid)
+
+    def connection_stats(self):
+        reuse_rate = 1 - self._connections / self._requests if self._requests else 0.0
+        return {'requests': self._requests, 'connections': self._connections, 'reuse_rate': reuse_rate}
+
+    def close(self):
+        """Closes the HTTP session and stops the event loop thread."""
+        storage.settings.unsubscribe(self._on_settings_changed)
+        if self.metrics_log is not None:
+            self.metrics_log.close()
+        asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
@@ -0,0 +1,941 @@
+import argparse
+import gc
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+import class_process
+import downloader
+import journal
+import lifecycle
+from bench_server import BenchServer, random_payload, start_server_process
+
+try:
+    import resource
+except ImportError:
+    # Windows: peak RSS is reported as unknown
+    resource = None
+
+"""
+Benchmarks for the download engine, run against a local HTTP server (no network, no Tk).
+Usage: python bench.py segments | resume | pool | engines | ratelimit | cpu | history | verify | faults | bulk | lifecycle
+                       | mirrors
+       python bench.py suite [--save] | compare BASELINE.json NEW.json
+"""
+
+MB = 1024 * 1024
+KB = 1024
+
+# Workloads of the regression suite: name -> {file name: size in bytes} at scale 1
+SUITE_WORKLOADS = {
+    "single-large": {"large.bin": 256 * MB},
+    "many-small": {f"small_{i}.bin": 64 * KB for i in range(500)},
+    "mixed": {**{f"mixed_large_{i}.bin": 64 * MB for i in range(2)},
+              **{f"mixed_small_{i}.bin": 128 * KB for i in range(200)}},
+}
+# compare: metric -> +1 if higher is better, -1 if lower is better
+SUITE_METRICS = {"throughput_mb_s": 1, "cpu_s_per_gb": -1, "peak_rss_mb": -1, "p50_s": -1, "p99_s": -1}
+RESULTS_DIR = "bench_results"
+
+
+class Checks:
+    """Prints one ok / FAIL line per check and counts the failures, which a bench returns as its exit status."""
+
+    def __init__(self, width):
+        """
+        Args:
+            width (int): Column the labels are padded to.
+        """
+        self.width = width
+        self.failures = 0
+
+    def __call__(self, label, ok, detail):
+        self.failures += 0 if ok else 1
+        print(f"  {label:<{self.width}} {'ok  ' if ok else 'FAIL'}  {detail}")
+
+
+def use_temp_settings(work_dir, **overrides):
+    """Points storage at a throwaway settings.json so benchmarks never touch the user's files."""
+    storage.SETTINGS_FILE = os.path.join(work_dir, "settings.json")
+    settings = {"save_path": work_dir, "open_on_finish": False}
+    settings.update(overrides)
+    storage.save_settings(settings)
+
+
+def run_process(url, session=None):
+    """
+    Runs one Process to completion on the current thread.
+    Returns:
+        tuple: (seconds, result) where result is the on_finish size or the on_error message.
+    """
+    result = {}
+    callbacks = {
+        'on_progress': lambda p: None,
+        'on_status': lambda t: None,
+        'on_finish': lambda f, p, s: result.update(size=s),
+        'on_error': lambda e: result.update(error=e),
+        'on_pause': lambda: None,
+        'on_cancel': lambda: None
+    }
+    began = time.perf_counter()
+    class_process.Process(url, callbacks, session=session).start()
+    elapsed = time.perf_counter() - began
+    return elapsed, result
+
+
+def run_engine(engine, urls, mirrors=None):
+    """
+    Starts every URL on a DownloadEngine (thread or async) and waits until all of them end.
+    `mirrors` are passed to every download.
+    Returns:
+        tuple: (seconds, results) with one result dict per URL, as in run_process, plus "seconds"
+               from the start of the run to that download's end.
+    """
+    remaining = threading.Semaphore(0)
+    results = []
+
+    def callbacks_for(result):
+        def done(**kwargs):
+            # Time to completion, counted from when every download was queued
+            result.update(kwargs, seconds=time.perf_counter() - began)
+            remaining.release()
+        return {
+            'on_progress': lambda p: None,
+            'on_status': lambda t: None,
+            'on_finish': lambda f, p, s: done(size=s),
+            'on_error': lambda e: done(error=e),
+            'on_pause': lambda: done(paused=True),
+            'on_cancel': lambda: done(cancelled=True)
+        }
+
+    began = time.perf_counter()
+    for url in urls:
+        result = {}
+        results.append(result)
+        engine.start_download(url, callbacks_for(result), mirrors=mirrors)
+    for _ in urls:
+        remaining.acquire()
+    return time.perf_counter() - began, results
+
+
+def bench_segments(size_mb, rate_mb):
+    """Compares throughput for 1, 4 and 8 segments on a per-connection throttled server."""
+    payload = random_payload(size_mb * MB)
+    print(f"{size_mb} MB file, server capped at {rate_mb} MB/s per connection")
+    with BenchServer({"file.bin": payload}, rate_per_connection=rate_mb * MB) as server:
+        for segments in (1, 4, 8):
+            with tempfile.TemporaryDirectory() as work_dir:
+                use_temp_settings(work_dir, segments=segments)
+                elapsed, result = run_process(server.url("file.bin"))
+                if "error" in result:
+                    print(f"  segments={segments}: failed: {result['error']}")
+                    continue
+                with open(os.path.join(work_dir, "file.bin"), "rb") as f:
+                    intact = f.read() == payload
+                print(f"  segments={segments}: {elapsed:6.2f}s  {size_mb / elapsed:7.2f} MB/s  intact={intact}")
+
+
+def _download_in_child(url, work_dir, segments):
+    use_temp_settings(work_dir, segments=segments)
+    run_process(url)
+
+
+def bench_resume(size_mb, rate_mb, segments):
+    """SIGKILLs a download halfway, resumes it, and checks that no journaled byte is fetched twice."""
+    payload = random_payload(size_mb * MB)
+    with BenchServer({"file.bin": payload}, rate_per_connection=rate_mb * MB) as server, \
+            tempfile.TemporaryDirectory() as work_dir:
+        url = server.url("file.bin")
+        child = multiprocessing.Process(target=_download_in_child, args=(url, work_dir, segments))
+        child.start()
+        while server.httpd.bytes_sent < len(payload) // 2 and child.is_alive():
+            time.sleep(0.01)
+        # SIGKILL on POSIX, TerminateProcess on Windows: no chance to flush or close anything
+        child.kill()
+        child.join()
+        # Let the server threads notice the dead connections before taking the baseline
+        time.sleep(0.5)
+
+        part_path = os.path.join(work_dir, "file.bin.part")
+        stored = journal._read(part_path + ".journal")
+        journaled = sum(stop - start for start, stop in journal.merge_ranges(stored[2])) if stored else 0
+        sent_before = server.httpd.bytes_sent
+
+        use_temp_settings(work_dir, segments=segments)
+        elapsed, result = run_process(url)
+        fetched = server.httpd.bytes_sent - sent_before
+        with open(os.path.join(work_dir, "file.bin"), "rb") as f:
+            intact = f.read() == payload
+
+        print(f"{size_mb} MB file, killed after {sent_before / MB:.1f} MB sent, {journaled / MB:.1f} MB journaled")
+        print(f"  resume: fetched {fetched / MB:.2f} MB in {elapsed:.2f}s  intact={intact}  "
+              f"result={result}")
+        # Probe requests fetch one byte each, everything else must be new data
+        print(f"  bytes fetched twice after resume: {max(0, journaled + fetched - len(payload) - 1)}")
+
+
+def bench_pool(count, size_kb, workers):
+    """Downloads many small files from one host with and without the engine's shared session."""
+    files = {f"small_{i}.bin": random_payload(size_kb * 1024) for i in range(count)}
+    print(f"{count} files of {size_kb} KB, {workers} workers")
+    with BenchServer(files) as server:
+        urls = [server.url(name) for name in files]
+        for label in ("unpooled", "pooled"):
+            with tempfile.TemporaryDirectory() as work_dir:
+                use_temp_settings(work_dir)
+                engine = downloader.DownloadEngine(connections_per_host=workers)
+                session = engine.session if label == "pooled" else None
+                began = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    results = list(pool.map(lambda u: run_process(u, session)[1], urls))
+                elapsed = time.perf_counter() - began
+                failed = sum(1 for r in results if "error" in r)
+                line = f"  {label:9}: {elapsed:6.2f}s  {count / elapsed:7.1f} files/s  failed={failed}"
+                if session is not None:
+                    stats = engine.connection_stats()
+                    line += f"  requests={stats['requests']} connections={stats['connections']} " \
+                            f"reuse={stats['reuse_rate']:.1%}"
+                print(line)
+
+
+def bench_engines(count, size_kb, rate_kb):
+    """Runs many slow concurrent downloads on the thread engine and on the asyncio engine."""
+    import async_downloader
+
+    files = {f"slow_{i}.bin": random_payload(size_kb * 1024) for i in range(count)}
+    print(f"{count} files of {size_kb} KB, server capped at {rate_kb} KB/s per connection")
+    with BenchServer(files, rate_per_connection=rate_kb * 1024) as server:
+        urls = [server.url(name) for name in files]
+        for label, factory in (("thread", downloader.DownloadEngine),
+                               ("async", async_downloader.AsyncDownloadEngine)):
+            with tempfile.TemporaryDirectory() as work_dir:
+                use_temp_settings(work_dir, max_active_downloads=count, max_downloads_per_host=count)
+                engine = factory(connections_per_host=count)
+                elapsed, results = run_engine(engine, urls)
+                engine.close()
+                failed = sum(1 for r in results if "error" in r)
+                print(f"  {label:6}: {elapsed:6.2f}s  {count * size_kb / 1024 / elapsed:7.2f} MB/s  "
+                      f"failed={failed}")
+
+
+def measure_rate(server, factory, names, work_dir, global_rate=0, download_rate=0):
+    """
+    Downloads `names` from `server` on a new engine under the given caps (bytes/sec, 0 = none).
+    Returns:
+        tuple: (target, achieved, results): the rate the caps allow for this many files, the total rate
+               reached and run_engine's results.
+    """
+    use_temp_settings(work_dir, global_rate_limit=global_rate, download_rate_limit=download_rate)
+    engine = factory()
+    try:
+        elapsed, results = run_engine(engine, [server.url(name) for name in names])
+    finally:
+        engine.close()
+    target = min(global_rate or float("inf"), (download_rate or float("inf")) * len(names))
+    achieved = sum(len(server.httpd.files[name]) for name in names) / elapsed
+    return target, achieved, results
+
+
+def bench_ratelimit(size_mb, tolerance):
+    """Checks achieved rates against global and per-download targets on an unthrottled local server."""
+    import async_downloader
+
+    files = {f"rate_{i}.bin": random_payload(size_mb * MB) for i in range(3)}
+    # (label, engine factory, number of files, global cap, per-download cap)
+    cases = [
+        ("thread global 6 MB/s, 3 files", downloader.DownloadEngine, 3, 6 * MB, 0),
+        ("thread per-download 2 MB/s", downloader.DownloadEngine, 1, 0, 2 * MB),
+        ("thread global 3 MB/s + per-download 2 MB/s, 3 files", downloader.DownloadEngine, 3, 3 * MB, 2 * MB),
+        ("async global 6 MB/s, 3 files", async_downloader.AsyncDownloadEngine, 3, 6 * MB, 0),
+        ("async per-download 2 MB/s", async_downloader.AsyncDownloadEngine, 1, 0, 2 * MB),
+    ]
+    check = Checks(52)
+    with BenchServer(files) as server:
+        for label, factory, count, global_rate, download_rate in cases:
+            with tempfile.TemporaryDirectory() as work_dir:
+                target, achieved, results = measure_rate(server, factory, list(files)[:count], work_dir,
+                                                         global_rate, download_rate)
+            error = achieved / target - 1
+            check(label, abs(error) <= tolerance and not any("error" in r for r in results),
+                  f"target {target / MB:5.2f} MB/s  achieved {achieved / MB:5.2f} MB/s  ({error:+.1%})")
+    return check.failures
+
+
+def bench_cpu(size_mb, rounds):
+    """Client CPU seconds per GB downloaded, fixed 8 KB reads vs adaptive reads (server runs in another process)."""
+    server, base_url = start_server_process({"big.bin": size_mb * MB})
+    try:
+        gigabytes = size_mb * rounds / 1024
+        print(f"{rounds} x {size_mb} MB from a local server in a separate process")
+        for label, chunk_size in (("fixed 8 KB", 8 * 1024), ("adaptive", 0)):
+            for segments in (1, 4):
+                cpu = wall = 0.0
+                for _ in range(rounds):
+                    with tempfile.TemporaryDirectory() as work_dir:
+                        use_temp_settings(work_dir, segments=segments, chunk_size=chunk_size)
+                        cpu_before = time.process_time()
+                        elapsed, result = run_process(base_url + "big.bin")
+                        cpu += time.process_time() - cpu_before
+                        wall += elapsed
+                        if "error" in result:
+                            raise SystemExit(result["error"])
+                print(f"  {label:10} segments={segments}: {cpu / gigabytes:6.2f} CPU s/GB  "
+                      f"{size_mb * rounds / wall:8.1f} MB/s")
+    finally:
+        server.terminate()
+
+
+def _tree_or_none():
+    """A hidden Treeview laid out like the main table, or None when there is no display."""
+    try:
+        import tkinter as tk
+        from tkinter import ttk
+        root = tk.Tk()
+    except Exception:
+        return None
+    root.withdraw()
+    return ttk.Treeview(root, columns=("Name", "Status", "Size", "Progress", "Speed", "ETA"), show="headings")
+
+
+def _timed(action):
+    began = time.perf_counter()
+    action()
+    return (time.perf_counter() - began) * 1000
+
+
+def bench_history(sizes):
+    """History startup cost: the old whole-file JSON load vs the first SQLite page the UI now shows."""
+    from ui import ASPU_DownloadManager_UI
+    page = ASPU_DownloadManager_UI.HISTORY_PAGE
+    tree = _tree_or_none()
+    if tree is None:
+        print("  (no display: Treeview insert times are left out)")
+
+    def fill(rows):
+        if tree is not None:
+            tree.delete(*tree.get_children())
+            for row in rows:
+                tree.insert("", "end", values=row)
+
+    for count in sizes:
+        with tempfile.TemporaryDirectory() as work_dir:
+            storage.HISTORY_FILE = os.path.join(work_dir, "history.json")
+            storage.HISTORY_DB = os.path.join(work_dir, "history.db")
+            legacy = [{"Name": f"file_{i}.zip", "Status": "Finished", "Size": f"{i % 900} MB", "Progress": "100%"}
+                      for i in range(count)]
+            with open(storage.HISTORY_FILE, "w") as f:
+                json.dump(legacy, f, indent=4)
+
+            def old_startup():
+                with open(storage.HISTORY_FILE) as f:
+                    fill([(e["Name"], e["Status"], e["Size"], e["Progress"]) for e in json.load(f)])
+
+            def old_append():
+                with open(storage.HISTORY_FILE) as f:
+                    history = json.load(f)
+                history.append({"Name": "new.zip", "Status": "Finished", "Size": "1 MB", "Progress": "100%"})
+                with open(storage.HISTORY_FILE, "w") as f:
+                    json.dump(history, f, indent=4)
+
+            def new_startup():
+                fill([(e["name"], e["status"], storage.format_size(e["size_bytes"]), "100%")
+                      for e in storage.query_history(0, page)])
+
+            migrate = _timed(storage.count_history)
+            results = {
+                "json startup": _timed(old_startup),
+                "sqlite startup": _timed(new_startup),
+                "search": _timed(lambda: storage.query_history(0, page, f"file_{count // 2}")),
+                "json append": _timed(old_append),
+                "sqlite append": _timed(lambda: storage.save_entry("new.zip", MB, url="http://bench/new.zip")),
+            }
+            print(f"  {count:>7} entries: migrate {migrate:8.1f} ms  " +
+                  "  ".join(f"{label} {ms:7.1f} ms" for label, ms in results.items()))
+
+
+def _metalink(name, payload, piece_length):
+    pieces = "".join(f"<hash>{hashlib.sha256(payload[i:i + piece_length]).hexdigest()}</hash>"
+                     for i in range(0, len(payload), piece_length))
+    return (f'<?xml version="1.0"?><metalink xmlns="urn:ietf:params:xml:ns:metalink">'
+            f'<file name="{name}"><size>{len(payload)}</size>'
+            f'<hash type="sha-256">{hashlib.sha256(payload).hexdigest()}</hash>'
+            f'<pieces length="{piece_length}" type="sha-256">{pieces}</pieces></file></metalink>').encode()
+
+
+def bench_verify(size_mb, segments, piece_kb):
+    """Checksum verification: time with and without it, a wrong digest, and re-fetching one corrupted piece."""
+    payload = random_payload(size_mb * MB)
+    digest = hashlib.sha256(payload).hexdigest()
+    files = {"file.bin": payload, "file.bin.meta4": _metalink("file.bin", payload, piece_kb * 1024)}
+    print(f"{size_mb} MB file, {segments} segments")
+    with BenchServer(files) as server:
+        cases = [
+            ("no checksum", "", {}, ()),
+            ("sha256 in url", f"#sha256={digest}", {}, ()),
+            ("wrong sha256", "#sha256=" + "0" * 64, {}, ()),
+            ("sha256 + 1 bad byte", f"#sha256={digest}", {}, (len(payload) // 3,)),
+            (f"{piece_kb} KB pieces + 1 bad byte", "", {"checksum_sidecar": True}, (len(payload) // 3,)),
+        ]
+        for label, fragment, overrides, bad_offsets in cases:
+            with tempfile.TemporaryDirectory() as work_dir:
+                use_temp_settings(work_dir, segments=segments, **overrides)
+                server.corrupt("file.bin", *bad_offsets)
+                sent_before = server.httpd.bytes_sent
+                elapsed, result = run_process(server.url("file.bin") + fragment)
+                refetched = server.httpd.bytes_sent - sent_before - len(payload)
+                if "error" in result:
+                    print(f"  {label:>26}: {elapsed:6.2f}s  failed: {result['error']}  "
+                          f"extra bytes fetched={refetched}  leftovers={sorted(os.listdir(work_dir))}")
+                    continue
+                with open(os.path.join(work_dir, "file.bin"), "rb") as f:
+                    intact = f.read() == payload
+                print(f"  {label:>26}: {elapsed:6.2f}s  {size_mb / elapsed:7.1f} MB/s  intact={intact}  "
+                      f"extra bytes fetched={refetched}")
+
+
+def _intact(work_dir, files, results):
+    return sum(1 for (name, payload), result in zip(files.items(), results) if "size" in result
+               and open(os.path.join(work_dir, name), "rb").read() == payload)
+
+
+def bench_faults(count, size_mb, drop):
+    """
+    Downloads through a server that hangs up at random offsets and answers 503 / 429, on both engines.
+    Returns:
+        int: Number of failed checks (the exit status).
+    """
+    import async_downloader
+
+    files = {f"flaky_{i}.bin": random_payload(size_mb * MB) for i in range(count)}
+    total = count * size_mb * MB
+    # Short waits keep the run quick; the backoff shape is the same as with the defaults
+    retry_settings = {"retry_attempts": 6, "retry_base_delay": 0.05, "retry_max_delay": 0.5,
+                      "max_active_downloads": count, "max_downloads_per_host": count}
+    check = Checks(34)
+
+    for engine_name, factory in (("thread", downloader.DownloadEngine),
+                                 ("async", async_downloader.AsyncDownloadEngine)):
+        print(f"{engine_name} engine, {count} x {size_mb} MB")
+        for accept_ranges in (True, False):
+            with BenchServer(files, accept_ranges=accept_ranges) as server, \
+                    tempfile.TemporaryDirectory() as work_dir:
+                use_temp_settings(work_dir, **retry_settings)
+                server.drop_connections(drop, seed=len(engine_name))
+                engine = factory()
+                elapsed, results = run_engine(engine, [server.url(name) for name in files])
+                engine.close()
+                intact = _intact(work_dir, files, results)
+                label = f"drop {drop:.0%} of bodies ({'ranged' if accept_ranges else 'single stream'})"
+                check(label, intact == count,
+                      f"{intact}/{count} intact, {server.httpd.drops} drops, "
+                      f"{server.httpd.bytes_sent / total:.2f}x bytes sent, {elapsed:.2f}s")
+
+        with BenchServer(files) as server, tempfile.TemporaryDirectory() as work_dir:
+            use_temp_settings(work_dir, **retry_settings)
+            engine = factory()
+            url = server.url(next(iter(files)))
+
+            server.fail(503, 502, 500)
+            elapsed, results = run_engine(engine, [url])
+            check("503, 502, 500 then OK", "size" in results[0], f"{elapsed:.2f}s")
+            os.remove(os.path.join(work_dir, next(iter(files))))
+
+            server.fail(429, retry_after=1)
+            elapsed, results = run_engine(engine, [url])
+            check("429 with Retry-After: 1", "size" in results[0] and elapsed >= 1, f"{elapsed:.2f}s")
+            os.remove(os.path.join(work_dir, next(iter(files))))
+
+            server.fail(*[503] * (retry_settings["retry_attempts"] + 1))
+            elapsed, results = run_engine(engine, [url])
+            check("503 beyond the retry budget", "error" in results[0],
+                  f"{results[0].get('error')!r} after {elapsed:.2f}s")
+            engine.close()
+    return check.failures
+
+
+def bench_bulk(counts, max_active, engine_names):
+    """
+    Queues thousands of downloads in one call, then re-adds, pauses, resumes and cancels all of them,
+    and reports the cost per download at each queue size. It should stay flat as the queue grows.
+    Returns:
+        int: Number of operations whose per-download cost grew more than 3x from the smallest count.
+    """
+    payload = random_payload(KB)
+    files = {f"bulk_{i}.bin": payload for i in range(max(counts))}
+    operations = ("queue", "re-add", "pause", "resume", "cancel")
+    failures = 0
+
+    with BenchServer(files, rate_per_connection=KB) as server:
+        for engine_name in engine_names:
+            print(f"{engine_name} engine, {max_active} active at a time (microseconds per download)")
+            print(f"  {'jobs':>6}  " + "  ".join(f"{op:>8}" for op in operations) + "  status updates")
+            per_op = {}
+            for count in counts:
+                with tempfile.TemporaryDirectory() as work_dir:
+                    use_temp_settings(work_dir, engine=engine_name, max_active_downloads=max_active,
+                                      max_downloads_per_host=max_active)
+                    engine = downloader.create_engine()
+                    statuses = [0]
+                    callbacks = {
+                        'on_status': lambda t: statuses.__setitem__(0, statuses[0] + 1),
+                        'on_finish': lambda f, p, s: None,
+                        'on_error': lambda e: None,
+                        'on_pause': lambda: None,
+                        'on_cancel': lambda: None
+                    }
+                    items = [(server.url(name), callbacks) for name in list(files)[:count]]
+                    seconds = {}
+
+                    began = time.perf_counter()
+                    pids = engine.start_downloads(items)
+                    seconds["queue"] = time.perf_counter() - began
+                    seconds["re-add"] = _timed(lambda: engine.start_downloads(items)) / 1000
+                    seconds["pause"] = _timed(lambda: engine.pause_downloads(pids)) / 1000
+                    began = time.perf_counter()
+                    pids = engine.start_downloads(items)
+                    seconds["resume"] = time.perf_counter() - began
+                    seconds["cancel"] = _timed(lambda: engine.cancel_downloads(pids)) / 1000
+                    engine.close()
+
+                per_op[count] = {op: seconds[op] / count * 1e6 for op in operations}
+                print(f"  {count:>6}  " + "  ".join(f"{per_op[count][op]:>8.1f}" for op in operations) +
+                      f"  {statuses[0]:>14}")
+
+            smallest, largest = per_op[min(counts)], per_op[max(counts)]
+            grown = [op for op in operations if largest[op] > 3 * max(smallest[op], 1.0)]
+            failures += len(grown)
+            print(f"  scaling: {'FAIL ' + ', '.join(grown) if grown else 'ok'}")
+    return failures
+
+
+def _open_sockets():
+    """Sockets this process holds open (Linux), or None where /proc isn't available."""
+    try:
+        fds = os.listdir("/proc/self/fd")
+    except OSError:
+        return None
+    count = 0
+    for fd in fds:
+        try:
+            count += os.readlink(f"/proc/self/fd/{fd}").startswith("socket:")
+        except OSError:
+            pass
+    return count
+
+
+def bench_lifecycle(count, retention, engine_names, rate_kb):
+    """
+    Memory held after `count` completed downloads and how fast a pause lets go of a slow server's sockets.
+    Returns:
+        int: Number of failed checks.
+    """
+    check = Checks(38)
+
+    # 1. Footprint of one ended download: the Process the engine used to keep vs its ProcessRecord
+    tracemalloc.start()
+    # Stand-in for the UI state a row's callbacks close over
+    callbacks_for = lambda i: {name: (lambda *a, row=[i] * 32: row) for name in
+                               ("on_status", "on_finish", "on_error", "on_pause", "on_cancel")}
+    gc.collect()
+    baseline = tracemalloc.get_traced_memory()[0]
+    processes = [class_process.Process(f"http://localhost/{i}.bin", callbacks_for(i)) for i in range(count)]
+    gc.collect()
+    process_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    records = [lifecycle.ProcessRecord(process, "finished") for process in processes]
+    del processes
+    gc.collect()
+    record_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    del records
+    print(f"{count} ended downloads: {process_bytes / count:.0f} B each as Process objects (with callbacks), "
+          f"{record_bytes / count:.0f} B as ProcessRecords (with their stats)")
+
+    # 2. Real downloads to completion: what the engine still holds afterwards.
+    #    The server runs in a child process so its own allocations aren't counted
+    server, base_url = start_server_process({f"done_{i}.bin": KB for i in range(count)})
+    try:
+        urls = [f"{base_url}done_{i}.bin" for i in range(count)]
+        for engine_name in engine_names:
+            with tempfile.TemporaryDirectory() as work_dir:
+                use_temp_settings(work_dir, engine=engine_name, max_active_downloads=32,
+                                  max_downloads_per_host=32, finished_retention=retention)
+                engine = downloader.create_engine()
+                gc.collect()
+                before = tracemalloc.get_traced_memory()[0]
+                elapsed, results = run_engine(engine, urls)
+                completed = sum(1 for result in results if "size" in result)
+                del results
+                # Let the last workers leave their finally blocks
+                time.sleep(0.2)
+                gc.collect()
+                held = tracemalloc.get_traced_memory()[0] - before
+                alive = sum(1 for obj in gc.get_objects() if isinstance(obj, class_process.Process))
+                tracked = len(engine.processes)
+                engine.close()
+            check(f"{engine_name}: {count} downloads, retention {retention}",
+                  completed == count and tracked <= retention and alive == 0,
+                  f"{completed} done, {tracked} records, {alive} Process objects alive, "
+                  f"{held / MB:.1f} MB held, {elapsed:.0f}s")
+    finally:
+        server.terminate()
+        tracemalloc.stop()
+
+    # 3. Pause while a segment waits on a slow server: the sockets must close now, not at its next block
+    payload = random_payload(8 * MB)
+    with BenchServer({"slow.bin": payload}, rate_per_connection=rate_kb * KB) as server:
+        for engine_name in engine_names:
+            with tempfile.TemporaryDirectory() as work_dir:
+                use_temp_settings(work_dir, engine=engine_name, segments=4)
+                engine = downloader.create_engine()
+                paused = threading.Event()
+                callbacks = {'on_status': lambda t: None, 'on_finish': lambda f, p, s: None,
+                             'on_error': lambda e: None, 'on_pause': paused.set, 'on_cancel': lambda: None}
+                idle_sockets = _open_sockets()
+                pid = engine.start_download(server.url("slow.bin"), callbacks)
+                while engine.processes[pid].downloaded == 0:
+                    time.sleep(0.05)
+                # Every segment has its first block and now blocks on the server's next one
+                time.sleep(0.5)
+                busy_sockets = _open_sockets()
+                began = time.perf_counter()
+                engine.pause_download(pid)
+                stopped = paused.wait(30)
+                latency = time.perf_counter() - began
+                time.sleep(0.1)
+                after_sockets = _open_sockets()
+                engine.close()
+            sockets = f", sockets {idle_sockets} idle / {busy_sockets} downloading / {after_sockets} paused" \
+                if idle_sockets is not None else ""
+            check(f"{engine_name}: pause at {rate_kb} KB/s per connection", stopped and latency < 1,
+                  f"on_pause after {latency:.2f}s{sockets}")
+    return check.failures
+
+
+def bench_mirrors(size_mb, segments, fast_mb, slow_mb, engine_names):
+    """
+    One file from a fast and a slow server (per-connection caps), with and without segment stealing,
+    plus mirrors that must be left out (different file, unreachable) and one that dies mid-download.
+    Returns:
+        int: Number of failed checks.
+    """
+    import async_downloader
+
+    payload = random_payload(size_mb * MB)
+    files = {"file.bin": payload}
+    # Same size, different bytes: its ETag differs, so it must not be used
+    impostor = {"file.bin": random_payload(size_mb * MB)}
+    factories = {"thread": downloader.DownloadEngine, "async": async_downloader.AsyncDownloadEngine}
+    steal_size = class_process.Process.MIN_STEAL_SIZE
+    check = Checks(36)
+
+    with BenchServer(files, rate_per_connection=fast_mb * MB) as fast, \
+            BenchServer(files, rate_per_connection=slow_mb * MB) as slow, \
+            BenchServer(impostor, rate_per_connection=fast_mb * MB) as other:
+        for engine_name in engine_names:
+            print(f"{engine_name} engine, {size_mb} MB, {segments} segments, "
+                  f"servers capped at {fast_mb} (fast) and {slow_mb} (slow) MB/s per connection")
+            dying = BenchServer(dict(files), rate_per_connection=fast_mb * MB).__enter__()
+            cases = [
+                ("fast only", fast, [], True),
+                ("slow only", slow, [], True),
+                ("fast + slow, no stealing", fast, [slow], False),
+                ("fast + slow", fast, [slow], True),
+                ("slow + fast", slow, [fast], True),
+                ("fast + impostor + unreachable", fast, [other, "http://127.0.0.1:9/file.bin"], True),
+                ("fast + mirror that dies", fast, [dying], True),
+            ]
+            times = {}
+            for label, main, mirrors, stealing in cases:
+                servers = [main] + [mirror for mirror in mirrors if isinstance(mirror, BenchServer)]
+                sent_before = [server.httpd.bytes_sent for server in servers]
+                with tempfile.TemporaryDirectory() as work_dir:
+                    use_temp_settings(work_dir, segments=segments, retry_attempts=2, retry_base_delay=0.05)
+                    class_process.Process.MIN_STEAL_SIZE = steal_size if stealing else math.inf
+                    if mirrors and mirrors[0] is dying:
+                        # Every body is cut short, then the file disappears: its ranges must move to the others
+                        dying.drop_connections(1.0, seed=1)
+                        threading.Timer(0.5, dying.httpd.files.clear).start()
+                    engine = factories[engine_name]()
+                    try:
+                        elapsed, results = run_engine(engine, [main.url("file.bin")],
+                                                      [m.url("file.bin") if isinstance(m, BenchServer) else m
+                                                       for m in mirrors])
+                    finally:
+                        engine.close()
+                        class_process.Process.MIN_STEAL_SIZE = steal_size
+                    intact = _intact(work_dir, files, results)
+                times[label] = elapsed
+                sent = [server.httpd.bytes_sent - before for server, before in zip(servers, sent_before)]
+                share = "  ".join(f"{n / MB:5.1f}" for n in sent)
+                check(label, intact == 1, f"{elapsed:6.2f}s  {size_mb / elapsed:6.1f} MB/s  MB per server: {share}"
+                      + ("" if intact else f"  {results[0].get('error')!r}"))
+            dying.__exit__(None, None, None)
+
+            check("stealing beats a static split", times["fast + slow"] < times["fast + slow, no stealing"],
+                  f"{times['fast + slow, no stealing'] / times['fast + slow']:.1f}x faster")
+            # Connections start spread evenly over the two servers, each capped per connection
+            ideal = size_mb / (segments / 2 * (fast_mb + slow_mb))
+            check("fast + slow near both servers' cap", times["fast + slow"] < ideal * 1.15,
+                  f"{times['fast + slow']:.2f}s vs {ideal:.2f}s if no connection ever waited")
+            check("a fast mirror speeds up a slow URL", times["slow + fast"] < times["slow only"] / 2,
+                  f"{times['slow only'] / times['slow + fast']:.1f}x faster")
+    return check.failures
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of `values` (0 < q <= 1), or None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered), max(1, math.ceil(q * len(ordered)))) - 1]
+
+
+def _suite_child(engine_name, urls, overrides, conn):
+    """One measured run in a fresh process, so CPU time and peak RSS belong to this workload only."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        use_temp_settings(work_dir, engine=engine_name, **overrides)
+        engine = downloader.create_engine()
+        cpu_before = time.process_time()
+        elapsed, results = run_engine(engine, urls)
+        cpu = time.process_time() - cpu_before
+        engine.close()
+    # ru_maxrss is in KB on Linux (bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+    if peak is not None and sys.platform == "darwin":
+        peak //= 1024
+    conn.send({"elapsed": elapsed, "cpu": cpu, "peak_rss_kb": peak,
+               "completions": [r["seconds"] for r in results if "size" in r],
+               "failed": sum(1 for r in results if "size" not in r)})
+
+
+def run_workload(name, sizes, engine_name, repeat, overrides, rate_per_connection=None, drop=0.0):
+    """
+    Serves `sizes` from a server process and downloads all of it `repeat` times.
+    Returns:
+        dict: The median run's numbers (by wall time) plus every run's throughput.
+    """
+    total = sum(sizes.values())
+    server, base_url = start_server_process(sizes, rate_per_connection, drop, seed=0)
+    runs = []
+    try:
+        for _ in range(repeat):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            child = multiprocessing.Process(
+                target=_suite_child, args=(engine_name, [base_url + n for n in sizes], overrides, child_conn))
+            child.start()
+            runs.append(parent_conn.recv())
+            child.join()
+    finally:
+        server.terminate()
+
+    runs.sort(key=lambda run: run["elapsed"])
+    run = runs[len(runs) // 2]
+    return {
+        "files": len(sizes),
+        "bytes": total,
+        "throughput_mb_s": total / MB / run["elapsed"],
+        "cpu_s_per_gb": run["cpu"] / (total / (1024 * MB)),
+        "peak_rss_mb": run["peak_rss_kb"] / 1024 if run["peak_rss_kb"] is not None else None,
+        "p50_s": percentile(run["completions"], 0.5),
+        "p99_s": percentile(run["completions"], 0.99),
+        "failed": run["failed"],
+        "throughput_runs": [total / MB / r["elapsed"] for r in runs],
+    }
+
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def bench_suite(workloads, engines, scale, repeat, max_active, rate_mb, drop, save):
+    """
+    Regression suite: each workload on each engine, against a local server process.
+    Reports throughput, client CPU per GB, peak RSS and p50/p99 time to completion, and can save
+    them as JSON for `bench.py compare`.
+    """
+    overrides = {"max_active_downloads": max_active, "max_downloads_per_host": max_active,
+                 "connections_per_host": max_active}
+    config = {"scale": scale, "repeat": repeat, "max_active": max_active, "rate_mb": rate_mb, "drop": drop}
+    report = {"environment": _environment(), "config": config, "results": {}}
+    print(f"scale {scale}, {repeat} run(s) each (median shown), up to {max_active} downloads at once"
+          + (f", {rate_mb} MB/s per connection" if rate_mb else "") + (f", {drop:.0%} bodies dropped" if drop else ""))
+    for name in workloads:
+        sizes = {file_name: max(1, int(size * scale)) for file_name, size in SUITE_WORKLOADS[name].items()}
+        for engine_name in engines:
+            result = run_workload(name, sizes, engine_name, repeat, overrides,
+                                  rate_mb * MB if rate_mb else None, drop)
+            report["results"][f"{name}/{engine_name}"] = result
+            rss = f"{result['peak_rss_mb']:6.1f} MB" if result["peak_rss_mb"] is not None else "   n/a"
+            # No percentiles when every download failed
+            p50, p99 = (f"{result[key]:.3f}s" if result[key] is not None else "n/a" for key in ("p50_s", "p99_s"))
+            print(f"  {name:12} {engine_name:6} {result['files']:4} files {result['bytes'] / MB:7.1f} MB  "
+                  f"{result['throughput_mb_s']:7.1f} MB/s  {result['cpu_s_per_gb']:5.2f} CPU s/GB  "
+                  f"peak RSS {rss}  p50 {p50}  p99 {p99}  failed={result['failed']}")
+
+    if save:
+        path = save if save.endswith(".json") else os.path.join(
+            save, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['environment']['commit'] or 'local'}.json")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"saved {path}")
+    return sum(result["failed"] for result in report["results"].values())
+
+
+def bench_compare(baseline_path, new_path, tolerance):
+    """
+    Compares two saved suite runs metric by metric.
+    Returns:
+        int: Number of metrics that got worse by more than `tolerance` (the exit status).
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if baseline["config"] != new["config"]:
+        print(f"warning: different settings: {baseline['config']} vs {new['config']}")
+    print(f"{baseline['environment'].get('commit')} -> {new['environment'].get('commit')}, "
+          f"tolerance {tolerance:.0%}")
+
+    regressions = 0
+    for key in sorted(set(baseline["results"]) & set(new["results"])):
+        cells = []
+        for metric, direction in SUITE_METRICS.items():
+            old, current = baseline["results"][key].get(metric), new["results"][key].get(metric)
+            if not old or current is None:
+                continue
+            change = current / old - 1
+            worse = change * direction < -tolerance
+            regressions += worse
+            cells.append(f"{metric} {old:.3g} -> {current:.3g} ({change:+.1%}){' REGRESSION' if worse else ''}")
+        print(f"  {key}")
+        for cell in cells:
+            print(f"    {cell}")
+    for key in sorted(set(baseline["results"]) ^ set(new["results"])):
+        print(f"  {key}: only in {'the baseline' if key in baseline['results'] else 'the new run'}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ASPU Download Manager benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("segments", help="1 vs 4 vs 8 segment throughput")
+    p.add_argument("--size-mb", type=int, default=32)
+    p.add_argument("--rate-mb", type=int, default=8, help="per-connection cap in MB/s")
+
+    p = sub.add_parser("resume", help="SIGKILL mid-download, then resume from the journal")
+    p.add_argument("--size-mb", type=int, default=32)
+    p.add_argument("--rate-mb", type=int, default=4, help="per-connection cap in MB/s")
+    p.add_argument("--segments", type=int, default=4)
+
+    p = sub.add_parser("pool", help="many small files, shared session vs a new connection per request")
+    p.add_argument("--count", type=int, default=500)
+    p.add_argument("--size-kb", type=int, default=32)
+    p.add_argument("--workers", type=int, default=8)
+
+    p = sub.add_parser("engines", help="hundreds of concurrent downloads, thread vs asyncio engine")
+    p.add_argument("--count", type=int, default=300)
+    p.add_argument("--size-kb", type=int, default=256)
+    p.add_argument("--rate-kb", type=int, default=256, help="per-connection cap in KB/s")
+
+    p = sub.add_parser("ratelimit", help="achieved vs target rate for global and per-download caps")
+    p.add_argument("--size-mb", type=int, default=8)
+    p.add_argument("--tolerance", type=float, default=0.1)
+
+    p = sub.add_parser("cpu", help="client CPU time per GB, fixed 8 KB vs adaptive chunk sizes")
+    p.add_argument("--size-mb", type=int, default=256)
+    p.add_argument("--rounds", type=int, default=4)
+
+    p = sub.add_parser("history", help="history view startup time, whole JSON file vs first SQLite page")
+    p.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+
+    p = sub.add_parser("verify", help="checksum verification cost and recovery from a corrupted range")
+    p.add_argument("--size-mb", type=int, default=64)
+    p.add_argument("--segments", type=int, default=4)
+    p.add_argument("--piece-kb", type=int, default=1024)
+
+    p = sub.add_parser("faults", help="random dropped connections, 5xx and 429 against both engines")
+    p.add_argument("--count", type=int, default=8)
+    p.add_argument("--size-mb", type=int, default=4)
+    p.add_argument("--drop", type=float, default=0.3, help="chance that a response body is cut short")
+
+    p = sub.add_parser("bulk", help="queue, pause, resume and cancel thousands of downloads at once")
+    p.add_argument("--counts", type=int, nargs="+", default=[1000, 5000, 10000])
+    p.add_argument("--max-active", type=int, default=4)
+    p.add_argument("--engines", nargs="+", choices=["thread", "async"], default=["thread", "async"])
+
+    p = sub.add_parser("lifecycle", help="memory held after many completed downloads, pause latency")
+    p.add_argument("--count", type=int, default=10000)
+    p.add_argument("--retention", type=int, default=lifecycle.DEFAULT_RETENTION)
+    p.add_argument("--engines", nargs="+", choices=["thread", "async"], default=["thread", "async"])
+    p.add_argument("--rate-kb", type=int, default=4, help="per-connection cap of the slow server in KB/s")
+
+    p = sub.add_parser("mirrors", help="one file from fast and slow mirrors, with and without segment stealing")
+    p.add_argument("--size-mb", type=int, default=32)
+    p.add_argument("--segments", type=int, default=4)
+    p.add_argument("--fast-mb", type=int, default=4, help="per-connection cap of the fast server in MB/s")
+    p.add_argument("--slow-mb", type=float, default=0.5, help="per-connection cap of the slow server in MB/s")
+    p.add_argument("--engines", nargs="+", choices=["thread", "async"], default=["thread", "async"])
+
+    p = sub.add_parser("suite", help="regression suite: single large, many small and mixed downloads")
+    p.add_argument("--workloads", nargs="+", choices=list(SUITE_WORKLOADS), default=list(SUITE_WORKLOADS))
+    p.add_argument("--engines", nargs="+", choices=["thread", "async"], default=["thread", "async"])
+    p.add_argument("--scale", type=float, default=1.0, help="multiplies every file size (e.g. 0.1 for a quick run)")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--max-active", type=int, default=16, help="concurrent downloads and connections per host")
+    p.add_argument("--rate-mb", type=int, default=0, help="per-connection cap in MB/s (0 = none)")
+    p.add_argument("--drop", type=float, default=0.0, help="chance that a response body is cut short")
+    p.add_argument("--save", nargs="?", const=RESULTS_DIR, help=f"save results as JSON (default dir: {RESULTS_DIR}/)")
+
+    p = sub.add_parser("compare", help="compare two saved suite runs")
+    p.add_argument("baseline")
+    p.add_argument("new")
+    p.add_argument("--tolerance", type=float, default=0.1, help="relative change tolerated before flagging")
+
+    args = parser.parse_args()
+    if args.bench == "segments":
+        bench_segments(args.size_mb, args.rate_mb)
+    elif args.bench == "resume":
+        bench_resume(args.size_mb, args.rate_mb, args.segments)
+    elif args.bench == "pool":
+        bench_pool(args.count, args.size_kb, args.workers)
+    elif args.bench == "engines":
+        bench_engines(args.count, args.size_kb, args.rate_kb)
+    elif args.bench == "ratelimit":
+        raise SystemExit(bench_ratelimit(args.size_mb, args.tolerance))
+    elif args.bench == "cpu":
+        bench_cpu(args.size_mb, args.rounds)
+    elif args.bench == "history":
+        bench_history(args.sizes)
+    elif args.bench == "verify":
+        bench_verify(args.size_mb, args.segments, args.piece_kb)
+    elif args.bench == "faults":
+        raise SystemExit(bench_faults(args.count, args.size_mb, args.drop))
+    elif args.bench == "bulk":
+        raise SystemExit(bench_bulk(args.counts, args.max_active, args.engines))
+    elif args.bench == "lifecycle":
+        raise SystemExit(bench_lifecycle(args.count, args.retention, args.engines, args.rate_kb))
+    elif args.bench == "mirrors":
+        raise SystemExit(bench_mirrors(args.size_mb, args.segments, args.fast_mb, args.slow_mb, args.engines))
+    elif args.bench == "suite":
+        raise SystemExit(min(255, bench_suite(args.workloads, args.engines, args.scale, args.repeat,
+                                              args.max_active, args.rate_mb, args.drop, args.save)))
+    elif args.bench == "compare":
+        raise SystemExit(min(255, bench_compare(args.baseline, args.new, args.tolerance)))
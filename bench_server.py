@@ -0,0 +1,236 @@
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+"""
+Local HTTP server used by the benchmarks.
+- Serves in-memory files at /<name> and honours single "Range: bytes=a-b" requests (206 / 416).
+- Each connection can be throttled so that several segments actually beat one stream on localhost.
+- Sends an ETag per file and honours If-Range, so resume logic can be checked against content changes.
+- BenchServer.corrupt() flips bytes in the next response covering them, to check checksum verification.
+- BenchServer.fail() answers the next requests with error statuses (e.g. 503, 429 + Retry-After) and
+  drop_connections() cuts bodies off at random offsets, to check retries and reconnects.
+"""
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this keep-alive requests hit delayed-ACK stalls
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        # Keep benchmark output readable
+        pass
+
+    def do_GET(self):
+        payload = self.server.files.get(self.path.lstrip("/"))
+        if payload is None:
+            self.send_error(404)
+            return
+        failure = self.server.take_failure()
+        if failure is not None:
+            status, retry_after = failure
+            self.send_response(status)
+            if retry_after is not None:
+                self.send_header("Retry-After", str(retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        total = len(payload)
+        start, end = 0, total - 1
+        etag = self.server.etag(self.path.lstrip("/"), payload)
+        range_header = self.headers.get("Range")
+        ranged = self.server.accept_ranges and range_header and range_header.startswith("bytes=")
+        if ranged and self.headers.get("If-Range", etag) != etag:
+            # Client's copy is stale: send the whole new file instead of a range
+            ranged = False
+
+        if ranged:
+            first, _, last = range_header[len("bytes="):].partition("-")
+            start = int(first) if first else 0
+            end = min(int(last), total - 1) if last else total - 1
+            if start >= total:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{total}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{total}")
+        else:
+            self.send_response(200)
+
+        if self.server.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self._send_body(self.server.take_corruption(self.path.lstrip("/"), payload, start, end + 1))
+
+    def _send_body(self, body):
+        """Writes the body in blocks, sleeping as needed to respect rate_per_connection."""
+        rate = self.server.rate_per_connection
+        block = 64 * 1024
+        began = time.perf_counter()
+        sent = 0
+        cut = self.server.drop_offset(len(body))
+        if cut is not None:
+            # Send part of the body, then hang up like a flaky network would
+            body = body[:cut]
+            self.close_connection = True
+        try:
+            while sent < len(body):
+                piece = body[sent:sent + block]
+                self.wfile.write(piece)
+                sent += len(piece)
+                self.server.count_sent(len(piece))
+                if rate:
+                    ahead = sent / rate - (time.perf_counter() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            # Client paused, cancelled or finished a probe early
+            pass
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 overflows when many downloads connect at once (SYN retried after 1 s)
+    request_queue_size = 128
+
+    def server_activate(self):
+        super().server_activate()
+        self.bytes_sent = 0
+        self._stats_lock = threading.Lock()
+        self._etags = {}
+        self.corrupt_offsets = {}
+        self.failures = []      # [(status, retry_after), ...] for the next requests
+        self.drop_probability = 0.0
+        self.drops = 0
+        self._random = random.Random()
+
+    def count_sent(self, n):
+        with self._stats_lock:
+            self.bytes_sent += n
+
+    def take_failure(self):
+        with self._stats_lock:
+            return self.failures.pop(0) if self.failures else None
+
+    def drop_offset(self, length):
+        """Where to cut off a body of `length` bytes, or None to send it whole."""
+        with self._stats_lock:
+            if length < 2 or self._random.random() >= self.drop_probability:
+                return None
+            self.drops += 1
+            return self._random.randrange(1, length)
+
+    def take_corruption(self, name, payload, start, stop):
+        """Returns payload[start:stop], with any pending corrupted offsets in it flipped (once)."""
+        body = memoryview(payload)[start:stop]
+        with self._stats_lock:
+            pending = self.corrupt_offsets.get(name, set())
+            hits = [offset for offset in pending if start <= offset < stop]
+            pending.difference_update(hits)
+        if not hits:
+            return body
+        body = bytearray(body)
+        for offset in hits:
+            body[offset - start] ^= 0xFF
+        return memoryview(body)
+
+    def etag(self, name, payload):
+        # Keyed on the object too, so replacing a file's bytes changes its ETag
+        key = (name, id(payload))
+        if key not in self._etags:
+            self._etags[key] = f'"{zlib.crc32(payload):08x}-{len(payload)}"'
+        return self._etags[key]
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections is normal here, not worth a traceback
+        pass
+
+
+class BenchServer:
+    """Runs a RangeRequestHandler server on a background thread."""
+
+    def __init__(self, files, rate_per_connection=None, accept_ranges=True):
+        """
+        Args:
+            files (dict): Maps file name to its bytes content.
+            rate_per_connection (int): Optional bytes/sec cap applied to every connection.
+            accept_ranges (bool): When False the server always answers 200 with the full body.
+        """
+        self.httpd = QuietHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+        self.httpd.files = files
+        self.httpd.rate_per_connection = rate_per_connection
+        self.httpd.accept_ranges = accept_ranges
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def corrupt(self, name, *offsets):
+        """The next response covering each of `offsets` in file `name` carries a flipped byte there."""
+        with self.httpd._stats_lock:
+            self.httpd.corrupt_offsets.setdefault(name, set()).update(offsets)
+
+    def fail(self, *statuses, retry_after=None):
+        """The next len(statuses) requests get these statuses (empty body) instead of the file."""
+        with self.httpd._stats_lock:
+            self.httpd.failures.extend((status, retry_after) for status in statuses)
+
+    def drop_connections(self, probability, seed=None):
+        """Each response body is cut off at a random offset with this probability (0 turns it off)."""
+        with self.httpd._stats_lock:
+            self.httpd.drop_probability = probability
+            self.httpd._random.seed(seed)
+
+    def url(self, name):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}/{name}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def random_payload(size):
+    """Returns `size` bytes of incompressible data."""
+    return os.urandom(size)
+
+
+def _serve_forever(sizes, rate_per_connection, drop, seed, conn):
+    files = {name: random_payload(size) for name, size in sizes.items()}
+    with BenchServer(files, rate_per_connection) as server:
+        server.drop_connections(drop, seed)
+        conn.send(server.url(""))
+        # Runs until the parent terminates this process
+        server.thread.join()
+
+
+def start_server_process(sizes, rate_per_connection=None, drop=0.0, seed=None):
+    """
+    Runs a BenchServer in a child process so its CPU time isn't charged to the client being measured.
+    Args:
+        sizes (dict): Maps file name to the number of random bytes to serve.
+        rate_per_connection (int): Optional bytes/sec cap applied to every connection.
+        drop (float): Chance that a response body is cut off (see BenchServer.drop_connections).
+        seed (int): Seed for the drops, so a faulty run can be repeated exactly.
+    Returns:
+        tuple: (process, base_url). Call process.terminate() when done.
+    """
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=_serve_forever, args=(sizes, rate_per_connection, drop, seed, child_conn), daemon=True)
+    process.start()
+    return process, parent_conn.recv()
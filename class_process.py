@@ -1,9 +1,18 @@
 import os
-from urllib import response 
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from pathlib import Path
 
+import integrity
+import metrics
+import retry
 import storage
+from journal import DownloadJournal
+from partfile import PartFile, ensure_space, allocated_bytes, remove_files
+from ratelimit import TokenBucket, Throttle
+from segments import SegmentPlanner, Source
 
 """
 Process class to handle individual download tasks.
@@ -11,10 +20,24 @@ Each Process instance represents a single download task and manages its own down
 """
 
 class Process:
-    
+
     process_id_counter = 1
-    
-    def __init__(self, url, callbacks):
+    # Segments are never smaller than this, so small files use a single connection
+    MIN_SEGMENT_SIZE = 1024 * 1024
+    # How much a segment writes between two resume journal records
+    JOURNAL_INTERVAL = 1024 * 1024
+    # Rounds of re-fetching pieces that failed checksum verification before giving up (a whole-file
+    # digest gets one re-download, as it can't tell which range is damaged)
+    VERIFY_RETRIES = 2
+    # Failures retried by reconnecting (see retry.py); AsyncProcess adds aiohttp's
+    TRANSIENT_ERRORS = retry.TRANSIENT_ERRORS
+    # Backoff waits are sliced so pause and cancel still answer quickly
+    BACKOFF_SLICE = 0.1
+    # A connection that ran out of work only takes over the rest of another one's range if at least this is left
+    MIN_STEAL_SIZE = 256 * 1024
+
+    def __init__(self, url, callbacks, session=None, global_bucket=None, rate_limit=0, checksum=None,
+                 mirrors=None):
         # Unique Process ID
         self.pid = Process.process_id_counter
         Process.process_id_counter += 1
@@ -24,68 +47,964 @@ class Process:
         self.cancel_requested = False
         # Download attributes
         self.url = url
-        self.callbacks = callbacks        
+        self.callbacks = callbacks
+        # Where the partial data lives, known once the download has started (or carried over from a paused one)
+        self.part_path = None
+        # Other URLs serving the same file; those that match the probe share the ranged download
+        self.mirrors = [mirror for mirror in dict.fromkeys(mirrors or ()) if mirror != url]
+        # Shared keep-alive session from the engine; plain requests opens a new connection per call
+        self.http = session or requests
+        # Bandwidth: the engine-wide budget plus this download's own cap (bytes/sec, 0 = unlimited)
+        self.global_bucket = global_bucket
+        self.rate_bucket = TokenBucket(rate_limit)
+        # Shared progress state (segments update it from several threads)
+        self._lock = threading.Lock()
+        self._downloaded = 0
+        self._total_size = 0
+        self._segment_failed = False
+        self.chunk_size = 0
+        # Streamed responses still open; pause and cancel shut them so no socket waits on a slow server
+        self._responses = set()
+        # Expected checksum: argument ("sha256:<hex>" or integrity.Checksum), else a "#sha256=<hex>" URL fragment
+        if isinstance(checksum, str):
+            checksum = integrity.Checksum.parse(checksum)
+        self.checksum = checksum or integrity.Checksum.from_url(url)
+        self.checksum_sidecar = False
+        self.verifier = None
+        self._verify_rounds = 0
+        self.retry_policy = retry.RetryPolicy()
+        # Measurements (the engine swaps in one tied to its Metrics) and the optional tracing hook
+        self.stats = metrics.DownloadStats()
+        self.tracer = None
 
     def start(self):
         # 1. Set downloading flag
         self.downloading = True
         self.stop_requested = False
         self.cancel_requested = False
+        self.stats.started()
+        # Connections opened on this thread are timed against this download
+        metrics.bind(self)
 
         try:
             # 2. Obtain download parameters
-            filename = self.url.split("/")[-1] or "Untitled" 
-            save_dir = storage.load_settings().get('save_path', os.path.join(Path.home(), "Downloads")) 
-            save_path = os.path.join(save_dir, filename) 
-            existing_size = os.path.getsize(save_path) if os.path.exists(save_path) else 0 
-
-            # 3. Start the download by sending HTTP request
-            headers = {"Range": f"bytes={existing_size}-"}  
-            response = requests.get(self.url, headers=headers, stream=True, timeout=15) 
-            
-            # If server returns 416, it means file is already finished
-            if response.status_code == 416:
-                self.callbacks['on_finish'](filename, save_path, existing_size)
-                return
+            filename, save_path, part_path, journal_path, segments = self._prepare()
+            self.part_path = part_path
+            if self.checksum is None and self.checksum_sidecar:
+                self.checksum = self._fetch_sidecar(filename)
 
-            total_size = int(response.headers.get('content-length', 0)) + existing_size
-            self.callbacks['on_status']("Downloading...")
-
-            # If server returns 206, it means server supports resuming
-            write_mode = 'ab' if response.status_code == 206 else 'wb'
-            downloaded = existing_size if response.status_code == 206 else 0
-
-            # 4. Write the content to file in chunks                
-            with open(save_path, write_mode) as f:
-                for chunk in response.iter_content(chunk_size=1024 * 8):
-                    if self.stop_requested or self.cancel_requested:
-                        break
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if total_size > 0:
-                            percent = (downloaded / total_size) * 100
-                            self.callbacks['on_progress'](percent)
-
-            # 5. Handle completion, pause, or cancellation requests
-            if self.cancel_requested:
-                if os.path.exists(save_path):
-                    os.remove(save_path)
-                self.callbacks['on_cancel']()
-
-            elif self.stop_requested:
-                self.callbacks['on_pause']()
+            # 3. Every download writes into a .part file that is renamed when complete.
+            #    Ranged downloads keep a resume journal; single streams resume by size
+            total_size, accepts_ranges, validator = (0, False, "")
+            if not os.path.exists(save_path) or os.path.exists(part_path):
+                total_size, accepts_ranges, validator = self._probe()
 
+            if self.stop_requested or self.cancel_requested:
+                # Paused or cancelled while waiting to retry the probe
+                total_size = 0
+            elif accepts_ranges and total_size > 0:
+                self._download_ranged(part_path, journal_path, total_size, validator, segments)
             else:
-                self.callbacks['on_finish'](filename, save_path, total_size)
+                if os.path.exists(journal_path):
+                    # A ranged .part is preallocated with holes, so its size says nothing
+                    remove_files(part_path, journal_path)
+                total_size = self._download_single(save_path, part_path)
+
+            # 4. Handle completion, pause, or cancellation requests
+            self._finish(filename, save_path, part_path, journal_path, total_size)
 
         except Exception as e:
+            self._ended("error", str(e))
             self.callbacks['on_error'](str(e))
         finally:
+            metrics.bind(None)
+            self._close_verifier()
             self.downloading = False
+            self._cancelled_after_end()
+
+    def _prepare(self):
+        """
+        Works out where the download goes from the current settings.
+        Returns:
+            tuple: (filename, save_path, part_path, journal_path, segments)
+        """
+        settings = storage.settings.snapshot()
+        filename = integrity.strip_fragment(self.url).split("/")[-1] or "Untitled"
+        save_dir = settings.get('save_path', os.path.join(Path.home(), "Downloads"))
+        save_path = os.path.join(save_dir, filename)
+        part_path = save_path + ".part"
+        segments = max(1, int(settings.get('segments', 4)))
+        # 0 = adapt the read size to the measured speed
+        self.chunk_size = int(settings.get('chunk_size', 0))
+        self.checksum_sidecar = bool(settings.get('checksum_sidecar', False))
+        self.retry_policy = retry.RetryPolicy.from_settings(settings)
+        return filename, save_path, part_path, part_path + ".journal", segments
+
+    def _finish(self, filename, save_path, part_path, journal_path, total_size):
+        """Reports the outcome through the callbacks. total_size is None when the server had nothing left to send."""
+        if total_size is None:
+            if not os.path.exists(part_path) and not os.path.exists(save_path):
+                # An empty remote file answers every range with 416: nothing to fetch, but a file to save
+                open(part_path, "wb").close()
+            # Server says the file is already complete; it is still checked if a checksum is known
+            self._verify_existing(part_path if os.path.exists(part_path) else save_path)
+            self._complete(part_path, save_path, journal_path)
+            self._ended("finished")
+            self.callbacks['on_finish'](filename, save_path, os.path.getsize(save_path))
+
+        elif self.cancel_requested:
+            remove_files(part_path, journal_path)
+            self._ended("cancelled")
+            self.callbacks['on_cancel']()
+
+        elif self.stop_requested:
+            self._ended("paused")
+            self.callbacks['on_pause']()
+
+        else:
+            self._complete(part_path, save_path, journal_path)
+            self._ended("finished")
+            self.callbacks['on_finish'](filename, save_path, total_size)
+
+    def _ended(self, outcome, error=None):
+        self.stats.ended(outcome, error)
+        if self.tracer is not None:
+            self.tracer("end", self, outcome)
+
+    def _get(self, headers, url=None):
+        """Sends a streamed GET for this download's URL (or a mirror's), timing it up to the response headers."""
+        began = time.perf_counter()
+        response = self.http.get(url or self.url, headers=headers, stream=True, timeout=15)
+        self._responded(time.perf_counter() - began)
+        with self._lock:
+            self._responses.add(response)
+        return response
+
+    def _release(self, response):
+        """Closes a response from _get (a no-op for one whose connection already went back to the pool)."""
+        with self._lock:
+            self._responses.discard(response)
+        response.close()
+
+    def _close_responses(self):
+        """Shuts the sockets of the open responses, so a read blocked on a slow server returns at once."""
+        with self._lock:
+            for response in self._responses:
+                try:
+                    response.raw.shutdown()
+                except (ValueError, RuntimeError, OSError):
+                    # Already closed, or its connection is back in the pool
+                    pass
+
+    def _responded(self, seconds):
+        self.stats.request(seconds)
+        if self.tracer is not None:
+            self.tracer("request", self, seconds)
+
+    def connected(self, seconds):
+        """A new connection for this download took `seconds` to set up (see metrics.bind)."""
+        self.stats.connected(seconds)
+        if self.tracer is not None:
+            self.tracer("connect", self, seconds)
+
+    def _complete(self, part_path, save_path, journal_path):
+        # Atomic on the same filesystem: save_path is either the old file or the whole new one
+        if os.path.exists(part_path):
+            os.replace(part_path, save_path)
+        remove_files(journal_path)
+
+    def _fetch_sidecar(self, filename):
+        """
+        Looks for a published checksum next to the file (<url>.meta4, .sha256, .md5).
+        Returns:
+            integrity.Checksum or None.
+        """
+        for suffix, url in integrity.sidecar_urls(self.url):
+            try:
+                response = self.http.get(url, timeout=15)
+            except requests.RequestException:
+                return None
+            if response.status_code == 200:
+                checksum = integrity.parse_sidecar(suffix, response.text, filename)
+                if checksum is not None:
+                    return checksum
+        return None
+
+    def _open_verifier(self, part_path, total_size, on_disk=()):
+        """Starts verification for this attempt (no-op without a checksum); on_disk data is hashed first."""
+        self._close_verifier()
+        if self.checksum is not None:
+            self.verifier = integrity.Verifier(self.checksum, part_path, total_size)
+            self.verifier.add_on_disk(on_disk)
+        return self.verifier
+
+    def _close_verifier(self):
+        if self.verifier is not None:
+            self.verifier.close()
+            self.verifier = None
+
+    def _verify_existing(self, path):
+        """Checks a file that was already complete on disk (nothing was streamed through the hashers)."""
+        if self.checksum is None:
+            return
+        size = os.path.getsize(path)
+        self.callbacks['on_status']("Verifying...")
+        verifier = self._open_verifier(path, size, [(0, size)])
+        bad = verifier.finish(size)
+        if bad:
+            raise IOError(verifier.describe_failure(bad))
+
+    def _verify_single(self, part_path, size):
+        """
+        Checks a finished single-stream download; a bad file is removed so it is fetched again from the start.
+        Returns:
+            bool: True when done (verified, nothing to verify, paused or cancelled), False when the file
+                  was removed and has to be downloaded once more.
+        """
+        if self.verifier is None or self.stop_requested or self.cancel_requested:
+            return True
+        self.callbacks['on_status']("Verifying...")
+        bad = self.verifier.finish(size)
+        if not bad:
+            return True
+        message = self.verifier.describe_failure(bad)
+        self._close_verifier()
+        remove_files(part_path)
+        self._verify_rounds += 1
+        # A single stream can only fetch the whole file again: once is enough to rule out a bad transfer
+        if self._verify_rounds > 1:
+            raise integrity.ChecksumMismatch(message)
+        self.callbacks['on_status']("Checksum mismatch, downloading again...")
+        return False
+
+    def _verify_ranged(self, journal):
+        """
+        Checks a finished ranged download against the expected checksum.
+        Returns:
+            bool: True when done (verified, nothing to verify, paused or cancelled), False when damaged
+                  ranges were dropped from the journal and have to be fetched again.
+        """
+        if self.verifier is None or self.stop_requested or self.cancel_requested:
+            return True
+        self.callbacks['on_status']("Verifying...")
+        bad = self.verifier.finish()
+        if not bad:
+            return True
+
+        message = self.verifier.describe_failure(bad)
+        self._verify_rounds += 1
+        # Without piece hashes the damage can't be localised and every round re-fetches the whole file
+        retries = Process.VERIFY_RETRIES if self.checksum.pieces else 1
+        if self._verify_rounds > retries:
+            # The caller removes the .part file and journal once they are closed, as a single stream does
+            raise integrity.ChecksumMismatch(message)
+        journal.invalidate(bad)
+        self.verifier.reset(bad)
+        with self._lock:
+            self._downloaded = journal.completed_bytes()
+        self.callbacks['on_status'](f"Re-fetching {len(bad)} damaged range(s)...")
+        return False
+
+    def _retry_delay(self, state, error, progressed):
+        """
+        Decides whether a failed connection is opened again.
+        Args:
+            state (retry.RetryState): Failure count of that connection.
+            error (Exception): What the attempt raised.
+            progressed (bool): True if the attempt wrote any bytes before failing.
+        Returns:
+            float: Seconds to back off before reconnecting (both engines wait through their _backoff).
+        Raises:
+            Exception: `error` itself, when the connection is given up.
+        """
+        if self.stop_requested or self.cancel_requested:
+            # The connection was going away anyway; the caller's loop ends on the flags
+            return 0.0
+        if self._segment_failed or not isinstance(error, self.TRANSIENT_ERRORS):
+            raise error
+        delay = state.next_delay(error, progressed)
+        if delay is None:
+            raise error
+        self.stats.retried()
+        if self.tracer is not None:
+            self.tracer("retry", self, delay)
+        self.callbacks['on_status'](f"{retry.describe(error)}, retrying in {delay:.1f}s "
+                                    f"({state.failures}/{state.policy.attempts})...")
+        return delay
+
+    def _halted(self):
+        """True once the transfers of this download should stop: paused, cancelled, or a segment failed for good."""
+        return self.stop_requested or self.cancel_requested or self._segment_failed
+
+    def _backoff(self, delay):
+        """Sleeps `delay` seconds, waking early if the download is paused, cancelled or failed."""
+        deadline = time.monotonic() + delay
+        while not self._halted():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return
+            time.sleep(min(left, Process.BACKOFF_SLICE))
+
+    def _probe(self):
+        """
+        Asks the server for the first byte to learn the file size, range support and validator.
+        Busy servers and network errors are retried; a pause or cancel during the wait returns (0, False, "").
+        Returns:
+            tuple: (total_size, accepts_ranges, validator). total_size is 0 when unknown.
+        """
+        state = retry.RetryState(self.retry_policy)
+        while not (self.stop_requested or self.cancel_requested):
+            try:
+                return self._probe_once()
+            except Exception as e:
+                self._backoff(self._retry_delay(state, e, False))
+        return 0, False, ""
+
+    def _probe_once(self, url=None):
+        response = self._get({"Range": "bytes=0-0"}, url)
+        try:
+            result = Process.probe_reply(response.status_code, response.headers)
+            if result[1]:
+                # Reading the one-byte body lets the connection go back to the pool
+                response.content
+            return result
+        finally:
+            self._release(response)
+
+    def _probe_mirrors(self, total_size, validator):
+        """
+        Probes each mirror once and keeps those serving the same file (see mirror_matches).
+        An unreachable mirror is left out rather than retried: the main URL carries the download anyway.
+        Returns:
+            list: segments.Source objects, the main URL first.
+        """
+        results = []
+        for url in self.mirrors:
+            if self.stop_requested or self.cancel_requested:
+                break
+            try:
+                results.append(self._probe_once(url))
+            except Exception as e:
+                results.append(e)
+        return self._mirror_sources(total_size, validator, results)
+
+    def _mirror_sources(self, total_size, validator, results):
+        """
+        Args:
+            results (list): Probe result (or the exception it raised) of each mirror, in self.mirrors order.
+        Returns:
+            list: segments.Source objects, the main URL first, then the mirrors serving the same file.
+        """
+        sources = [Source(self.url, validator)]
+        for url, result in zip(self.mirrors, results):
+            if not isinstance(result, BaseException) and self.mirror_matches(total_size, validator, *result):
+                sources.append(Source(url, result[2]))
+        return sources
+
+    def mirror_matches(self, total_size, validator, size, accepts_ranges, mirror_validator):
+        """
+        Whether a mirror's probe describes the same file as the main URL's: same size, range support and,
+        when both send strong ETags, the same ETag. With a known checksum a differing ETag is allowed
+        (servers often derive it from inode or mtime); the verifier then catches a different file.
+        """
+        if size != total_size or not accepts_ranges:
+            return False
+        if Process._strong_etag(validator) and Process._strong_etag(mirror_validator) and validator != mirror_validator:
+            return self.checksum is not None
+        return True
+
+    @staticmethod
+    def _strong_etag(validator):
+        # parse_probe falls back to Last-Modified, which differs between servers and is not compared
+        return validator.startswith('"')
+
+    @staticmethod
+    def probe_reply(status_code, headers):
+        """Checks the reply to a "Range: bytes=0-0" probe (416: the file is empty) and parses it as parse_probe."""
+        retry.check_status(status_code, headers, (200, 206, 416))
+        return Process.parse_probe(status_code, headers)
+
+    @staticmethod
+    def parse_probe(status_code, headers):
+        """Extracts (total_size, accepts_ranges, validator) from the reply to a "Range: bytes=0-0" request."""
+        # Prefer a strong ETag; weak ones can't be used with If-Range
+        etag = headers.get('etag', '')
+        validator = etag if etag and not etag.startswith('W/') else headers.get('last-modified', etag)
+
+        # "Content-Range: bytes 0-0/12345" carries the full size
+        content_range = headers.get('content-range', '')
+        if status_code == 206 and '/' in content_range:
+            size = content_range.rsplit('/', 1)[-1]
+            return (int(size), True, validator) if size.isdigit() else (0, False, validator)
+        return int(headers.get('content-length', 0)), False, validator
+
+    def _download_single(self, save_path, part_path, resume=True):
+        """
+        Downloads the file over one HTTP stream into part_path, appending to any partial file.
+        A dropped stream is reopened from the last byte written (from the start if the server can't resume).
+        Args:
+            resume (bool): False to ignore any partial file (the re-download after a checksum mismatch).
+        Returns:
+            int: The total file size, or None if the file was already complete.
+        """
+        source, existing_size = self._single_resume_point(save_path, part_path) if resume else (part_path, 0)
+        state = retry.RetryState(self.retry_policy)
+        writer = None
+        total_size = 0
+        try:
+            while not (self.stop_requested or self.cancel_requested):
+                position = existing_size if writer is None else writer.position
+                try:
+                    response = self._get({"Range": f"bytes={position}-"})
+                    try:
+                        action, size = self._single_reply(writer, existing_size, response.status_code,
+                                                          response.headers)
+                        if action == "complete":
+                            return None
+                        if action == "end":
+                            break
+                        if action == "restart":
+                            writer.close()
+                            writer, source, existing_size = None, part_path, 0
+                        if writer is None:
+                            total_size = size
+                            writer = self._open_single(source, part_path, response.status_code == 206,
+                                                       existing_size, total_size)
+                        self.callbacks['on_status']("Downloading...")
+
+                        # Write the content to file in chunks
+                        for chunk in self._iter_body(response):
+                            if self.stop_requested or self.cancel_requested:
+                                break
+                            delay = writer.write(chunk)
+                            if delay:
+                                time.sleep(delay)
+                        else:
+                            break
+                    finally:
+                        self._release(response)
+                except Exception as e:
+                    self._backoff(self._retry_delay(state, e, writer is not None and writer.position > position))
+        finally:
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            # Paused or cancelled before the server sent anything
+            return 0
+        if not self._verify_single(part_path, writer.position):
+            return self._download_single(save_path, part_path, resume=False)
+        # A chunked reply has no Content-Length: what was written is the size
+        return total_size or writer.position
+
+    @staticmethod
+    def _single_reply(writer, existing_size, status_code, headers):
+        """
+        Decides what a single-stream download does with the reply to its "Range: bytes=<position>-" request.
+        Args:
+            writer (SegmentWriter): The writer so far, or None before the first reply.
+            existing_size (int): Bytes of partial data the first request resumes from.
+        Returns:
+            tuple: (action, total_size). action is one of
+                   "complete": nothing to fetch (416 before any data), the file is already whole;
+                   "end": a reconnect came after the last byte (416), only the end of the reply was lost;
+                   "restart": a reconnect got the whole file again (200), rewrite it with a new writer;
+                   "open": the first reply, open a writer (appending if 206) for a file of total_size bytes;
+                   "continue": the reconnect resumed (206), keep writing with the same writer.
+                   total_size is only set for "open" and "restart".
+        """
+        if status_code == 416:
+            if writer is None:
+                return "complete", None
+            Process._check_resumed_at_end(writer, headers)
+            return "end", None
+        retry.check_status(status_code, headers)
+        if writer is not None and status_code == 206:
+            return "continue", None
+        length = int(headers.get('content-length', 0))
+        if writer is not None:
+            return "restart", length
+        # 206: the server supports resuming from existing_size
+        return "open", length + (existing_size if status_code == 206 else 0)
+
+    @staticmethod
+    def _check_resumed_at_end(writer, headers):
+        """Raises unless a 416 to a reconnect says the file ends exactly where the writer is."""
+        if Process.range_total(headers) != writer.position:
+            raise IOError(f"Server refused to resume at byte {writer.position} (HTTP 416)")
+
+    @staticmethod
+    def range_total(headers):
+        """Full size from a 416's "Content-Range: bytes */12345", or None if it doesn't say."""
+        content_range = headers.get('content-range', '')
+        size = content_range.rsplit('/', 1)[-1]
+        return int(size) if '/' in content_range and size.isdigit() else None
+
+    @staticmethod
+    def _single_resume_point(save_path, part_path):
+        """
+        Returns:
+            tuple: (path, size) of the partial data to continue: the .part file, or a file an older
+                   version wrote in place under the final name.
+        """
+        source = part_path if os.path.exists(part_path) else save_path
+        return source, os.path.getsize(source) if os.path.exists(source) else 0
+
+    def _open_single(self, source, part_path, resuming, existing_size, total_size):
+        """Prepares progress counters and a writer that appends to (206) or rewrites (200) the .part file."""
+        if not resuming:
+            existing_size = 0
+        elif source != part_path and os.path.exists(source):
+            # Carry on in the .part file from where the older in-place download stopped
+            os.replace(source, part_path)
+
+        part_file = PartFile(part_path)
+        try:
+            if not resuming:
+                part_file.truncate()
+            # A single stream can't be preallocated (its size is its resume point), but it can fail early
+            ensure_space(part_path, total_size - existing_size)
+        except Exception:
+            part_file.close()
+            raise
+        self._downloaded = existing_size
+        self._total_size = total_size
+        self._open_verifier(part_path, total_size, [(0, existing_size)])
+        return SegmentWriter(self, part_file, None, existing_size, close_file=True)
+
+    def _iter_body(self, response):
+        """
+        Yields the body of a streamed requests response in reads sized by a ChunkSizer.
+        Reading response.raw directly avoids iter_content's fixed chunk size.
+        """
+        sizer = self.chunk_sizer()
+        read = response.raw.read
+        while True:
+            chunk = read(sizer.size, decode_content=True)
+            if not chunk:
+                # Whole body read: hand the connection back to the pool instead of closing it.
+                # Under the lock, so a pause can't shut it down once another download may be using it
+                with self._lock:
+                    self._responses.discard(response)
+                    response.raw.release_conn()
+                return
+            sizer.update(len(chunk))
+            yield chunk
+
+    def _download_ranged(self, part_path, journal_path, total_size, validator, segments):
+        """
+        Fetches the byte ranges the journal doesn't have yet, in parallel, into a preallocated .part file.
+        Connections are spread over the URL and its matching mirrors; one that runs out of work takes
+        over part of the slowest remaining range (see segments.py).
+        Args:
+            part_path (str): File receiving the data until the download completes.
+            journal_path (str): Resume journal kept next to the .part file.
+            total_size (int): Size reported by the server.
+            validator (str): ETag or Last-Modified reported by the server.
+            segments (int): Number of parallel connections to use (at least one per source).
+        """
+        journal, part_file = self._open_journal(part_path, journal_path, total_size, validator)
+        damaged = False
+        try:
+            sources = self._probe_mirrors(total_size, validator)
+            self._report_sources(sources)
+            verifier = self._open_verifier(part_path, total_size, journal.completed)
+            verified = False
+            while not verified:
+                planner, connections = self._plan_round(journal, sources, segments, verifier)
+                # Each download gets its own small pool; sharing the engine pool could deadlock it
+                errors = []
+                with ThreadPoolExecutor(max_workers=max(1, connections)) as pool:
+                    futures = [pool.submit(self._run_connection, planner, part_file, journal)
+                               for _ in range(connections)]
+                    for future in futures:
+                        try:
+                            future.result()
+                        except Exception as e:
+                            errors.append(e)
+                self._end_round(journal, errors)
+                verified = self._verify_ranged(journal)
+        except integrity.ChecksumMismatch:
+            damaged = True
+            raise
+        finally:
+            part_file.close()
+            journal.close()
+            if damaged:
+                remove_files(part_path, journal_path)
+
+    def _open_journal(self, part_path, journal_path, total_size, validator):
+        """
+        Opens (or resets) the resume journal and the preallocated .part file, and primes the progress counters.
+        Returns:
+            tuple: (journal, part_file) shared by all segments of the download.
+        """
+        # A journal is only trustworthy together with its preallocated .part file
+        if not os.path.exists(part_path) or os.path.getsize(part_path) != total_size:
+            remove_files(journal_path)
+
+        # Fail before creating anything; blocks the .part file already holds are reused (or freed by a reset)
+        ensure_space(part_path, total_size - allocated_bytes(part_path))
+
+        journal, resumed = DownloadJournal.open(journal_path, total_size, validator)
+        part_file = None
+        try:
+            part_file = PartFile(part_path)
+            if not resumed:
+                # New download, or the remote file changed: start over cleanly
+                part_file.preallocate(total_size)
+        except Exception:
+            if part_file is not None:
+                part_file.close()
+            journal.close()
+            raise
+
+        self._downloaded = journal.completed_bytes()
+        self._total_size = total_size
+        self._segment_failed = False
+        self.callbacks['on_status']("Downloading...")
+        return journal, part_file
+
+    def _report_sources(self, sources):
+        if len(sources) > 1:
+            self.callbacks['on_status'](f"Downloading from {len(sources)} sources...")
+
+    def _plan_round(self, journal, sources, segments, verifier):
+        """
+        Spreads what the journal is still missing over the connections of one round of a ranged download
+        (the first fetch, or a re-fetch of ranges that failed verification).
+        Returns:
+            tuple: (planner, connections): the SegmentPlanner they share and how many to run.
+        """
+        alignment = verifier.alignment if verifier else 0
+        ranges = Process.plan_ranges(journal.missing_ranges(), max(segments, len(sources)), alignment)
+        return SegmentPlanner(ranges, sources, alignment, self.MIN_STEAL_SIZE), len(ranges)
+
+    def _end_round(self, journal, errors):
+        """Raises the first error of the round's connections, or if they left part of the file unfetched."""
+        if errors:
+            raise errors[0]
+        if not (self.stop_requested or self.cancel_requested) and journal.missing_ranges():
+            raise IOError(f"Connection closed early ({journal.completed_bytes()} of {journal.total_size} bytes)")
+
+    def _run_connection(self, planner, part_file, journal):
+        """One connection of a ranged download: fetches the ranges the planner hands out until none are left."""
+        metrics.bind(self)
+        try:
+            assignment = None
+            while not self._halted():
+                assignment = planner.take(assignment)
+                if assignment is None:
+                    return
+                self._fetch_segment(planner, assignment, part_file, journal)
+        except Exception:
+            # Tell the sibling segments to stop early
+            self._segment_failed = True
+            raise
+        finally:
+            metrics.bind(None)
+
+    def _fetch_segment(self, planner, assignment, part_file, journal):
+        """
+        Downloads the assigned range from its source and writes it at its offset, journaling what is on disk.
+        A dropped connection is reopened from the last byte written, with backoff (see retry.py). A source
+        that fails for good is dropped and the rest of the range goes back to the planner, unless it was the last.
+        """
+        state = retry.RetryState(self.retry_policy)
+        with SegmentWriter(self, part_file, journal, assignment.start, assignment.stop) as writer:
+            planner.begin(assignment, writer)
+            try:
+                while writer.position < writer.stop and not self._halted():
+                    position = writer.position
+                    try:
+                        self._stream_range(writer, assignment.source)
+                    except Exception as e:
+                        self._backoff(self._retry_delay(state, e, writer.position > position))
+            except Exception as e:
+                self._source_failed(planner, assignment, e)
+            else:
+                planner.finish(assignment)
+
+    def _source_failed(self, planner, assignment, error):
+        """Hands the rest of a range whose source gave up back to the planner; re-raises if no source is left."""
+        if not planner.fail(assignment):
+            raise error
+        self.callbacks['on_status'](f"Gave up on {assignment.source.url} ({error}), using the other sources...")
+
+    def _stream_range(self, writer, source):
+        """One connection's worth of _fetch_segment: bytes [writer.position, writer.stop) until done or dropped."""
+        start, stop = writer.position, writer.stop
+        response = self._get(Process.range_headers(start, stop, source.validator), source.url)
+        try:
+            Process.range_reply(start, stop, response.status_code, response.headers)
+            for chunk in self._iter_body(response):
+                if self._halted():
+                    return
+                delay = writer.write(chunk)
+                if Process.range_taken(writer, stop):
+                    # Another connection took over the rest; the unread body goes with the connection
+                    return
+                if delay:
+                    time.sleep(delay)
+        finally:
+            self._release(response)
+        Process.check_range_end(writer, start, stop)
+
+    def throttle(self):
+        """Returns a fresh Throttle for one connection of this download."""
+        return Throttle(self.global_bucket, self.rate_bucket)
+
+    def chunk_sizer(self):
+        """Returns a fresh ChunkSizer for one connection, fixed if the chunk_size setting is non-zero."""
+        return ChunkSizer(self.chunk_size)
+
+    @property
+    def downloaded(self):
+        """Bytes on disk so far; read by progress.ProgressTracker without any callback."""
+        return self._downloaded
+
+    @property
+    def total_size(self):
+        return self._total_size
+
+    def _add_progress(self, size):
+        """Counts `size` new bytes and, if the caller asked for on_progress, reports the overall percentage."""
+        with self._lock:
+            self._downloaded += size
+            on_progress = self.callbacks.get('on_progress')
+            if on_progress is None or not self._total_size:
+                return
+            percent = (self._downloaded / self._total_size) * 100
+        on_progress(percent)
+
+    @staticmethod
+    def range_headers(start, stop, validator):
+        headers = {"Range": f"bytes={start}-{stop - 1}"}
+        if validator and not validator.startswith('W/'):
+            # Makes the server send 200 instead of mixing bytes from a changed file
+            headers["If-Range"] = validator
+        return headers
+
+    @staticmethod
+    def range_reply(start, stop, status_code, headers):
+        """Raises unless the reply to a range request carries exactly that range (206)."""
+        retry.check_status(status_code, headers)
+        if status_code != 206:
+            raise IOError(f"Server did not return range {start}-{stop - 1} (HTTP {status_code}); "
+                          "the file may have changed")
+
+    @staticmethod
+    def range_taken(writer, stop):
+        """True once the writer reached a stop that another connection moved down from `stop` (a steal)."""
+        return writer.stop < stop and writer.position >= writer.stop
+
+    @staticmethod
+    def check_range_end(writer, start, stop):
+        """Raises if a range's reply ended before the writer got to its stop."""
+        if writer.position < writer.stop:
+            raise ConnectionError(f"Connection closed at byte {writer.position} of range {start}-{stop - 1}")
+
+    @staticmethod
+    def plan_ranges(missing, segments, alignment=0):
+        """
+        Spreads `segments` connections over the missing half-open byte ranges, proportionally to their size.
+        Args:
+            alignment (int): If set, inner boundaries are rounded up to multiples of it (checksum pieces),
+                             so each piece is written, and hashed, by a single connection.
+        Returns:
+            list: [(start, stop), ...] pieces covering exactly the missing bytes.
+        """
+        remaining = sum(stop - start for start, stop in missing)
+        pieces = []
+        for start, stop in missing:
+            length = stop - start
+            count = max(1, min(round(segments * length / remaining), length // Process.MIN_SEGMENT_SIZE))
+            step = length // count
+            for i in range(count):
+                piece_stop = stop if i == count - 1 else start + step
+                if alignment:
+                    piece_stop = min(stop, -(-piece_stop // alignment) * alignment)
+                if piece_stop > start:
+                    pieces.append((start, piece_stop))
+                start = piece_stop
+        return pieces
+
+    def remove_partial(self):
+        """Deletes the .part file and journal of a download that isn't running (cancelled while paused or queued)."""
+        if self.part_path is not None:
+            remove_files(self.part_path, self.part_path + ".journal")
+
+    def _cancelled_after_end(self):
+        """
+        Cleans up for a cancel that came after on_pause / on_error but before `downloading` was cleared:
+        the engine saw a running download and left the files to the transfer, which had already finished.
+        """
+        if self.cancel_requested and self.stats.outcome in ("paused", "error"):
+            self.remove_partial()
 
     def pause(self):
         self.stop_requested = True
+        self._close_responses()
 
     def cancel(self):
-        self.cancel_requested = True
\ No newline at end of file
+        self.cancel_requested = True
+        self._close_responses()
+
+
+class SegmentWriter:
+    """
+    Writes one segment's bytes at their offset in the .part file (positional writes, so all segments
+    share one descriptor) and journals them once written.
+    Shared by the thread and asyncio engines so both keep the same on-disk guarantees.
+    - Small reads are gathered in a reusable buffer so the disk sees few, large writes; reads at
+      least as large as the buffer (fast links, see ChunkSizer) go straight to the file.
+    - write() returns how long the caller should wait to stay within the bandwidth limits.
+    - With no journal and no stop it is a plain buffered appender (single-stream downloads).
+    """
+
+    # Per connection, so kept modest for the asyncio engine's hundreds of transfers
+    BUFFER_SIZE = 256 * 1024
+
+    def __init__(self, process, part_file, journal, start, stop=None, close_file=False):
+        """
+        Args:
+            process (Process): Download whose counters and bandwidth limits apply.
+            part_file (PartFile): Destination; closed on exit only if close_file is True.
+            journal (DownloadJournal): Receives a record per JOURNAL_INTERVAL written, or None.
+            start (int): Offset of the first byte.
+            stop (int): Offset just past the segment, or None for "until the stream ends".
+        """
+        self.process = process
+        self.journal = journal
+        self.stop = stop
+        self.position = self.committed = start
+        # stop and position change together: split() runs on the connection that takes over the rest
+        self._lock = threading.Lock()
+        self.throttle = process.throttle()
+        # Allocated on the first small read only
+        self.buffer = None
+        self.buffered = 0
+        # Unbuffered: SegmentWriter does its own buffering
+        self.file = part_file
+        self.close_file = close_file
+        self.offset = start
+
+    def write(self, chunk):
+        size = len(chunk)
+        with self._lock:
+            if self.stop is not None and size > self.stop - self.position:
+                # Never write past the segment, even if the server sends too much (or the rest was split off)
+                size = self.stop - self.position
+                chunk = memoryview(chunk)[:size]
+            self.position += size
+
+        if self.buffered + size > SegmentWriter.BUFFER_SIZE:
+            self._drain()
+        if size >= SegmentWriter.BUFFER_SIZE:
+            self._write_all(chunk)
+        else:
+            if self.buffer is None:
+                self.buffer = memoryview(bytearray(SegmentWriter.BUFFER_SIZE))
+            self.buffer[self.buffered:self.buffered + size] = chunk
+            self.buffered += size
+
+        self.process._add_progress(size)
+        if self.process.tracer is not None:
+            self.process.tracer("chunk", self.process, size)
+        if self.position - self.committed >= Process.JOURNAL_INTERVAL:
+            self._commit()
+        return self.throttle.consume(size)
+
+    def flushes(self, size):
+        """True if write() of `size` bytes would reach the disk (pwrite, hashing, journal) instead of the buffer."""
+        return (self.buffered + size > SegmentWriter.BUFFER_SIZE or size >= SegmentWriter.BUFFER_SIZE
+                or self.position + size - self.committed >= Process.JOURNAL_INTERVAL)
+
+    def split(self, at, alignment=0):
+        """
+        Ends the segment early so another connection can fetch the rest.
+        Args:
+            at (int): Wanted new end; moved up past what was already written, then to a multiple of alignment.
+        Returns:
+            int: The new end. [returned value, old stop) now belongs to the caller (empty if nothing was left).
+        """
+        with self._lock:
+            at = max(at, self.position)
+            if alignment:
+                at = -(-at // alignment) * alignment
+            self.stop = min(self.stop, at)
+            return self.stop
+
+    def _drain(self):
+        if self.buffered:
+            self._write_all(self.buffer[:self.buffered])
+            self.buffered = 0
+
+    def _write_all(self, data):
+        began = time.perf_counter()
+        self.file.pwrite(data, self.offset)
+        elapsed = time.perf_counter() - began
+        self.process.stats.wrote(len(data), elapsed)
+        if self.process.tracer is not None:
+            self.process.tracer("write", self.process, elapsed)
+        if self.process.verifier is not None:
+            # Hashed while it is still in hand, on this connection's thread
+            self.process.verifier.feed(self.offset, data)
+        self.offset += len(data)
+
+    def _commit(self):
+        # Data must reach the OS before the journal claims it
+        self._drain()
+        if self.journal is not None:
+            self.journal.record(self.committed, self.position)
+        self.committed = self.position
+        verifier = self.process.verifier
+        if verifier is not None and verifier.ordered:
+            # Hash what other segments wrote ahead of the whole-file hash cursor, if no one else is
+            verifier.catch_up(blocking=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        try:
+            self._commit()
+        finally:
+            if self.close_file:
+                self.file.close()
+
+
+class ChunkSizer:
+    """
+    Picks the next read size from the measured throughput of one connection: about 10 ms of data
+    per read, so fast links do few large reads and slow links still report progress and notice pauses.
+    """
+
+    MIN_SIZE = 16 * 1024
+    MAX_SIZE = 4 * 1024 * 1024
+    # How often the size is re-evaluated
+    WINDOW = 0.25
+
+    def __init__(self, fixed_size=0):
+        self.fixed = fixed_size > 0
+        self.size = fixed_size if self.fixed else ChunkSizer.MIN_SIZE
+        self._bytes = 0
+        self._since = time.monotonic()
+
+    def update(self, amount):
+        if self.fixed:
+            return
+        self._bytes += amount
+        now = time.monotonic()
+        elapsed = now - self._since
+        if elapsed >= ChunkSizer.WINDOW:
+            ideal = self._bytes / elapsed / 100
+            # Round down to a power of two so sizes don't jitter between windows
+            size = ChunkSizer.MIN_SIZE
+            while size * 2 <= min(ideal, ChunkSizer.MAX_SIZE):
+                size *= 2
+            self.size = size
+            self._bytes = 0
+            self._since = now
@@ -0,0 +1,188 @@
+import argparse
+import json
+import signal
+import sys
+import threading
+import time
+
+import requests
+
+# Import custom logic modules
+import daemon
+import downloader
+import progress
+import storage
+
+"""
+Command-line entry point for headless use (no Tk display needed).
+- `python cli.py daemon` runs the download daemon and its local control API.
+- `python cli.py batch urls.txt` downloads every URL in a list at full concurrency and exits.
+- `python cli.py add | pause | resume | cancel | priority | list | stats | metrics | watch` control a running daemon.
+"""
+
+# Batch mode prints a one-line summary this often
+REPORT_SECONDS = 1.0
+
+
+def read_url_list(path):
+    """
+    Reads one URL per line; blank lines and lines starting with # are skipped, repeats are dropped.
+    Args:
+        path (str): File name, or "-" for standard input.
+    """
+    stream = sys.stdin if path == "-" else open(path, "r")
+    try:
+        return downloader.parse_url_list(stream)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def run_batch(urls, max_active=None, max_per_host=None, quiet=False):
+    """
+    Downloads every URL with one engine, lifting the queue caps so they all run at once
+    (the per-host connection pool still bounds sockets to one server).
+    Returns:
+        int: Number of downloads that failed.
+    """
+    if not urls:
+        return 0
+    engine = downloader.create_engine()
+    engine.set_limits(max_active or len(urls), max_per_host or len(urls))
+    tracker = progress.ProgressTracker(engine)
+    remaining = threading.Semaphore(0)
+    failed = []
+
+    def callbacks_for(url):
+        def on_finish(filename, save_path, total_size):
+            storage.save_entry(filename, total_size or 0, url=url, path=save_path)
+            print(f"done   {filename} ({storage.format_size(total_size or 0)}) -> {save_path}")
+            remaining.release()
+
+        def on_error(message):
+            failed.append(url)
+            print(f"failed {url}: {message}", file=sys.stderr)
+            remaining.release()
+
+        return {
+            'on_status': lambda t: None,
+            'on_finish': on_finish,
+            'on_error': on_error,
+            'on_pause': remaining.release,
+            'on_cancel': remaining.release
+        }
+
+    began = time.monotonic()
+    engine.start_downloads([(url, callbacks_for(url)) for url in urls])
+
+    done = 0
+    while done < len(urls):
+        if remaining.acquire(timeout=REPORT_SECONDS):
+            done += 1
+            continue
+        if not quiet:
+            samples = tracker.poll()
+            speed = sum(sample.speed for sample in samples)
+            print(f"[{done}/{len(urls)}] {progress.format_speed(speed)}", file=sys.stderr)
+
+    engine.close()
+    print(f"{len(urls) - len(failed)}/{len(urls)} downloaded in {time.monotonic() - began:.1f}s")
+    return len(failed)
+
+
+def run_daemon(host, port):
+    """Serves until SIGINT/SIGTERM, then pauses running downloads so they resume on the next start."""
+    app = daemon.DownloadDaemon(host=host, port=port)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever, so it can't run on the thread that serves
+        threading.Thread(target=app.shutdown).start()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print(f"ASPU daemon listening on {app.address}")
+    app.serve_forever()
+
+
+def run_client_command(client, args):
+    """Runs one of the daemon control subcommands through `client`."""
+    if args.command == "add":
+        for url in args.urls:
+            print_job(client.add(url, args.priority, mirrors=args.mirror))
+    elif args.command in ("pause", "resume", "cancel"):
+        for job_id in args.ids:
+            print_job(getattr(client, args.command)(job_id))
+    elif args.command == "priority":
+        for job_id in args.ids:
+            print_job(client.set_priority(job_id, args.level))
+    elif args.command == "list":
+        for job in client.list():
+            print_job(job)
+    elif args.command == "stats":
+        print(json.dumps(client.stats(), indent=4))
+    elif args.command == "metrics":
+        if args.json:
+            print(json.dumps(client.metrics(as_json=True), indent=4))
+        else:
+            print(client.metrics(), end="")
+    elif args.command == "watch":
+        try:
+            for event in client.events():
+                print(json.dumps(event))
+        except KeyboardInterrupt:
+            pass
+
+
+def print_job(job):
+    print(f"{job['id']:>5}  {job['status']:<16} {storage.format_size(job['downloaded']):>12}  {job['name']}")
+
+
+if __name__ == "__main__":
+    settings = storage.settings
+    host = settings.get("daemon_host", daemon.DEFAULT_HOST)
+    port = settings.get("daemon_port", daemon.DEFAULT_PORT)
+
+    parser = argparse.ArgumentParser(description="ASPU Download Manager (headless)")
+    parser.add_argument("--daemon-url", default=f"http://{host}:{port}", help="control API of a running daemon")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("daemon", help="run the download daemon")
+    p.add_argument("--host", default=host)
+    p.add_argument("--port", type=int, default=port)
+
+    p = sub.add_parser("batch", help="download every URL in a file (one per line, - for stdin) and exit")
+    p.add_argument("url_list")
+    p.add_argument("--max-active", type=int, help="default: every URL at once")
+    p.add_argument("--max-per-host", type=int, help="default: every URL at once")
+    p.add_argument("--quiet", action="store_true", help="no periodic speed lines")
+
+    p = sub.add_parser("add", help="queue URLs on the daemon")
+    p.add_argument("urls", nargs="+")
+    p.add_argument("--mirror", action="append", default=[], metavar="URL",
+                   help="another URL of the same file to download from too (repeatable)")
+    p.add_argument("--priority", choices=list(daemon.PRIORITIES), help="queue position class (default: normal)")
+    for name in ("pause", "resume", "cancel"):
+        p = sub.add_parser(name, help=f"{name} daemon downloads by id")
+        p.add_argument("ids", type=int, nargs="+")
+    p = sub.add_parser("priority", help="move queued daemon downloads to another priority level")
+    p.add_argument("level", choices=list(daemon.PRIORITIES))
+    p.add_argument("ids", type=int, nargs="+")
+    sub.add_parser("list", help="list the daemon's downloads")
+    sub.add_parser("stats", help="show the daemon's totals")
+    p = sub.add_parser("metrics", help="show the daemon's engine metrics (Prometheus text format)")
+    p.add_argument("--json", action="store_true", help="full snapshot with per-download metrics instead")
+    sub.add_parser("watch", help="print the daemon's event stream")
+
+    args = parser.parse_args()
+    if args.command == "daemon":
+        run_daemon(args.host, args.port)
+    elif args.command == "batch":
+        raise SystemExit(min(run_batch(read_url_list(args.url_list), args.max_active, args.max_per_host, args.quiet), 255))
+    else:
+        client = daemon.DaemonClient(args.daemon_url)
+        try:
+            run_client_command(client, args)
+        except requests.HTTPError as e:
+            raise SystemExit(f"{e.response.status_code}: {e.response.json().get('error', e.response.reason)}")
+        except requests.ConnectionError:
+            raise SystemExit(f"No daemon at {args.daemon_url} (start one with: python cli.py daemon)")
@@ -0,0 +1,783 @@
+import itertools
+import json
+import queue
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+# Import custom logic modules
+import downloader
+import integrity
+import progress
+import scheduler
+import storage
+
+"""
+Headless download daemon with a local HTTP control API, plus the clients that talk to it.
+- DownloadDaemon runs one DownloadEngine (thread or async, from settings) with no Tk at all.
+- Routes (JSON in and out, bound to 127.0.0.1 by default):
+    GET  /downloads                     list jobs
+    POST /downloads {"url", "priority", "rate_limit", "checksum", "mirrors"}
+                                        add a job (an existing URL is resumed instead)
+    GET  /downloads/<id>                one job
+    POST /downloads/<id>/pause | resume | cancel
+    POST /downloads/<id>/move {"offset"}
+    POST /downloads/<id>/priority {"priority"}
+                                        0-2 or high / normal / low; reorders a queued job now and
+                                        applies whenever the job is queued again
+    POST /limits {"max_active", "max_per_host", "global_rate", "download_rate"}
+    GET  /stats                         totals, queue and connection reuse
+    GET  /metrics                       engine metrics, Prometheus text format (?format=json: full snapshot)
+    GET  /events                        newline-delimited JSON stream: a "snapshot" of every job, then
+                                        status and progress events
+- Job ids stay the same across pause/resume, even though the engine creates a new Process each time.
+- Only local clients are served: POST bodies must be application/json, and requests with a foreign Host or
+  Origin (a web page the user happens to visit) are refused.
+- DaemonClient wraps the routes; RemoteEngine looks like a DownloadEngine so the Tk UI can attach to a daemon.
+"""
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Names accepted for "priority" besides the scheduler's numbers
+PRIORITIES = {"high": scheduler.PRIORITY_HIGH, "normal": scheduler.PRIORITY_NORMAL, "low": scheduler.PRIORITY_LOW}
+
+
+def parse_priority(value):
+    """Scheduler priority from a number (0-2) or a name ("high", "normal", "low"); raises ValueError otherwise."""
+    if isinstance(value, str) and value.lower() in PRIORITIES:
+        return PRIORITIES[value.lower()]
+    if value in PRIORITIES.values() and not isinstance(value, bool):
+        return int(value)
+    raise ValueError(f"priority must be one of 0, 1, 2, high, normal, low (got {value!r})")
+
+
+def parse_count(name, value, minimum=0):
+    """
+    A whole number >= minimum from a JSON value, or None when absent.
+    Raises ValueError for anything else, so bad input is refused before it reaches the engine.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value) or value < minimum:
+        raise ValueError(f"{name} must be a whole number >= {minimum} (got {value!r})")
+    return int(value)
+
+
+def parse_offset(value):
+    """Places to move a queued job (negative = towards the front) from a JSON value; raises ValueError otherwise."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != int(value):
+        raise ValueError(f"offset must be a whole number (got {value!r})")
+    return int(value)
+
+
+class DownloadJob:
+    """What the daemon knows about one URL it was asked to download."""
+
+    def __init__(self, job_id, url, priority, rate_limit, checksum=None, mirrors=None):
+        self.id = job_id
+        self.url = url
+        self.priority = priority
+        self.rate_limit = rate_limit
+        self.checksum = checksum
+        self.mirrors = list(mirrors or ())
+        bare_url = integrity.strip_fragment(url)
+        self.name = bare_url.split('/')[-1] if '/' in bare_url else "Unknown_File"
+        self.pid = None
+        # Bumped on every (re)start so callbacks of a replaced Process are ignored
+        self.generation = 0
+        self.status = "Queued"
+        self.running = False
+        self.downloaded = 0
+        self.total = 0
+        self.speed = 0.0
+        self.eta = None
+        self.path = None
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "id": self.id, "url": self.url, "name": self.name, "status": self.status, "priority": self.priority,
+            "running": self.running, "downloaded": self.downloaded, "total": self.total,
+            "speed": self.speed, "eta": self.eta, "path": self.path, "error": self.error
+        }
+
+
+class DownloadDaemon:
+    # Progress events go out at most this often per job
+    FRAME_SECONDS = 0.25
+    # Events buffered for one /events client before it is considered stuck and dropped
+    SUBSCRIBER_BACKLOG = 10000
+
+    def __init__(self, engine=None, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """
+        Args:
+            engine (DownloadEngine): Engine to drive; defaults to downloader.create_engine().
+            host (str): Interface to listen on. Keep it local: the API has no authentication.
+            port (int): TCP port, 0 picks a free one (see `address`).
+        """
+        self.engine = engine or downloader.create_engine()
+        self.tracker = progress.ProgressTracker(self.engine)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.jobs = {}        # job id -> DownloadJob
+        self._by_url = {}     # url -> job id
+        self._by_pid = {}     # engine pid -> job id
+        self._subscribers = []
+        self._stopping = threading.Event()
+        self._threads = []
+
+        self.server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+        self.server.daemon_threads = True
+        self.server.app = self
+        # Host headers accepted (DNS rebinding guard); None when listening on every interface
+        bound_port = self.server.server_address[1]
+        self.allowed_hosts = None if host in ("", "0.0.0.0", "::") else \
+            {f"{name}:{bound_port}" for name in ("127.0.0.1", "localhost", "[::1]", host)}
+
+    @property
+    def address(self):
+        """Base URL of the control API, e.g. "http://127.0.0.1:8765"."""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        """Runs until shutdown() is called (e.g. from a signal handler on another thread)."""
+        self._start_progress_thread()
+        self.server.serve_forever()
+
+    def start(self):
+        """Serves on background threads and returns right away."""
+        self._start_progress_thread()
+        thread = threading.Thread(target=self.server.serve_forever, name="aspu-daemon-http", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def shutdown(self):
+        """Pauses running downloads (they resume from their journals next time) and stops serving."""
+        self._stopping.set()
+        for job in list(self.jobs.values()):
+            if job.pid is not None:
+                self.engine.pause_download(job.pid)
+        self.server.shutdown()
+        self.server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self.engine.close()
+
+    # --- Commands (called by the HTTP handler, usable directly too) ---
+
+    def add(self, url, priority=scheduler.PRIORITY_NORMAL, rate_limit=None, checksum=None, mirrors=None):
+        """
+        Starts downloading `url`, or resumes the existing job for it.
+        `checksum` ("sha256:<hex>" / "md5:<hex>") is checked when the file is complete.
+        `mirrors` are other URLs of the same file to download from in parallel.
+        Every argument is checked first; ValueError leaves no job behind.
+        Returns:
+            DownloadJob: The new or existing job.
+        """
+        if not isinstance(url, str) or not url:
+            raise ValueError("url must be a non-empty string")
+        priority = parse_priority(priority)
+        rate_limit = parse_count("rate_limit", rate_limit)
+        if isinstance(checksum, str):
+            checksum = integrity.Checksum.parse(checksum)
+        elif checksum is not None and not isinstance(checksum, integrity.Checksum):
+            raise ValueError("checksum must be a string like sha256:<hex>")
+        mirrors = list(mirrors or ())
+        if not all(isinstance(mirror, str) and mirror for mirror in mirrors):
+            raise ValueError("mirrors must be a list of URLs")
+
+        with self._lock:
+            job_id = self._by_url.get(url)
+            if job_id is None:
+                job = DownloadJob(next(self._ids), url, priority, rate_limit, checksum, mirrors)
+                self.jobs[job.id] = job
+                self._by_url[url] = job.id
+                created = True
+            else:
+                job = self.jobs[job_id]
+                created = False
+        if created:
+            self._publish({"event": "added", **job.to_dict()})
+        if created or job.status != "Finished" and not self._is_active(job):
+            try:
+                self._start(job)
+            except Exception:
+                if created:
+                    self._forget(job)
+                    self._publish({"event": "cancelled", "id": job.id})
+                raise
+        return job
+
+    def pause(self, job_id):
+        job = self._job(job_id)
+        if job.pid is not None:
+            self.engine.pause_download(job.pid)
+        return job
+
+    def resume(self, job_id):
+        job = self._job(job_id)
+        if job.status != "Finished" and not self._is_active(job):
+            self._start(job)
+        return job
+
+    def cancel(self, job_id):
+        job = self._job(job_id)
+        self._forget(job)
+        job.generation += 1
+        if job.pid is not None:
+            self.engine.cancel_download(job.pid)
+        job.status = "Cancelled"
+        self._publish({"event": "cancelled", "id": job.id})
+        return job
+
+    def move(self, job_id, offset):
+        job = self._job(job_id)
+        if job.pid is not None:
+            self.engine.move_download(job.pid, offset)
+        return job
+
+    def set_priority(self, job_id, priority):
+        """Moves the job to another priority level (ValueError for an unknown one)."""
+        priority = parse_priority(priority)
+        job = self._job(job_id)
+        job.priority = priority
+        if job.pid is not None:
+            self.engine.set_priority(job.pid, priority)
+        return job
+
+    def set_limits(self, max_active=None, max_per_host=None, global_rate=None, download_rate=None):
+        """Changes the engine's limits; all values are checked before any is applied (ValueError)."""
+        max_active = parse_count("max_active", max_active, 1)
+        max_per_host = parse_count("max_per_host", max_per_host, 1)
+        global_rate = parse_count("global_rate", global_rate)
+        download_rate = parse_count("download_rate", download_rate)
+        self.engine.set_limits(max_active, max_per_host)
+        self.engine.set_rate_limits(global_rate, download_rate)
+
+    def list(self):
+        return [job.to_dict() for job in list(self.jobs.values())]
+
+    def stats(self):
+        jobs = list(self.jobs.values())
+        queue_state = self.engine.scheduler.snapshot()
+        return {
+            "jobs": len(jobs),
+            "running": sum(1 for job in jobs if job.running),
+            "queued": len(queue_state["queued"]),
+            "finished": sum(1 for job in jobs if job.status == "Finished"),
+            "failed": sum(1 for job in jobs if job.status == "Error"),
+            "downloaded": sum(job.downloaded for job in jobs),
+            "speed": sum(job.speed for job in jobs if job.running),
+            "max_active": queue_state["max_active"],
+            "max_per_host": queue_state["max_per_host"],
+            "connections": self.engine.connection_stats()
+        }
+
+    def subscribe(self):
+        subscriber = queue.Queue(DownloadDaemon.SUBSCRIBER_BACKLOG)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def is_subscribed(self, subscriber):
+        with self._lock:
+            return subscriber in self._subscribers
+
+    # --- Internals ---
+
+    def _forget(self, job):
+        with self._lock:
+            self.jobs.pop(job.id, None)
+            self._by_url.pop(job.url, None)
+            self._by_pid.pop(job.pid, None)
+
+    def _job(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"No download with id {job_id}")
+        return job
+
+    def _is_active(self, job):
+        """True while the job's Process is running or waiting in the engine's queue."""
+        process = self.engine.processes.get(job.pid)
+        return process is not None and (process.downloading or self.engine.scheduler.is_scheduled(job.pid))
+
+    def _start(self, job):
+        job.generation += 1
+        job.status = "Queued"
+        job.error = None
+        job.running = False
+        pid = self.engine.start_download(job.url, self._callbacks(job, job.generation),
+                                         priority=job.priority, rate_limit=job.rate_limit,
+                                         checksum=job.checksum, mirrors=job.mirrors)
+        with self._lock:
+            self._by_pid.pop(job.pid, None)
+            job.pid = pid
+            self._by_pid[pid] = job.id
+
+    def _callbacks(self, job, generation):
+        def current():
+            return job.generation == generation and job.id in self.jobs
+
+        def on_status(text):
+            if current():
+                job.status = text
+                self._publish({"event": "status", "id": job.id, "status": text})
+
+        def on_finish(filename, save_path, total_size):
+            if current():
+                job.name, job.path, job.status, job.running = filename, save_path, "Finished", False
+                if total_size:
+                    job.total = job.downloaded = total_size
+                storage.save_entry(filename, total_size or 0, url=job.url, path=save_path)
+                self._publish({"event": "finished", **job.to_dict()})
+
+        def on_error(message):
+            if current():
+                job.status, job.error, job.running = "Error", message, False
+                self._publish({"event": "error", "id": job.id, "error": message})
+
+        def on_pause():
+            if current():
+                job.status, job.running = "Paused", False
+                self._publish({"event": "paused", "id": job.id})
+
+        def on_cancel():
+            # The daemon already reported the cancel when it was requested
+            pass
+
+        return {'on_status': on_status, 'on_finish': on_finish, 'on_error': on_error,
+                'on_pause': on_pause, 'on_cancel': on_cancel}
+
+    def _start_progress_thread(self):
+        thread = threading.Thread(target=self._progress_loop, name="aspu-daemon-progress", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _progress_loop(self):
+        """Same polling pipeline as the UI: one pass over the counters per frame, one event per moved job."""
+        while not self._stopping.wait(DownloadDaemon.FRAME_SECONDS):
+            for sample in self.tracker.poll():
+                job = self.jobs.get(self._by_pid.get(sample.pid))
+                if job is None or job.pid != sample.pid:
+                    continue
+                process = self.engine.processes.get(sample.pid)
+                job.running = bool(process and process.downloading)
+                job.downloaded, job.total, job.speed, job.eta = sample.downloaded, sample.total, sample.speed, sample.eta
+                self._publish({"event": "progress", "id": job.id, "running": job.running,
+                               "downloaded": sample.downloaded, "total": sample.total,
+                               "percent": sample.percent, "speed": sample.speed, "eta": sample.eta})
+
+    def _publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # A client this far behind is stuck; its stream is closed on the next heartbeat
+                self.unsubscribe(subscriber)
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # An idle /events stream sends an empty line this often so dead clients are noticed
+    HEARTBEAT_SECONDS = 15
+
+    def log_message(self, format, *args):
+        # Keep the daemon's output for download events
+        pass
+
+    def do_GET(self):
+        app = self.server.app
+        if not self._from_local_client():
+            return
+        parts = self._parts()
+        if parts == ["downloads"]:
+            self._send_json(200, app.list())
+        elif len(parts) == 2 and parts[0] == "downloads":
+            self._with_job(parts[1], lambda job_id: app._job(job_id))
+        elif parts == ["stats"]:
+            self._send_json(200, app.stats())
+        elif parts == ["metrics"]:
+            if "format=json" in self.path.partition("?")[2].split("&"):
+                self._send_json(200, app.engine.metrics.snapshot())
+            else:
+                self._send_text(200, app.engine.metrics.prometheus(), "text/plain; version=0.0.4")
+        elif parts == ["events"]:
+            self._stream_events()
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        app = self.server.app
+        if not self._from_local_client():
+            return
+        if self.headers.get_content_type() != "application/json":
+            # A web page can only send a cross-site POST without a preflight as a form or text/plain
+            self._send_json(415, {"error": "Content-Type must be application/json"})
+            return
+        parts = self._parts()
+        try:
+            body = self._read_json()
+        except ValueError:
+            self._send_json(400, {"error": "Body must be a JSON object"})
+            return
+
+        if parts == ["downloads"]:
+            if not body.get("url"):
+                self._send_json(400, {"error": "Missing url"})
+                return
+            mirrors = body.get("mirrors", [])
+            if not isinstance(mirrors, list):
+                self._send_json(400, {"error": "mirrors must be a list of URLs"})
+                return
+            try:
+                job = app.add(body["url"], body.get("priority", scheduler.PRIORITY_NORMAL), body.get("rate_limit"),
+                              body.get("checksum") or None, mirrors)
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(201, job.to_dict())
+        elif len(parts) == 3 and parts[0] == "downloads" and parts[2] == "priority":
+            try:
+                priority = parse_priority(body.get("priority"))
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._with_job(parts[1], lambda job_id: app.set_priority(job_id, priority))
+        elif len(parts) == 3 and parts[0] == "downloads" and parts[2] in ("pause", "resume", "cancel", "move"):
+            action = parts[2]
+            if action == "move":
+                try:
+                    offset = parse_offset(body.get("offset", 0))
+                except ValueError as e:
+                    self._send_json(400, {"error": str(e)})
+                    return
+                self._with_job(parts[1], lambda job_id: app.move(job_id, offset))
+            else:
+                self._with_job(parts[1], getattr(app, action))
+        elif parts == ["limits"]:
+            try:
+                app.set_limits(body.get("max_active"), body.get("max_per_host"),
+                               body.get("global_rate"), body.get("download_rate"))
+            except ValueError as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(200, app.stats())
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def _from_local_client(self):
+        """
+        Refuses (403) what a web page in the user's browser could send: the API has no authentication, so
+        a foreign Host (DNS rebinding) or an Origin other than the daemon itself (cross-site request) is
+        turned away. Returns True if the request may go on.
+        """
+        host = self.headers.get("Host", "")
+        origin = self.headers.get("Origin")
+        allowed = self.server.app.allowed_hosts
+        if (allowed is not None and host not in allowed) or (origin is not None and origin != f"http://{host}"):
+            self._send_json(403, {"error": "Forbidden origin"})
+            return False
+        return True
+
+    def _parts(self):
+        return [part for part in self.path.split("?")[0].split("/") if part]
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not isinstance(body, dict):
+            raise ValueError("not an object")
+        return body
+
+    def _with_job(self, raw_id, action):
+        try:
+            job = action(int(raw_id))
+        except (KeyError, ValueError) as e:
+            self._send_json(404, {"error": str(e)})
+            return
+        self._send_json(200, job.to_dict())
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status, text, content_type):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_events(self):
+        """Sends one JSON object per line until the client goes away or the daemon stops."""
+        app = self.server.app
+        subscriber = app.subscribe()
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Cache-Control", "no-cache")
+        # One chunk per event, so clients can hand each line over as soon as it arrives
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            # Start with a snapshot so a new client doesn't wait for the next change
+            self._send_chunk(json.dumps({"event": "snapshot", "jobs": app.list()}) + "\n")
+            while not app._stopping.is_set() and app.is_subscribed(subscriber):
+                try:
+                    event = subscriber.get(timeout=DaemonRequestHandler.HEARTBEAT_SECONDS)
+                    self._send_chunk(json.dumps(event) + "\n")
+                except queue.Empty:
+                    self._send_chunk("\n")
+            self._send_chunk("")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            app.unsubscribe(subscriber)
+
+
+class DaemonClient:
+    """Thin wrapper around the daemon's HTTP routes. Raises requests.HTTPError on 4xx/5xx."""
+
+    def __init__(self, base_url=None, timeout=10):
+        if base_url is None:
+            settings = storage.settings
+            base_url = f"http://{settings.get('daemon_host', DEFAULT_HOST)}:{settings.get('daemon_port', DEFAULT_PORT)}"
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.http = requests.Session()
+
+    def add(self, url, priority=None, rate_limit=None, checksum=None, mirrors=None):
+        body = {"url": url}
+        if priority is not None:
+            body["priority"] = priority
+        if rate_limit is not None:
+            body["rate_limit"] = rate_limit
+        if checksum is not None:
+            body["checksum"] = str(checksum)
+        if mirrors:
+            body["mirrors"] = list(mirrors)
+        return self._post("/downloads", body)
+
+    def pause(self, job_id):
+        return self._post(f"/downloads/{job_id}/pause")
+
+    def resume(self, job_id):
+        return self._post(f"/downloads/{job_id}/resume")
+
+    def cancel(self, job_id):
+        return self._post(f"/downloads/{job_id}/cancel")
+
+    def move(self, job_id, offset):
+        return self._post(f"/downloads/{job_id}/move", {"offset": offset})
+
+    def set_priority(self, job_id, priority):
+        return self._post(f"/downloads/{job_id}/priority", {"priority": priority})
+
+    def set_limits(self, **limits):
+        return self._post("/limits", {key: value for key, value in limits.items() if value is not None})
+
+    def list(self):
+        return self._get("/downloads")
+
+    def stats(self):
+        return self._get("/stats")
+
+    def metrics(self, as_json=False):
+        """The daemon engine's metrics: Prometheus text, or the snapshot dict if as_json."""
+        if as_json:
+            return self._get("/metrics?format=json")
+        response = self.http.get(self.base_url + "/metrics", timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def events(self):
+        """Yields event dicts from /events until the stream ends."""
+        with self.http.get(self.base_url + "/events", stream=True, timeout=(self.timeout, None)) as response:
+            response.raise_for_status()
+            # chunk_size=None yields each chunk (one event) as soon as it arrives
+            for line in response.iter_lines(chunk_size=None):
+                if line:
+                    yield json.loads(line)
+
+    def _get(self, path):
+        response = self.http.get(self.base_url + path, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def _post(self, path, body=None):
+        response = self.http.post(self.base_url + path, json=body or {}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+
+class RemoteProcess:
+    """Mirror of a daemon job with the attributes ProgressTracker and the UI read from a Process."""
+
+    def __init__(self, url, callbacks):
+        self.pid = None
+        self.url = url
+        self.callbacks = callbacks
+        self.status = None
+        self.downloaded = 0
+        self.total_size = 0
+        self.downloading = False
+
+
+class RemoteEngine:
+    """
+    The subset of the DownloadEngine API the Tk UI uses, carried out by a daemon.
+    Callbacks are fed from the daemon's event stream on a background thread.
+    """
+
+    # The daemon writes history itself
+    records_history = True
+    # Wait this long before reconnecting a dropped event stream
+    RECONNECT_SECONDS = 1
+
+    def __init__(self, base_url=None):
+        self.client = DaemonClient(base_url)
+        self.processes = {}
+        self._closed = threading.Event()
+        self._connected = threading.Event()
+        storage.settings.subscribe(self._on_settings_changed)
+        self._thread = threading.Thread(target=self._follow_events, name="aspu-remote-events", daemon=True)
+        self._thread.start()
+
+    def start_download(self, url, callbacks, priority=scheduler.PRIORITY_NORMAL, rate_limit=None, checksum=None,
+                       mirrors=None):
+        # Events of a job that ends quickly would be lost if the stream weren't open yet
+        self._connected.wait(self.client.timeout)
+        job = self.client.add(url, priority, rate_limit, checksum, mirrors)
+        process = self.processes.get(job["id"])
+        if process is None:
+            process = self.processes[job["id"]] = RemoteProcess(url, callbacks)
+            process.pid = job["id"]
+        process.callbacks = callbacks
+        self._apply(process, job)
+        if job["status"] == "Finished" and process.status != "Finished":
+            # Already downloaded earlier: the daemon won't fetch it again
+            self._dispatch({**job, "event": "finished"})
+        process.status = job["status"]
+        return job["id"]
+
+    def start_downloads(self, items, priority=scheduler.PRIORITY_NORMAL):
+        # The daemon queues each job as it is added, so there is nothing to batch on this side
+        return [self.start_download(url, callbacks, priority) for url, callbacks in items]
+
+    def pause_download(self, pid):
+        if pid in self.processes:
+            self.client.pause(pid)
+
+    def cancel_download(self, pid):
+        if pid in self.processes:
+            self.client.cancel(pid)
+            del self.processes[pid]
+
+    def pause_downloads(self, pids):
+        for pid in pids:
+            self.pause_download(pid)
+
+    def cancel_downloads(self, pids):
+        for pid in pids:
+            self.cancel_download(pid)
+
+    def move_download(self, pid, offset):
+        self.client.move(pid, offset)
+
+    def set_priority(self, pid, priority):
+        self.client.set_priority(pid, priority)
+
+    def set_limits(self, max_active=None, max_per_host=None):
+        self.client.set_limits(max_active=max_active, max_per_host=max_per_host)
+
+    def set_rate_limits(self, global_rate=None, download_rate=None):
+        self.client.set_limits(global_rate=global_rate, download_rate=download_rate)
+
+    def connection_stats(self):
+        return self.client.stats()["connections"]
+
+    def _on_settings_changed(self, changed):
+        """Forwards limits saved in the local settings dialog to the daemon; the rest are the daemon's own."""
+        if 'max_active_downloads' in changed or 'max_downloads_per_host' in changed:
+            self.set_limits(changed.get('max_active_downloads'), changed.get('max_downloads_per_host'))
+        if 'global_rate_limit' in changed or 'download_rate_limit' in changed:
+            self.set_rate_limits(changed.get('global_rate_limit'), changed.get('download_rate_limit'))
+
+    def close(self):
+        storage.settings.unsubscribe(self._on_settings_changed)
+        self._closed.set()
+
+    def _follow_events(self):
+        while not self._closed.is_set():
+            try:
+                for event in self.client.events():
+                    if self._closed.is_set():
+                        return
+                    self._dispatch(event)
+            except (requests.RequestException, ValueError):
+                pass
+            self._connected.clear()
+            self._closed.wait(RemoteEngine.RECONNECT_SECONDS)
+
+    def _dispatch(self, event):
+        kind = event["event"]
+        if kind == "snapshot":
+            # Sent on every (re)connect: replay endings missed while the stream was down
+            for job in event["jobs"]:
+                process = self.processes.get(job["id"])
+                if process is not None:
+                    self._apply(process, job)
+                    if job["status"] != process.status and job["status"] in ("Finished", "Error", "Paused"):
+                        self._dispatch({**job, "event": job["status"].lower()})
+            self._connected.set()
+            return
+
+        process = self.processes.get(event.get("id"))
+        if process is None:
+            return
+        if kind == "progress":
+            self._apply(process, event)
+        elif kind == "status":
+            process.status = event["status"]
+            process.callbacks['on_status'](event["status"])
+        elif kind == "finished":
+            self._apply(process, event)
+            process.status = "Finished"
+            process.callbacks['on_finish'](event["name"], event["path"], event["total"])
+        elif kind == "error":
+            process.downloading, process.status = False, "Error"
+            process.callbacks['on_error'](event["error"])
+        elif kind == "paused":
+            process.downloading, process.status = False, "Paused"
+            process.callbacks['on_pause']()
+        elif kind == "cancelled":
+            self.processes.pop(process.pid, None)
+            process.callbacks['on_cancel']()
+
+    @staticmethod
+    def _apply(process, job):
+        process.downloaded = job.get("downloaded", process.downloaded)
+        process.total_size = job.get("total", process.total_size)
+        process.downloading = job.get("running", process.downloading)
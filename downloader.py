@@ -1,64 +1,372 @@
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
 # Import  custon logic modules
 import class_process
+import lifecycle
+import metrics
+import storage
+import scheduler
+from ratelimit import TokenBucket
 
 """
 DownloadEngine class to manage multiple download processes using a threadpool.
 - This class handles starting, pausing, and canceling download tasks while preventing duplicate downloads.
 - This class manages a pool of threads and tracks active download processes.
+- All processes share one keep-alive HTTP session, so connections are reused across downloads and resumes.
+- A DownloadScheduler decides when queued downloads start (priorities, global and per-host caps).
+- A URL-keyed index makes the duplicate check O(1), and start_downloads() queues a whole list with
+  one scheduler pass, so thousands of downloads can be added and controlled without slowing down.
+- Ended downloads are compacted into small records, and only the newest "finished_retention" of
+  them are kept (see lifecycle.py), so memory doesn't grow with every download of a long session.
+- A global TokenBucket caps the bandwidth of all downloads together; each download may have its own cap too.
+- engine.metrics (metrics.Metrics) records throughput, latencies, retries and outcomes; see metrics.py.
 """
 
 class DownloadEngine:
-    def __init__(self):
-        self.executor = ThreadPoolExecutor(max_workers=5)
+    # Upper bound for max_active_downloads; threads are only created when needed
+    MAX_WORKERS = 64
+    # Finished downloads are written to history by the front end (the UI, the daemon or the batch CLI)
+    records_history = False
+
+    def __init__(self, connections_per_host=None):
+        self.executor = ThreadPoolExecutor(max_workers=DownloadEngine.MAX_WORKERS)
         self.processes: dict[int, class_process.Process] = {} 
         # I used this instead of simply using self.processes = {} becuase of Pylance error. :)
+        self._by_url = {}       # url -> pid of its newest process, for the duplicate check
+        settings = storage.settings.snapshot()
+        if connections_per_host is None:
+            connections_per_host = settings.get('connections_per_host', 16)
+        self.session = DownloadEngine.build_session(connections_per_host)
+        self._init_lifecycle(settings)
+        self._init_scheduler(settings)
+        self._init_rate_limits(settings)
+        self._init_metrics(settings)
+        storage.settings.subscribe(self._on_settings_changed)
+
+    def _init_lifecycle(self, settings):
+        self.lifecycle = lifecycle.ProcessLifecycle(
+            self.processes, self._by_url, settings.get('finished_retention', lifecycle.DEFAULT_RETENTION))
+
+    def _init_scheduler(self, settings):
+        self.scheduler = scheduler.DownloadScheduler(
+            self._launch, self._report_position,
+            max_active=self._clamp_active(settings.get('max_active_downloads', 5)),
+            max_per_host=settings.get('max_downloads_per_host', 4))
+
+    def _init_rate_limits(self, settings):
+        # Bytes per second, 0 = unlimited
+        self.global_bucket = TokenBucket(settings.get('global_rate_limit', 0))
+        self.download_rate_limit = settings.get('download_rate_limit', 0)
 
-    def start_download(self, url, callbacks):
+    def _init_metrics(self, settings):
+        self.metrics = metrics.Metrics(self)
+        self.tracer = None
+        # Optional periodic JSON-lines log of metrics snapshots
+        log_path = settings.get('metrics_log', '')
+        self.metrics_log = metrics.MetricsLog(self.metrics, log_path, settings.get('metrics_interval', 10)) \
+            if log_path else None
+
+    def _on_settings_changed(self, changed):
+        """Applies queue and speed limits live when they are saved (or settings.json is edited)."""
+        if 'max_active_downloads' in changed or 'max_downloads_per_host' in changed:
+            self.set_limits(changed.get('max_active_downloads'), changed.get('max_downloads_per_host'))
+        if 'global_rate_limit' in changed or 'download_rate_limit' in changed:
+            self.set_rate_limits(changed.get('global_rate_limit'), changed.get('download_rate_limit'))
+        if 'finished_retention' in changed:
+            self.lifecycle.set_retention(changed['finished_retention'])
+
+    def _clamp_active(self, max_active):
+        return min(max_active, DownloadEngine.MAX_WORKERS)
+
+    @staticmethod
+    def build_session(connections_per_host):
         """
-        Starts or Resumes a download while preventing duplicate threads.
+        Creates a keep-alive session with a bounded connection pool per host.
+        Args:
+            connections_per_host (int): Max open sockets to one host; extra requests wait for a free one.
+        Returns:
+            requests.Session: Session safe to share between the download threads.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=connections_per_host, pool_block=True)
+        # Pools whose connections report their setup time to metrics
+        adapter.poolmanager.pool_classes_by_scheme = {"http": _timed_pool(HTTPConnectionPool),
+                                                      "https": _timed_pool(HTTPSConnectionPool)}
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def connection_stats(self):
+        """
+        Reports how often requests reused a pooled connection instead of opening a new one.
+        Only hosts still held in the pool manager are counted.
+        Returns:
+            dict: {'requests': int, 'connections': int, 'reuse_rate': float between 0 and 1}
+        """
+        total_requests = total_connections = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    total_requests += pool.num_requests
+                    total_connections += pool.num_connections
+        reuse_rate = 1 - total_connections / total_requests if total_requests else 0.0
+        return {'requests': total_requests, 'connections': total_connections, 'reuse_rate': reuse_rate}
+
+    def start_download(self, url, callbacks, priority=scheduler.PRIORITY_NORMAL, rate_limit=None, checksum=None,
+                       mirrors=None):
+        """
+        Queues (or Resumes) a download while preventing duplicate threads.
         Args:
             url (str): The URL of the file to download.
             callbacks (dict): A dictionary of callback functions for status updates.
+                While waiting, on_status receives "Queued (N)" with the job's queue position.
+                on_progress is optional; progress.ProgressTracker can poll the counters instead.
+            priority (int): scheduler.PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW.
+            rate_limit (int): Optional bytes/sec cap for this download; defaults to the download_rate_limit setting.
+            checksum (str): Optional "sha256:<hex>" / "md5:<hex>" the finished file must match
+                (a "#sha256=<hex>" URL fragment works too).
+            mirrors (list): Optional other URLs of the same file; ranged downloads spread connections over them.
+                Defaults to the mirrors given when the paused download was first started.
         Returns:
             int: The Process ID of the download task.
         """
+        pid, is_new = self._prepare(url, callbacks, rate_limit, checksum, mirrors)
+        if is_new:
+            # Queue it; the scheduler submits it to the ThreadPool when a slot is free
+            self.scheduler.enqueue(pid, url, priority)
+        return pid
+
+    def start_downloads(self, items, priority=scheduler.PRIORITY_NORMAL):
+        """
+        Queues (or Resumes) many downloads at once, e.g. an imported URL list.
+        Same duplicate rules as start_download, but the scheduler runs once for the whole batch.
+        Args:
+            items (list): [(url, callbacks), ...] in the order they should run.
+            priority (int): Priority of every download in the batch.
+        Returns:
+            list: The Process ID of each item, in the same order.
+        """
+        pids = []
+        queued = []
+        for url, callbacks in items:
+            pid, is_new = self._prepare(url, callbacks, None, None, None)
+            pids.append(pid)
+            if is_new:
+                queued.append((pid, url))
+        self.scheduler.enqueue_many(queued, priority)
+        return pids
+
+    def _prepare(self, url, callbacks, rate_limit, checksum, mirrors):
+        """
+        Creates the process for start_download(s) without queueing it.
+        Returns:
+            tuple: (pid, is_new); is_new is False when the URL is already running or queued.
+        """
         # 1. Check if we already have a process for this URL to avoid duplicates
-        for existing_pid, proc in self.processes.items():
-            if proc.url == url:
-                # If it's already downloading, don't start a second thread
-                if proc.downloading:
-                    return existing_pid
-                
-                # If it exists but is paused, we will replace it with a fresh process 
-                self.pause_download(existing_pid)
-
-        # 2. Create the new Process instance
-        new_process = class_process.Process(url, callbacks) 
+        stats = part_path = None
+        existing_pid = self._by_url.get(url)
+        proc = self.processes.get(existing_pid)
+        if proc is not None:
+            # If it's already downloading or waiting its turn, don't start a second thread
+            if proc.downloading or self.scheduler.is_scheduled(existing_pid):
+                return existing_pid, False
+
+            # If it exists but is paused (or ended), we will replace it with a fresh process
+            self.lifecycle.discard(existing_pid)
+            stats = proc.stats
+            part_path = proc.part_path
+            if mirrors is None:
+                mirrors = proc.mirrors
+
+        # 2. Create the new Process instance; its measurements carry on from the paused one
+        if rate_limit is None:
+            rate_limit = self.download_rate_limit
+        new_process = self._create_process(url, callbacks, rate_limit, checksum, mirrors)
+        new_process.stats = stats or self.metrics.new_stats()
+        # Lets a cancel before it starts again still find the paused download's .part
+        new_process.part_path = part_path
+        new_process.stats.queued()
+        new_process.tracer = self.tracer
         pid = new_process.pid
 
-        # 3. Store it in our tracking dictionary
+        # 3. Store it in our tracking dictionaries
         self.processes[pid] = new_process 
+        self._by_url[url] = pid
+        return pid, True
 
-        # 4. Submit to the ThreadPool
-        self.executor.submit(new_process.start) 
+    def _create_process(self, url, callbacks, rate_limit, checksum=None, mirrors=None):
+        return class_process.Process(url, callbacks, session=self.session, global_bucket=self.global_bucket,
+                                     rate_limit=rate_limit, checksum=checksum, mirrors=mirrors)
 
-        return pid
+    def _launch(self, pid):
+        """Called by the scheduler when a queued download may start."""
+        process = self.processes.get(pid)
+        if process is None:
+            self.scheduler.job_done(pid)
+            return
+        self._submit(process)
+
+    def _submit(self, process):
+        self.executor.submit(self._run, process)
+
+    def _run(self, process):
+        try:
+            process.start()
+        finally:
+            self.metrics.run_finished(process.stats)
+            self.lifecycle.ended(process)
+            self.scheduler.job_done(process.pid)
+
+    def _report_position(self, pid, position):
+        process = self.processes.get(pid)
+        if process is not None:
+            process.callbacks['on_status'](f"Queued ({position})" if position is not None else "Queued")
 
     def pause_download(self, pid):
         """Finds a specific process by ID and pauses it."""
-        if pid in self.processes:
-            self.processes[pid].pause()
+        process = self.processes.get(pid)
+        if process is not None:
+            if self.scheduler.remove(pid):
+                # It never started, so nobody else will report the pause
+                process.callbacks['on_pause']()
+                self.lifecycle.ended(process, "paused")
+            else:
+                process.pause()
+
+    def pause_downloads(self, pids):
+        """Pauses many downloads; the queued ones leave the queue in a single scheduler pass."""
+        processes = [process for process in map(self.processes.get, pids) if process is not None]
+        removed = self.scheduler.remove_many([process.pid for process in processes])
+        for process in processes:
+            if process.pid in removed:
+                process.callbacks['on_pause']()
+                self.lifecycle.ended(process, "paused")
+            else:
+                process.pause()
 
     def cancel_download(self, pid):
         """Finds a specific process by ID and cancels it."""
         if pid in self.processes:
-            self.processes[pid].cancel()
-            
-            # Remove from tracking dictionary after canceling
-            del self.processes[pid]
+            self.scheduler.remove(pid)
+            self._cancel(pid)
+
+    def cancel_downloads(self, pids):
+        """Cancels many downloads; the queued ones leave the queue in a single scheduler pass."""
+        pids = [pid for pid in pids if pid in self.processes]
+        self.scheduler.remove_many(pids)
+        for pid in pids:
+            self._cancel(pid)
+
+    def _cancel(self, pid):
+        # Stop tracking it, then cancel (a running download still reports on_cancel when it stops)
+        process = self.lifecycle.discard(pid)
+        if process is not None:
+            process.cancel()
+            if not process.downloading:
+                # Paused, failed or still queued: no transfer will clean up after it
+                process.remove_partial()
+
+    def set_limits(self, max_active=None, max_per_host=None):
+        """Changes the global and per-host active download caps while downloads are running."""
+        if max_active is not None:
+            max_active = self._clamp_active(max_active)
+        self.scheduler.set_limits(max_active, max_per_host)
+
+    def set_rate_limits(self, global_rate=None, download_rate=None):
+        """
+        Changes bandwidth caps live (bytes/sec, 0 = unlimited).
+        Args:
+            global_rate (int): Budget shared by every download.
+            download_rate (int): Cap applied to each download, including those already running.
+        """
+        if global_rate is not None:
+            self.global_bucket.set_rate(global_rate)
+        if download_rate is not None:
+            self.download_rate_limit = download_rate
+            for process in self._live_processes():
+                process.rate_bucket.set_rate(download_rate)
+
+    def set_download_rate(self, pid, rate):
+        """Caps one download (bytes/sec, 0 = unlimited)."""
+        process = self.processes.get(pid)
+        if process is not None and not isinstance(process, lifecycle.ProcessRecord):
+            process.rate_bucket.set_rate(rate)
+
+    def set_tracer(self, tracer):
+        """
+        Installs (or with None removes) a tracing hook on every download, current and future.
+        Args:
+            tracer (callable): tracer(event, process, value); see metrics.py for the events. It runs on
+                the transfer threads (the loop thread for the async engine), so it must be quick.
+        """
+        self.tracer = tracer
+        for process in self._live_processes():
+            process.tracer = tracer
+
+    def _live_processes(self):
+        """Processes queued or running; ProcessRecords of ended downloads have no buckets or tracer."""
+        return [process for process in list(self.processes.values())
+                if not isinstance(process, lifecycle.ProcessRecord)]
+
+    def set_priority(self, pid, priority):
+        """Moves a queued download to another priority level."""
+        self.scheduler.set_priority(pid, priority)
+
+    def move_download(self, pid, offset):
+        """Moves a queued download earlier (negative offset) or later (positive) in the queue."""
+        self.scheduler.move(pid, offset)
+
+    def close(self):
+        """Stops accepting work and closes pooled connections once running downloads end."""
+        storage.settings.unsubscribe(self._on_settings_changed)
+        if self.metrics_log is not None:
+            self.metrics_log.close()
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+def _timed_pool(pool_class):
+    """A urllib3 pool class whose new connections pass their setup time to metrics.connection_opened."""
+
+    class TimedConnection(pool_class.ConnectionCls):
+        def connect(self):
+            began = time.perf_counter()
+            super().connect()
+            metrics.connection_opened(time.perf_counter() - began)
+
+    return type("Timed" + pool_class.__name__, (pool_class,), {"ConnectionCls": TimedConnection})
+
+
+def create_engine():
+    """
+    Builds the engine chosen by the "engine" setting.
+    Returns:
+        DownloadEngine: The thread-pool engine ("thread", default) or the asyncio engine ("async").
+    """
+    if storage.settings.get('engine', 'thread') == 'async':
+        # Imported here so aiohttp is only needed when the async engine is selected
+        import async_downloader
+        return async_downloader.AsyncDownloadEngine()
+    return DownloadEngine()
+
+
+def parse_url_list(lines):
+    """
+    Cleans a pasted or loaded URL list: one URL per line, blank lines and lines starting with # skipped,
+    repeats dropped (first occurrence kept).
+    Args:
+        lines (iterable): Lines of text.
+    Returns:
+        list: The URLs in their original order.
+    """
+    urls = (line.strip() for line in lines)
+    return list(dict.fromkeys(url for url in urls if url and not url.startswith("#")))
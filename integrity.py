@@ -0,0 +1,328 @@
+import hashlib
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+from urllib.parse import urlsplit
+
+"""
+End-to-end checksum verification for downloads.
+- Expected checksums come with the URL ("...file.iso#sha256=<hex>", or the engine's checksum argument)
+  or from a sidecar next to it: <url>.meta4 (Metalink, may carry per-piece hashes), <url>.sha256, <url>.md5.
+- Verifier hashes data as the writers hand it over, so a normal download is never read back:
+  - with piece hashes, every piece is hashed by the segment writing it (segments are aligned to
+    pieces), all segments in parallel, and a bad piece is the only range fetched again;
+  - with a whole-file digest, bytes are hashed in file order: the segment at the hash cursor feeds it
+    directly, data that arrived ahead of the cursor is read back from the (page-cached) .part file.
+- Data already on disk from an earlier session is read back once, since hash state can't be saved.
+"""
+
+ALGORITHMS = {"sha256": hashlib.sha256, "md5": hashlib.md5}
+DIGEST_LENGTHS = {64: "sha256", 32: "md5"}
+# Sidecars tried, in order, when the checksum_sidecar setting is on
+SIDECARS = (".meta4", ".sha256", ".md5")
+# Read-back size for data that couldn't be hashed as it arrived
+READ_SIZE = 1024 * 1024
+
+_METALINK_NS = "{urn:ietf:params:xml:ns:metalink}"
+_METALINK_TYPES = {"sha-256": "sha256", "md5": "md5"}
+
+
+class ChecksumMismatch(IOError):
+    """A download still failed verification after its re-downloads; its partial files have been removed."""
+
+
+class Checksum:
+
+    def __init__(self, algorithm, digest, piece_length=0, pieces=None):
+        """
+        Args:
+            algorithm (str): "sha256" or "md5".
+            digest (str): Expected hex digest of the whole file, or None if only pieces are known.
+            piece_length (int): Size of each piece when `pieces` is given.
+            pieces (list): Expected hex digests of consecutive piece_length pieces.
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+        self.algorithm = algorithm
+        self.digest = digest.lower() if digest else None
+        self.piece_length = piece_length if pieces else 0
+        self.pieces = [piece.lower() for piece in pieces] if pieces else []
+
+    def __repr__(self):
+        return f"{self.algorithm}:{self.digest or f'{len(self.pieces)} pieces'}"
+
+    @classmethod
+    def parse(cls, text):
+        """Reads "sha256:<hex>", "md5=<hex>" or a bare hex digest (algorithm picked from its length)."""
+        text = text.strip()
+        algorithm, _, digest = text.rpartition(":") if ":" in text else text.rpartition("=")
+        algorithm = algorithm.lower().replace("-", "")
+        if not algorithm:
+            algorithm = DIGEST_LENGTHS.get(len(digest), "")
+        if not re.fullmatch(r"[0-9a-fA-F]+", digest) or DIGEST_LENGTHS.get(len(digest)) != algorithm:
+            raise ValueError(f"Not a checksum: {text!r}")
+        return cls(algorithm, digest)
+
+    @classmethod
+    def from_url(cls, url):
+        """Returns the checksum in a "#sha256=<hex>" / "#md5=<hex>" URL fragment, or None."""
+        fragment = urlsplit(url).fragment
+        if not fragment:
+            return None
+        try:
+            return cls.parse(fragment)
+        except ValueError:
+            return None
+
+
+def strip_fragment(url):
+    """The URL as sent to the server (fragments never are)."""
+    return url.split("#", 1)[0]
+
+
+def sidecar_urls(url):
+    """Returns [(suffix, sidecar url), ...] in the order they should be tried."""
+    base = strip_fragment(url)
+    return [(suffix, base + suffix) for suffix in SIDECARS]
+
+
+def parse_sidecar(suffix, text, filename):
+    """
+    Reads a sidecar file fetched from <url><suffix>.
+    Returns:
+        Checksum or None if the file has nothing usable (e.g. an HTML error page served with 200).
+    """
+    try:
+        if suffix == ".meta4":
+            return _parse_metalink(text, filename)
+        algorithm = suffix.lstrip(".")
+        for line in text.splitlines():
+            # sha256sum / md5sum format: "<hex>  <name>" or "<hex> *<name>", or just "<hex>"
+            parts = line.strip().split(None, 1)
+            if not parts:
+                continue
+            name = parts[1].lstrip("*").strip() if len(parts) > 1 else ""
+            if not name or os.path.basename(name) == filename:
+                checksum = Checksum.parse(parts[0])
+                if checksum.algorithm == algorithm:
+                    return checksum
+    except (ValueError, ET.ParseError):
+        pass
+    return None
+
+
+def _parse_metalink(text, filename):
+    root = ET.fromstring(text)
+    files = root.findall(f"{_METALINK_NS}file")
+    entry = next((f for f in files if f.get("name") == filename), files[0] if len(files) == 1 else None)
+    if entry is None:
+        return None
+
+    digest = None
+    for hash_element in entry.findall(f"{_METALINK_NS}hash"):
+        algorithm = _METALINK_TYPES.get(hash_element.get("type", "").lower())
+        value = _metalink_hash(hash_element, algorithm)
+        if value and (algorithm == "sha256" or digest is None):
+            digest = (algorithm, value)
+
+    for pieces in entry.findall(f"{_METALINK_NS}pieces"):
+        algorithm = _METALINK_TYPES.get(pieces.get("type", "").lower())
+        length = pieces.get("length", "")
+        hashes = [_metalink_hash(h, algorithm) for h in pieces.findall(f"{_METALINK_NS}hash")]
+        # Piece hashes are only usable whole: a piece without one could never be checked
+        if algorithm and length.isdigit() and int(length) > 0 and hashes and all(hashes):
+            whole = digest[1] if digest and digest[0] == algorithm else None
+            return Checksum(algorithm, whole, int(length), hashes)
+    return Checksum(*digest) if digest else None
+
+
+def _metalink_hash(element, algorithm):
+    """The hex digest in a <hash> element, or None if it is empty or not a digest of that algorithm."""
+    value = (element.text or "").strip()
+    if not algorithm or not re.fullmatch(r"[0-9a-fA-F]+", value) or DIGEST_LENGTHS.get(len(value)) != algorithm:
+        return None
+    return value
+
+
+class _Piece:
+    """One independently verified byte range and its in-order hash state."""
+
+    __slots__ = ("start", "stop", "expected", "hasher", "cursor", "lock", "ok")
+
+    def __init__(self, start, stop, expected, algorithm):
+        self.start = start
+        self.stop = stop
+        self.expected = expected
+        self.hasher = ALGORITHMS[algorithm]()
+        self.cursor = start
+        self.lock = threading.Lock()
+        self.ok = None
+
+
+class Verifier:
+
+    def __init__(self, checksum, path, total_size):
+        """
+        Args:
+            checksum (Checksum): What the file must hash to.
+            path (str): The .part file, read only for data that can't be hashed as it arrives.
+            total_size (int): File size, or 0 when the server didn't say (whole-file digest only).
+        """
+        self.checksum = checksum
+        self.path = path
+        self._fd = None
+        self._extent_lock = threading.Lock()
+        self._extents = {}      # start -> stop of data known to be on disk
+        if checksum.pieces and total_size:
+            length = checksum.piece_length
+            if len(checksum.pieces) != -(-total_size // length):
+                raise IOError(f"Checksum lists {len(checksum.pieces)} pieces, the file has "
+                              f"{-(-total_size // length)}")
+            self.pieces = [_Piece(i * length, min((i + 1) * length, total_size), expected, checksum.algorithm)
+                           for i, expected in enumerate(checksum.pieces)]
+        else:
+            # None: size unknown until the stream ends
+            self.pieces = [_Piece(0, total_size or None, checksum.digest, checksum.algorithm)]
+
+    @property
+    def alignment(self):
+        """Segment boundaries should fall on multiples of this (0 = anywhere)."""
+        return 0 if self.ordered else self.checksum.piece_length
+
+    @property
+    def ordered(self):
+        """True when one hash covers the whole file, so out-of-order data has to be caught up later."""
+        return len(self.pieces) == 1
+
+    def add_on_disk(self, ranges):
+        """Registers data written by an earlier session and hashes it (the one unavoidable read-back)."""
+        for start, stop in ranges:
+            self._record(start, stop)
+        self.catch_up()
+
+    def feed(self, offset, data):
+        """Called by a writer right after `data` was written at `offset`. Hashes it if it is next in line."""
+        view = memoryview(data)
+        end = offset + len(view)
+        self._record(offset, end)
+        index = self._piece_index(offset)
+        while index < len(self.pieces):
+            piece = self.pieces[index]
+            if piece.start >= end:
+                break
+            low = max(offset, piece.start)
+            high = end if piece.stop is None else min(end, piece.stop)
+            with piece.lock:
+                if piece.cursor == low and piece.ok is None:
+                    piece.hasher.update(view[low - offset:high - offset])
+                    piece.cursor = high
+                    self._check(piece)
+            index += 1
+
+    def catch_up(self, blocking=True):
+        """Hashes data that landed ahead of a piece's cursor and is now contiguous with it."""
+        for piece in self.pieces:
+            if piece.ok is not None:
+                continue
+            if not piece.lock.acquire(blocking):
+                continue
+            try:
+                while piece.ok is None:
+                    extent_stop = self._extent_covering(piece.cursor)
+                    if extent_stop is None:
+                        break
+                    high = extent_stop if piece.stop is None else min(extent_stop, piece.stop)
+                    while piece.cursor < high:
+                        chunk = self._pread(min(READ_SIZE, high - piece.cursor), piece.cursor)
+                        if not chunk:
+                            break
+                        piece.hasher.update(chunk)
+                        piece.cursor += len(chunk)
+                    self._check(piece)
+                    if piece.cursor < high:
+                        break
+            finally:
+                piece.lock.release()
+
+    def finish(self, total_size=None):
+        """
+        Completes every hash once all data is on disk.
+        Args:
+            total_size (int): Final size, needed when it wasn't known up front.
+        Returns:
+            list: [(start, stop), ...] ranges that failed verification (empty when the file is good).
+        """
+        last = self.pieces[-1]
+        if last.stop is None:
+            last.stop = total_size if total_size is not None else last.cursor
+        self.catch_up()
+        bad = []
+        for piece in self.pieces:
+            with piece.lock:
+                self._check(piece)
+                if not piece.ok:
+                    bad.append((piece.start, piece.stop))
+        return bad
+
+    def reset(self, ranges):
+        """Forgets the hashes of `ranges` (about to be fetched again)."""
+        with self._extent_lock:
+            self._extents.clear()
+        for piece in self.pieces:
+            if any(start <= piece.start and piece.stop <= stop for start, stop in ranges):
+                with piece.lock:
+                    piece.hasher = ALGORITHMS[self.checksum.algorithm]()
+                    piece.cursor = piece.start
+                    piece.ok = None
+
+    def describe_failure(self, bad):
+        if len(self.pieces) == 1:
+            piece = self.pieces[0]
+            return f"{self.checksum.algorithm} mismatch: expected {piece.expected}, got {piece.hasher.hexdigest()}"
+        return f"{self.checksum.algorithm} mismatch in {len(bad)} of {len(self.pieces)} pieces"
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _check(self, piece):
+        if piece.ok is None and piece.stop is not None and piece.cursor >= piece.stop:
+            piece.ok = self._matches(piece)
+
+    def _matches(self, piece):
+        # Pieces from a file with only a whole-file digest have no expected value of their own
+        return piece.expected is None or piece.hasher.hexdigest() == piece.expected
+
+    def _piece_index(self, offset):
+        if len(self.pieces) == 1:
+            return 0
+        return offset // self.checksum.piece_length
+
+    def _record(self, start, stop):
+        if stop <= start:
+            return
+        with self._extent_lock:
+            # Writers move forward, so an extent usually just grows at its end
+            for extent_start, extent_stop in list(self._extents.items()):
+                if extent_start <= start <= extent_stop:
+                    self._extents[extent_start] = max(extent_stop, stop)
+                    return
+            self._extents[start] = stop
+
+    def _extent_covering(self, position):
+        with self._extent_lock:
+            for start, stop in self._extents.items():
+                if start <= position < stop:
+                    return stop
+        return None
+
+    def _pread(self, size, offset):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        if hasattr(os, "pread"):
+            return os.pread(self._fd, size, offset)
+        with self._extent_lock:
+            os.lseek(self._fd, offset, os.SEEK_SET)
+            return os.read(self._fd, size)
@@ -0,0 +1,168 @@
+import os
+import struct
+import threading
+import zlib
+
+"""
+Resume journal for ranged downloads.
+- A small binary sidecar next to the .part file records which byte ranges are safely on disk,
+  together with the size and validator (ETag / Last-Modified) of the remote file.
+- Records are appended only after the data they describe has been flushed, and every record
+  carries a CRC, so a process killed mid-write leaves at worst a torn last record that is ignored.
+"""
+
+MAGIC = b"ASPJ"
+VERSION = 1
+# magic, version, total size, validator length  (+ validator bytes + header crc)
+HEADER = struct.Struct("<4sBQH")
+HEADER_CRC = struct.Struct("<I")
+# start, stop (half-open byte range), crc of the two offsets
+RECORD = struct.Struct("<QQI")
+
+
+class DownloadJournal:
+
+    def __init__(self, path, total_size, validator):
+        self.path = path
+        self.total_size = total_size
+        self.validator = validator or ""
+        self.completed = []     # merged, sorted [(start, stop), ...]
+        self._lock = threading.Lock()
+        self._file = None
+
+    @classmethod
+    def open(cls, path, total_size, validator):
+        """
+        Loads the journal at `path` if it matches the remote file, otherwise starts a fresh one.
+        Args:
+            path (str): Location of the journal file.
+            total_size (int): Size reported by the server now.
+            validator (str): ETag or Last-Modified reported by the server now.
+        Returns:
+            tuple: (journal, resumed). resumed is False when the old journal was missing or stale.
+        """
+        journal = cls(path, total_size, validator)
+        stored = _read(path)
+        resumed = stored is not None and stored[0] == total_size and stored[1] == journal.validator
+        if resumed:
+            journal.completed = merge_ranges(stored[2])
+        # Rewriting also compacts the many small records of the last session into a few
+        journal._rewrite()
+        return journal, resumed
+
+    def completed_bytes(self):
+        return sum(stop - start for start, stop in self.completed)
+
+    def missing_ranges(self):
+        """Returns the half-open ranges of [0, total_size) that are not on disk yet."""
+        missing = []
+        position = 0
+        for start, stop in self.completed:
+            if start > position:
+                missing.append((position, start))
+            position = max(position, stop)
+        if position < self.total_size:
+            missing.append((position, self.total_size))
+        return missing
+
+    def record(self, start, stop):
+        """Marks [start, stop) as written. The caller must flush the data file first."""
+        if stop <= start:
+            return
+        offsets = struct.pack("<QQ", start, stop)
+        with self._lock:
+            self._file.write(RECORD.pack(start, stop, zlib.crc32(offsets)))
+            self.completed = merge_ranges(self.completed + [(start, stop)])
+
+    def invalidate(self, ranges):
+        """Forgets [start, stop) ranges (e.g. data that failed verification) so they are fetched again."""
+        with self._lock:
+            self.completed = subtract_ranges(self.completed, ranges)
+            if self._file:
+                self._file.close()
+            self._rewrite()
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _rewrite(self):
+        validator = self.validator.encode("utf-8")[:0xFFFF]
+        header = HEADER.pack(MAGIC, VERSION, self.total_size, len(validator)) + validator
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header + HEADER_CRC.pack(zlib.crc32(header)))
+            for start, stop in self.completed:
+                f.write(RECORD.pack(start, stop, zlib.crc32(struct.pack("<QQ", start, stop))))
+        os.replace(tmp_path, self.path)
+        # Unbuffered: every record reaches the OS in a single write() call
+        self._file = open(self.path, "ab", buffering=0)
+
+
+def _read(path):
+    """
+    Parses a journal file.
+    Returns:
+        tuple: (total_size, validator, ranges) or None if the file is missing or unreadable.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    if len(data) < HEADER.size:
+        return None
+    magic, version, total_size, validator_len = HEADER.unpack_from(data)
+    header_end = HEADER.size + validator_len
+    if magic != MAGIC or version != VERSION or len(data) < header_end + HEADER_CRC.size:
+        return None
+    (header_crc,) = HEADER_CRC.unpack_from(data, header_end)
+    if header_crc != zlib.crc32(data[:header_end]):
+        return None
+    validator = data[HEADER.size:header_end].decode("utf-8", "replace")
+
+    ranges = []
+    offset = header_end + HEADER_CRC.size
+    # A torn final record (shorter than RECORD.size) is simply not read
+    while offset + RECORD.size <= len(data):
+        start, stop, crc = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if crc != zlib.crc32(data[offset - RECORD.size:offset - 4]):
+            break
+        if start < stop <= total_size:
+            ranges.append((start, stop))
+    return total_size, validator, ranges
+
+
+def merge_ranges(ranges):
+    """Sorts half-open ranges and joins the ones that touch or overlap."""
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def subtract_ranges(ranges, removed):
+    """Returns the parts of merged `ranges` not covered by any of the `removed` half-open ranges."""
+    result = []
+    for start, stop in ranges:
+        pieces = [(start, stop)]
+        for cut_start, cut_stop in removed:
+            next_pieces = []
+            for piece_start, piece_stop in pieces:
+                if cut_stop <= piece_start or piece_stop <= cut_start:
+                    next_pieces.append((piece_start, piece_stop))
+                    continue
+                if piece_start < cut_start:
+                    next_pieces.append((piece_start, cut_start))
+                if cut_stop < piece_stop:
+                    next_pieces.append((cut_stop, piece_stop))
+            pieces = next_pieces
+        result.extend(pieces)
+    return result
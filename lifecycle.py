@@ -0,0 +1,113 @@
+"""
+Lifecycle of the Process objects an engine tracks, so a long session doesn't keep every download alive.
+- While a download is queued or running, engine.processes holds its Process.
+- Once it ends (finished, failed or paused) the Process is swapped for a ProcessRecord: pid, URL,
+  byte counters, outcome and its metrics. The callbacks (and the UI objects they close over), the
+  session, the rate buckets and the verifier go with the Process.
+- Records answer what progress.ProgressTracker, metrics and the daemon read from a Process, and a
+  paused one still resumes through start_download (which reads the URL, the mirrors and the stats).
+- Only the newest `retention` records are kept; older ones are dropped from engine.processes.
+"""
+
+import threading
+
+from partfile import remove_files
+
+
+# Ended downloads remembered by default (the "finished_retention" setting)
+DEFAULT_RETENTION = 1000
+
+
+class ProcessRecord:
+    """What is left of a Process after it ended. Read-only stand-in for it in engine.processes."""
+
+    __slots__ = ("pid", "url", "mirrors", "part_path", "outcome", "downloaded", "total_size", "stats")
+
+    # Same flags as a Process that is not running
+    downloading = False
+    stop_requested = False
+    cancel_requested = False
+
+    def __init__(self, process, outcome=None):
+        self.pid = process.pid
+        self.url = process.url
+        self.mirrors = process.mirrors
+        self.part_path = process.part_path
+        self.outcome = outcome or process.stats.outcome
+        self.downloaded = process.downloaded
+        self.total_size = process.total_size
+        # Kept so totals carry on if the download is started again
+        self.stats = process.stats
+
+    def pause(self):
+        # Already ended: nothing to stop
+        pass
+
+    def cancel(self):
+        pass
+
+    def remove_partial(self):
+        """Deletes what a paused or failed download left on disk (a finished one has no .part any more)."""
+        if self.part_path is not None and self.outcome != "finished":
+            remove_files(self.part_path, self.part_path + ".journal")
+
+
+class ProcessLifecycle:
+    """Compacts ended downloads into ProcessRecords and bounds how many are kept."""
+
+    def __init__(self, processes, by_url, retention=DEFAULT_RETENTION):
+        """
+        Args:
+            processes (dict): The engine's pid -> Process (or ProcessRecord) map, edited in place.
+            by_url (dict): The engine's url -> pid index; evicted pids are removed from it too.
+            retention (int): Ended downloads to keep as records (0 = drop them as soon as they end).
+        """
+        self.processes = processes
+        self.by_url = by_url
+        self.retention = max(0, int(retention))
+        self._lock = threading.Lock()
+        self._records = {}      # pid -> None, oldest first (an insertion-ordered set)
+
+    def ended(self, process, outcome=None):
+        """
+        Replaces a Process that stopped running with its ProcessRecord.
+        Called from the transfer threads (or the loop thread); a pid the engine already dropped or
+        replaced (cancel, restart) is left alone.
+        """
+        with self._lock:
+            if self.processes.get(process.pid) is not process:
+                return
+            self.processes[process.pid] = ProcessRecord(process, outcome)
+            self._records[process.pid] = None
+            self._evict()
+
+    def discard(self, pid):
+        """
+        Stops tracking a download (cancel, or a restart that replaces it).
+        Returns:
+            Process: Its Process or ProcessRecord, or None if it wasn't tracked.
+        """
+        with self._lock:
+            self._records.pop(pid, None)
+            return self._drop(pid)
+
+    def set_retention(self, retention):
+        with self._lock:
+            self.retention = max(0, int(retention))
+            self._evict()
+
+    def records(self):
+        """Number of ended downloads currently remembered."""
+        return len(self._records)
+
+    def _evict(self):
+        while len(self._records) > self.retention:
+            pid = next(iter(self._records))
+            del self._records[pid]
+            self._drop(pid)
+
+    def _drop(self, pid):
+        process = self.processes.pop(pid, None)
+        if process is not None and self.by_url.get(process.url) == pid:
+            del self.by_url[process.url]
+        return process
@@ -1,14 +1,24 @@
+import argparse
 import tkinter as tk
 from ui import ASPU_DownloadManager_UI
 
 """This is the main entry point for the ASPU Download Manager application."""
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ASPU Download Manager")
+    parser.add_argument("--attach", metavar="DAEMON_URL",
+                        help="drive a running daemon (e.g. http://127.0.0.1:8765) instead of downloading in-process")
+    args = parser.parse_args()
+
     # 1. Create the root window
     root = tk.Tk()
     
     # 2. Pass the root window to your UI class
-    app = ASPU_DownloadManager_UI(root)
+    engine = None
+    if args.attach:
+        import daemon
+        engine = daemon.RemoteEngine(args.attach)
+    app = ASPU_DownloadManager_UI(root, engine)
     
     # 3. Start the event loop
     root.mainloop()
@@ -18,4 +28,5 @@ test cases:
 1. 10 MB file: https://www.google.com/search?q=http://xcal1.vodafone.co.uk/10MB.zip
 2. 50 MB file: https://speed.hetzner.de/50MB.bin
 3. 100 MB file: https://speed.hetzner.de/100MB.bin
+Offline and repeatable: python bench.py suite (see bench.py)
 """
\ No newline at end of file
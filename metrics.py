@@ -0,0 +1,360 @@
+import bisect
+import json
+import threading
+import time
+
+"""
+Engine metrics: what the downloads are doing, for dashboards and logs rather than the UI.
+- Every Process carries a DownloadStats; its observations also feed the engine-wide Metrics,
+  so totals survive pauses, cancels and the Process objects being replaced on resume.
+- Recorded per download and globally: bytes written and bytes/sec, time to first byte (request
+  sent -> response headers), connection setup time, retries, queue wait, disk write latency and
+  the outcome. Worker utilization, queue depth and stalled downloads are read at pull time.
+- Nothing is recorded per network chunk: bytes and write latency are taken per disk write
+  (SegmentWriter drains up to 256 KB at a time), the rest per request.
+- Pull API: Metrics.snapshot() (a dict), Metrics.prometheus() (text exposition format).
+  MetricsLog appends a snapshot as one JSON line every few seconds.
+- Tracing: a tracer set with engine.set_tracer() is called as tracer(event, process, value) for
+  "request" (seconds to headers), "connect" (seconds), "chunk" (bytes received), "write" (seconds),
+  "retry" (backoff seconds) and "end" (outcome). Without one the chunk loop pays a None check.
+"""
+
+# Seconds: TTFB, connect, queue wait
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# Seconds per disk write
+WRITE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1)
+# Bytes/sec is averaged over this many whole seconds
+RATE_WINDOW = 5
+# A running download with no bytes written for this long counts as stalled
+STALL_SECONDS = 10.0
+
+OUTCOMES = ("finished", "paused", "cancelled", "error")
+
+
+class Histogram:
+    """Fixed-bucket histogram (Prometheus style). Not locked: callers hold the Metrics lock."""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (None if empty or past the last bound)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self):
+        return {"count": self.count, "sum": self.sum, "p50": self.quantile(0.5), "p99": self.quantile(0.99)}
+
+
+class RateWindow:
+    """Bytes per whole second for the last RATE_WINDOW seconds."""
+
+    __slots__ = ("seconds", "amounts")
+
+    def __init__(self):
+        self.seconds = [0] * (RATE_WINDOW + 1)
+        self.amounts = [0] * (RATE_WINDOW + 1)
+
+    def add(self, amount, now):
+        second = int(now)
+        slot = second % len(self.seconds)
+        if self.seconds[slot] != second:
+            self.seconds[slot] = second
+            self.amounts[slot] = 0
+        self.amounts[slot] += amount
+
+    def rate(self, now):
+        # The current second is still filling up, so it is left out
+        current = int(now)
+        return sum(amount for second, amount in zip(self.seconds, self.amounts)
+                   if current - RATE_WINDOW <= second < current) / RATE_WINDOW
+
+
+class DownloadStats:
+    """Measurements of one download, kept across the Process objects a pause/resume creates."""
+
+    __slots__ = ("registry", "lock", "queued_at", "started_at", "ended_at", "first_byte", "requests", "connections",
+                 "connect_seconds", "retries", "bytes", "writes", "write_seconds", "write_max",
+                 "last_write_at", "window", "outcome", "error")
+
+    def __init__(self, registry=None):
+        """
+        Args:
+            registry (Metrics): Engine-wide totals these observations also go to, or None.
+        """
+        self.registry = registry
+        # Segments of one download report from several threads
+        self.lock = threading.Lock()
+        self.queued_at = self.started_at = self.ended_at = None
+        self.first_byte = None
+        self.requests = self.connections = self.retries = self.bytes = self.writes = 0
+        self.connect_seconds = self.write_seconds = self.write_max = 0.0
+        self.last_write_at = None
+        self.window = RateWindow()
+        self.outcome = self.error = None
+
+    def queued(self):
+        self.queued_at = time.monotonic()
+
+    def started(self):
+        now = time.monotonic()
+        if self.registry is not None and self.queued_at is not None:
+            self.registry.observe("queue_wait", now - self.queued_at)
+        self.started_at = now
+        self.ended_at = self.outcome = self.error = None
+
+    def request(self, seconds):
+        """A request got its response headers after `seconds`."""
+        with self.lock:
+            self.requests += 1
+            if self.first_byte is None:
+                self.first_byte = seconds
+        if self.registry is not None:
+            self.registry.observe("ttfb", seconds)
+
+    def connected(self, seconds):
+        with self.lock:
+            self.connections += 1
+            self.connect_seconds += seconds
+        if self.registry is not None:
+            self.registry.observe("connect", seconds)
+
+    def retried(self):
+        with self.lock:
+            self.retries += 1
+        if self.registry is not None:
+            self.registry.count("retries")
+
+    def wrote(self, size, seconds):
+        now = time.monotonic()
+        with self.lock:
+            self.bytes += size
+            self.writes += 1
+            self.write_seconds += seconds
+            if seconds > self.write_max:
+                self.write_max = seconds
+            self.last_write_at = now
+            self.window.add(size, now)
+        if self.registry is not None:
+            self.registry.wrote(size, seconds, now)
+
+    def ended(self, outcome, error=None):
+        self.ended_at = time.monotonic()
+        self.outcome = outcome
+        self.error = error
+        if self.registry is not None:
+            self.registry.count(outcome)
+
+    def snapshot(self, now):
+        active_since = self.started_at
+        elapsed = ((self.ended_at or now) - active_since) if active_since is not None else 0.0
+        return {
+            "bytes": self.bytes,
+            "bytes_per_second": self.window.rate(now) if self.ended_at is None else 0.0,
+            "average_bytes_per_second": self.bytes / elapsed if elapsed > 0 else 0.0,
+            "time_to_first_byte": self.first_byte,
+            "requests": self.requests,
+            "connections": self.connections,
+            "connect_seconds": self.connect_seconds,
+            "retries": self.retries,
+            "queue_wait": (active_since or now) - self.queued_at if self.queued_at is not None else None,
+            "writes": self.writes,
+            "write_seconds": self.write_seconds,
+            "write_max": self.write_max,
+            "stalled": self.is_stalled(now),
+            "outcome": self.outcome,
+            "error": self.error,
+        }
+
+    def is_stalled(self, now):
+        if self.started_at is None or self.ended_at is not None:
+            return False
+        return now - max(self.last_write_at or 0.0, self.started_at) > STALL_SECONDS
+
+
+class Metrics:
+    """Engine-wide counters and histograms, plus the pull API over the engine's live downloads."""
+
+    def __init__(self, engine):
+        """
+        Args:
+            engine (DownloadEngine): Read at pull time for its processes, scheduler and connection pool.
+        """
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.counters = {name: 0 for name in ("bytes", "writes", "retries") + OUTCOMES}
+        self.histograms = {"ttfb": Histogram(LATENCY_BUCKETS), "connect": Histogram(LATENCY_BUCKETS),
+                           "queue_wait": Histogram(LATENCY_BUCKETS), "write": Histogram(WRITE_BUCKETS)}
+        self.window = RateWindow()
+        # Sum over finished runs of (run time), for worker utilization since start
+        self.busy_seconds = 0.0
+
+    def new_stats(self):
+        """A DownloadStats that reports into this registry (one per download, handed to each Process)."""
+        return DownloadStats(self)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms[name].observe(value)
+
+    def wrote(self, size, seconds, now):
+        with self._lock:
+            self.counters["bytes"] += size
+            self.counters["writes"] += 1
+            self.histograms["write"].observe(seconds)
+            self.window.add(size, now)
+
+    def run_finished(self, stats):
+        if stats.started_at is not None:
+            with self._lock:
+                self.busy_seconds += time.monotonic() - stats.started_at
+
+    def snapshot(self, downloads=True):
+        """
+        Returns:
+            dict: {"global": {...}, "downloads": [{"pid", "url", ...DownloadStats fields}, ...]}
+        """
+        now = time.monotonic()
+        processes = list(self.engine.processes.values())
+        queue_state = self.engine.scheduler.snapshot()
+        running = [process for process in processes if process.downloading]
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {name: histogram.snapshot() for name, histogram in self.histograms.items()}
+            rate = self.window.rate(now)
+            busy = self.busy_seconds
+        busy += sum(now - process.stats.started_at for process in running if process.stats.started_at is not None)
+        uptime = now - self.started
+        max_active = queue_state["max_active"]
+        result = {
+            "global": {
+                "uptime": uptime,
+                "bytes_per_second": rate,
+                "active": len(running),
+                "queued": len(queue_state["queued"]),
+                "max_active": max_active,
+                "worker_utilization": len(running) / max_active if max_active else 0.0,
+                "average_worker_utilization": busy / (uptime * max_active) if uptime and max_active else 0.0,
+                "stalled": sum(1 for process in running if process.stats.is_stalled(now)),
+                "connections": self.engine.connection_stats(),
+                **counters,
+                **histograms,
+            }
+        }
+        if downloads:
+            result["downloads"] = [{"pid": process.pid, "url": process.url, "running": process.downloading,
+                                    **process.stats.snapshot(now)} for process in processes]
+        return result
+
+    def prometheus(self):
+        """Renders the engine totals in the Prometheus text exposition format (version 0.0.4)."""
+        snapshot = self.snapshot(downloads=False)["global"]
+        lines = []
+
+        def metric(name, kind, help_text, value, labels=""):
+            lines.append(f"# HELP aspu_{name} {help_text}")
+            lines.append(f"# TYPE aspu_{name} {kind}")
+            lines.append(f"aspu_{name}{labels} {value}")
+
+        metric("bytes_total", "counter", "Bytes written to disk.", snapshot["bytes"])
+        metric("bytes_per_second", "gauge", f"Write rate over the last {RATE_WINDOW} s.", snapshot["bytes_per_second"])
+        metric("retries_total", "counter", "Reconnects after transient failures.", snapshot["retries"])
+        lines.append("# HELP aspu_downloads_total Downloads that ended, by outcome.")
+        lines.append("# TYPE aspu_downloads_total counter")
+        for outcome in OUTCOMES:
+            lines.append(f'aspu_downloads_total{{outcome="{outcome}"}} {snapshot[outcome]}')
+        metric("active_downloads", "gauge", "Downloads running now.", snapshot["active"])
+        metric("queued_downloads", "gauge", "Downloads waiting for a slot.", snapshot["queued"])
+        metric("stalled_downloads", "gauge", f"Running downloads with no data for {STALL_SECONDS:.0f} s.",
+               snapshot["stalled"])
+        metric("worker_utilization", "gauge", "Running downloads / max_active.", snapshot["worker_utilization"])
+        # Counted by the registry since the engine started: the pool's own counts drop as hosts leave the pool
+        metric("connections_total", "counter", "Connections opened.", snapshot["connect"]["count"])
+        metric("requests_total", "counter", "HTTP requests answered.", snapshot["ttfb"]["count"])
+        metric("connection_reuse_ratio", "gauge", "Requests that reused a pooled connection, over hosts still pooled.",
+               snapshot["connections"]["reuse_rate"])
+
+        with self._lock:
+            histograms = [(name, histogram.bounds, list(histogram.counts), histogram.sum, histogram.count)
+                          for name, histogram in self.histograms.items()]
+        helps = {"ttfb": "Request sent to response headers.", "connect": "Connection setup.",
+                 "queue_wait": "Time queued before starting.", "write": "One disk write."}
+        for name, bounds, counts, total, count in histograms:
+            full_name = f"aspu_{name}_seconds"
+            lines.append(f"# HELP {full_name} {helps[name]}")
+            lines.append(f"# TYPE {full_name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                lines.append(f'{full_name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{full_name}_bucket{{le="+Inf"}} {count}')
+            lines.append(f"{full_name}_sum {total}")
+            lines.append(f"{full_name}_count {count}")
+        return "\n".join(lines) + "\n"
+
+
+_local = threading.local()
+
+
+def bind(owner):
+    """
+    Names the download whose requests the current thread is sending, so connection setup time
+    measured deep in the HTTP library (see connection_opened) can be attributed. None unbinds.
+    """
+    _local.owner = owner
+
+
+def connection_opened(seconds):
+    """Called when a new connection took `seconds` to set up, on the thread that opened it."""
+    owner = getattr(_local, "owner", None)
+    if owner is not None:
+        owner.connected(seconds)
+
+
+class MetricsLog:
+    """Appends Metrics.snapshot() to a file as one JSON line every `interval` seconds, on its own thread."""
+
+    def __init__(self, metrics, path, interval=10.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = max(0.1, float(interval))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="aspu-metrics-log", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        line = json.dumps({"time": time.time(), **self.metrics.snapshot()})
+        with open(self.path, "a") as f:
+            f.write(line + "\n")
+
+    def close(self):
+        """Stops the thread and writes a last line, so short runs still leave their totals."""
+        self._stop.set()
+        self._thread.join()
+        self.write()
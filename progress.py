@@ -0,0 +1,82 @@
+import time
+from collections import namedtuple
+
+"""
+Progress aggregation between the download engine and whoever displays it.
+- Workers only bump byte counters on their Process (no callback, no Tk call per chunk).
+- A single consumer (the UI timer, the daemon) calls ProgressTracker.poll() at its own frame rate
+  and gets one sample per download that moved since the last poll, with speed and ETA worked out.
+"""
+
+ProgressSample = namedtuple("ProgressSample", "pid downloaded total percent speed eta")
+
+
+class ProgressTracker:
+
+    def __init__(self, engine, smoothing=0.3):
+        """
+        Args:
+            engine (DownloadEngine): Engine whose `processes` are polled.
+            smoothing (float): Weight of the newest speed reading in the moving average (0..1).
+        """
+        self.engine = engine
+        self.smoothing = smoothing
+        # pid -> [downloaded, timestamp, speed, was_downloading]
+        self._last = {}
+
+    def poll(self):
+        """
+        Reads every download's counters once.
+        Returns:
+            list: ProgressSample for each download that is running, moved or stopped since the previous poll.
+                  eta is in seconds, or None while the speed or size is unknown.
+        """
+        now = time.monotonic()
+        samples = []
+        for pid, process in list(self.engine.processes.items()):
+            downloaded, total, running = process.downloaded, process.total_size, process.downloading
+            last = self._last.get(pid)
+            if last is None:
+                # First sighting: no speed yet
+                self._last[pid] = last = [downloaded, now, 0.0, running]
+            elif downloaded == last[0] and not running and not last[3]:
+                # Idle since the previous poll (paused, finished or failed): nothing to redraw
+                continue
+            else:
+                elapsed = now - last[1]
+                if elapsed > 0:
+                    current = max(0, downloaded - last[0]) / elapsed
+                    last[2] = current if not last[2] else \
+                        self.smoothing * current + (1 - self.smoothing) * last[2]
+                last[0], last[1] = downloaded, now
+            last[3] = running
+
+            speed = last[2] if running else 0.0
+            percent = downloaded / total * 100 if total else 0.0
+            eta = (total - downloaded) / speed if total and speed else None
+            samples.append(ProgressSample(pid, downloaded, total, percent, speed, eta))
+
+        # Downloads the engine no longer tracks (cancelled) are dropped
+        for pid in list(self._last):
+            if pid not in self.engine.processes:
+                del self._last[pid]
+        return samples
+
+
+def format_speed(bytes_per_sec):
+    """Formats a transfer rate such as "1.4 MB/s"."""
+    for unit in ("B/s", "KB/s", "MB/s"):
+        if bytes_per_sec < 1024:
+            return f"{bytes_per_sec:.0f} {unit}" if unit == "B/s" else f"{bytes_per_sec:.1f} {unit}"
+        bytes_per_sec /= 1024
+    return f"{bytes_per_sec:.1f} GB/s"
+
+
+def format_eta(seconds):
+    """Formats seconds left as "m:ss" or "h:mm:ss"; "--" when unknown."""
+    if seconds is None:
+        return "--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
@@ -0,0 +1,78 @@
+import threading
+import time
+
+"""
+Token-bucket bandwidth limiting.
+- TokenBucket is a shared budget in bytes/sec (one global bucket, plus one per download).
+- Throttle is a per-transfer handle that batches chunk accounting, so the shared buckets are
+  locked about a hundred times a second per transfer instead of once per 8 KB chunk.
+- Callers get back a delay and sleep themselves (time.sleep or asyncio.sleep), never under a lock.
+"""
+
+class TokenBucket:
+
+    def __init__(self, rate=0):
+        """
+        Args:
+            rate (int): Bytes per second. 0 means unlimited.
+        """
+        self._lock = threading.Lock()
+        self.rate = 0
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        """Changes the budget live; transfers pick it up on their next reservation."""
+        with self._lock:
+            self.rate = max(0, int(rate or 0))
+            # A short burst allowance keeps the achieved rate close to the target after idle periods
+            self._tokens = min(self._tokens, self._burst())
+            self._updated = time.monotonic()
+
+    def reserve(self, amount):
+        """
+        Takes `amount` bytes from the bucket, going into debt if needed.
+        Returns:
+            float: Seconds the caller must wait before sending more.
+        """
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self._burst(), self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def _burst(self):
+        return max(self.rate / 10, 64 * 1024)
+
+
+class Throttle:
+    """Accounts one transfer's bytes against several buckets (e.g. global and per-download)."""
+
+    # Reserve once per ~10 ms worth of data at the tightest rate, within these bounds
+    MIN_QUANTUM = 16 * 1024
+    MAX_QUANTUM = 1024 * 1024
+
+    def __init__(self, *buckets):
+        self.buckets = [b for b in buckets if b is not None]
+        self._pending = 0
+
+    def consume(self, amount):
+        """
+        Records `amount` transferred bytes.
+        Returns:
+            float: Seconds to wait before reading more (0 almost always).
+        """
+        rates = [b.rate for b in self.buckets if b.rate]
+        if not rates:
+            self._pending = 0
+            return 0.0
+        self._pending += amount
+        quantum = min(max(min(rates) // 100, Throttle.MIN_QUANTUM), Throttle.MAX_QUANTUM)
+        if self._pending < quantum:
+            return 0.0
+        amount, self._pending = self._pending, 0
+        return max(b.reserve(amount) for b in self.buckets)
@@ -0,0 +1,132 @@
+import email.utils
+import random
+import time
+
+import requests
+import urllib3.exceptions
+
+"""
+Retry policy for transient network failures.
+- Connect errors, read timeouts, connections dropped mid-body, 5xx replies and 429 are retried;
+  anything else (404, a changed file, a full disk) fails at once.
+- Waits grow exponentially with full jitter (a random delay up to base * 2^n, capped), so many
+  downloads hit by the same outage don't all reconnect in the same instant.
+- A 429/503 with Retry-After waits what the server asked for instead.
+- The budget counts failures in a row: an attempt that got some bytes through starts it over, so a
+  long download on a flaky link keeps going while a dead server gives up after `attempts` tries.
+- The engines reconnect from the last byte on disk, so a retry never fetches good data twice.
+"""
+
+# Server asked for longer than this: give up instead of sitting in the queue
+MAX_RETRY_AFTER = 600.0
+
+
+class TransientError(IOError):
+    """A reply worth retrying (5xx, 429). retry_after is the server's requested wait in seconds, or None."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# What a requests/urllib3 transfer raises when the network, not the request, is at fault.
+# urllib3 errors show up unwrapped because bodies are read from response.raw.
+TRANSIENT_ERRORS = (
+    TransientError,
+    ConnectionError,
+    TimeoutError,
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    urllib3.exceptions.ProtocolError,
+    urllib3.exceptions.ReadTimeoutError,
+)
+
+
+class RetryPolicy:
+
+    def __init__(self, attempts=5, base_delay=1.0, max_delay=30.0):
+        """
+        Args:
+            attempts (int): Failures in a row tolerated before giving up (0 = never retry).
+            base_delay (float): Upper bound of the first wait, in seconds.
+            max_delay (float): Upper bound of any computed wait, in seconds.
+        """
+        self.attempts = max(0, int(attempts))
+        self.base_delay = max(0.0, float(base_delay))
+        self.max_delay = max(self.base_delay, float(max_delay))
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.get('retry_attempts', 5), settings.get('retry_base_delay', 1.0),
+                   settings.get('retry_max_delay', 30.0))
+
+    def delay(self, failures, retry_after=None):
+        """
+        Args:
+            failures (int): Failures in a row so far, including the one just seen (1 = first).
+            retry_after (float): Wait requested by the server, if any.
+        Returns:
+            float: Seconds to wait before the next attempt, or None if the budget is spent.
+        """
+        if failures > self.attempts:
+            return None
+        if retry_after is not None:
+            return retry_after if retry_after <= MAX_RETRY_AFTER else None
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (failures - 1)))
+
+
+class RetryState:
+    """Failure count of one connection (a segment, a single stream, a probe)."""
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.failures = 0
+
+    def next_delay(self, error, progressed):
+        """
+        Records a failed attempt.
+        Args:
+            error (Exception): What the attempt raised.
+            progressed (bool): True if the attempt wrote any bytes before failing.
+        Returns:
+            float: Seconds to wait before retrying, or None to give up and re-raise.
+        """
+        if progressed:
+            self.failures = 0
+        self.failures += 1
+        return self.policy.delay(self.failures, getattr(error, 'retry_after', None))
+
+
+def check_status(status_code, headers, expected=(200, 206)):
+    """
+    Raises TransientError for replies a later attempt may get past (429, 5xx other than 501/505), and a
+    plain IOError for any other status not in `expected` (404, 403...), so an error page is never saved as the file.
+    """
+    if status_code == 429 or 500 <= status_code <= 599 and status_code not in (501, 505):
+        raise TransientError(f"Server busy (HTTP {status_code})", parse_retry_after(headers.get('retry-after')))
+    if status_code not in expected:
+        raise IOError(f"Server replied HTTP {status_code}")
+
+
+def parse_retry_after(value):
+    """Reads a Retry-After header (seconds or an HTTP date). Returns seconds from now, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def describe(error):
+    """Short reason for the status line ("Connection lost", "HTTP 503"...)."""
+    if isinstance(error, TransientError):
+        return str(error)
+    if isinstance(error, (TimeoutError, requests.Timeout, urllib3.exceptions.ReadTimeoutError)):
+        return "Timed out"
+    return "Connection lost"
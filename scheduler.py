@@ -0,0 +1,230 @@
+import threading
+from urllib.parse import urlsplit
+
+"""
+DownloadScheduler decides which queued downloads may run.
+- Jobs wait in one queue ordered by priority, then by the user's order within a priority.
+- A job starts only while both the global active cap and its host's cap have room.
+- Limits, priorities and order can change at any time; the queue is re-dispatched right away.
+- Built for thousands of queued jobs: membership checks are O(1), a dispatch stops scanning once
+  nothing more can start, and exact positions are reported only for the front of the queue.
+"""
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Jobs further back than this are reported as position None ("queued") instead of a number that
+# would change, and be redrawn, every time any job ahead of them starts
+POSITION_LIMIT = 100
+
+
+class DownloadScheduler:
+
+    def __init__(self, launch, notify, max_active=5, max_per_host=4):
+        """
+        Args:
+            launch (callable): launch(pid) starts a job. Called outside the scheduler lock.
+            notify (callable): notify(pid, position) reports a job's new 1-based queue position,
+                or None once it is queued beyond POSITION_LIMIT.
+            max_active (int): Downloads allowed to run at once.
+            max_per_host (int): Downloads allowed to run at once against one host.
+        """
+        self._launch = launch
+        self._notify = notify
+        self.max_active = max(1, max_active)
+        self.max_per_host = max(1, max_per_host)
+        self._lock = threading.Lock()
+        self._queue = []        # [priority, pid, host] entries in run order
+        self._queued = {}       # pid -> its entry in _queue
+        self._queued_hosts = {} # host -> number of queued jobs
+        self._active = {}       # pid -> host
+        self._host_active = {}  # host -> number of running jobs
+        self._positions = {}    # pid -> last reported queue position (None = beyond POSITION_LIMIT)
+        self._ranked = set()    # pids last reported with a numeric position
+        self._fresh = []        # pids queued since the last dispatch, not reported yet
+
+    def enqueue(self, pid, url, priority=PRIORITY_NORMAL):
+        """Queues a job behind every job of the same or higher priority."""
+        self.enqueue_many([(pid, url)], priority)
+
+    def enqueue_many(self, jobs, priority=PRIORITY_NORMAL):
+        """Queues [(pid, url), ...] in order with a single dispatch (for bulk imports)."""
+        with self._lock:
+            for pid, url in jobs:
+                self._insert(pid, urlsplit(url).hostname or "", priority)
+        self._run_pending()
+
+    def remove(self, pid):
+        """
+        Drops a job that hasn't started yet.
+        Returns:
+            bool: True if the job was waiting in the queue.
+        """
+        with self._lock:
+            index = self._index(pid)
+            if index is None:
+                return False
+            self._unqueue(index)
+            self._positions.pop(pid, None)
+        self._run_pending()
+        return True
+
+    def remove_many(self, pids):
+        """
+        Drops many waiting jobs with one pass over the queue and a single dispatch.
+        Returns:
+            set: The pids that were waiting in the queue.
+        """
+        with self._lock:
+            removed = {pid for pid in pids if pid in self._queued}
+            if removed:
+                self._queue = [entry for entry in self._queue if entry[1] not in removed]
+                for pid in removed:
+                    host = self._queued.pop(pid)[2]
+                    self._queued_hosts[host] -= 1
+                    if not self._queued_hosts[host]:
+                        del self._queued_hosts[host]
+                    self._positions.pop(pid, None)
+        if removed:
+            self._run_pending()
+        return removed
+
+    def job_done(self, pid):
+        """Frees the slot of a job that finished, failed, paused or was cancelled."""
+        with self._lock:
+            host = self._active.pop(pid, None)
+            if host is not None:
+                self._host_active[host] -= 1
+                if not self._host_active[host]:
+                    del self._host_active[host]
+        self._run_pending()
+
+    def set_limits(self, max_active=None, max_per_host=None):
+        """Changes the caps at runtime. Lowering them lets running jobs finish; nothing is stopped."""
+        with self._lock:
+            if max_active is not None:
+                self.max_active = max(1, max_active)
+            if max_per_host is not None:
+                self.max_per_host = max(1, max_per_host)
+        self._run_pending()
+
+    def set_priority(self, pid, priority):
+        """Moves a queued job to the end of another priority level."""
+        with self._lock:
+            index = self._index(pid)
+            if index is None:
+                return
+            host = self._unqueue(index)[2]
+            self._insert(pid, host, priority)
+        self._run_pending()
+
+    def move(self, pid, offset):
+        """Moves a queued job `offset` places earlier (negative) or later (positive) within its priority."""
+        with self._lock:
+            index = self._index(pid)
+            if index is None:
+                return
+            entry = self._queue[index]
+            target = index
+            step = 1 if offset > 0 else -1
+            for _ in range(abs(offset)):
+                neighbour = target + step
+                if not 0 <= neighbour < len(self._queue) or self._queue[neighbour][0] != entry[0]:
+                    break
+                target = neighbour
+            self._queue.insert(target, self._queue.pop(index))
+        self._run_pending()
+
+    def is_scheduled(self, pid):
+        """True while the job is waiting or running under the scheduler."""
+        with self._lock:
+            return pid in self._active or pid in self._queued
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: {'queued': [pid, ...] in run order, 'active': [pid, ...], 'max_active': int, 'max_per_host': int}
+        """
+        with self._lock:
+            return {
+                'queued': [entry[1] for entry in self._queue],
+                'active': list(self._active),
+                'max_active': self.max_active,
+                'max_per_host': self.max_per_host
+            }
+
+    def _insert(self, pid, host, priority):
+        index = len(self._queue)
+        if self._queue and self._queue[-1][0] > priority:
+            # Appending behind the lowest priority is the common case; only a higher one needs the scan
+            for i, entry in enumerate(self._queue):
+                if entry[0] > priority:
+                    index = i
+                    break
+        entry = [priority, pid, host]
+        self._queue.insert(index, entry)
+        self._queued[pid] = entry
+        self._queued_hosts[host] = self._queued_hosts.get(host, 0) + 1
+        self._fresh.append(pid)
+
+    def _unqueue(self, index):
+        entry = self._queue.pop(index)
+        del self._queued[entry[1]]
+        host = entry[2]
+        self._queued_hosts[host] -= 1
+        if not self._queued_hosts[host]:
+            del self._queued_hosts[host]
+        return entry
+
+    def _index(self, pid):
+        entry = self._queued.get(pid)
+        # list.index matches the entry by identity first, at C speed
+        return None if entry is None else self._queue.index(entry)
+
+    def _run_pending(self):
+        """Starts whatever fits under the caps, then reports queue positions that changed."""
+        launches = []
+        moved = []
+        with self._lock:
+            # 1. Launch in queue order; stop as soon as the global cap is reached or every host
+            #    that still has queued jobs is at its own cap
+            started = []
+            saturated = set()
+            for index, (_, pid, host) in enumerate(self._queue):
+                if len(self._active) >= self.max_active or len(saturated) == len(self._queued_hosts):
+                    break
+                if host in saturated:
+                    continue
+                if self._host_active.get(host, 0) < self.max_per_host:
+                    self._active[pid] = host
+                    self._host_active[host] = self._host_active.get(host, 0) + 1
+                    self._positions.pop(pid, None)
+                    launches.append(pid)
+                    started.append(index)
+                else:
+                    saturated.add(host)
+            for index in reversed(started):
+                self._unqueue(index)
+
+            # 2. Exact positions for the front of the queue, None for the rest (once)
+            front = set()
+            for position, entry in enumerate(self._queue[:POSITION_LIMIT], start=1):
+                pid = entry[1]
+                front.add(pid)
+                if self._positions.get(pid) != position:
+                    self._positions[pid] = position
+                    moved.append((pid, position))
+            behind = [pid for pid in self._ranked if pid not in front]
+            behind.extend(pid for pid in self._fresh if pid not in front)
+            for pid in behind:
+                if pid in self._queued and self._positions.get(pid, 0) is not None:
+                    self._positions[pid] = None
+                    moved.append((pid, None))
+            self._ranked = front
+            self._fresh = []
+
+        for pid in launches:
+            self._launch(pid)
+        for pid, position in moved:
+            self._notify(pid, position)
@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import deque
+
+"""
+Work distribution for ranged downloads over one or more sources (the URL and its mirrors).
+- Every connection asks the planner for a range, fetches it from its source and asks again, until
+  nothing is left.
+- Ranges nobody has started go first. After that a connection that ran out of work steals: it takes
+  the tail of the range with the most expected time left, split in proportion to the two connections'
+  measured speeds, so one slow connection (or slow mirror) can't hold up the end of the download.
+- Once a range from a source has finished, its speed is known; a connection asking for more work
+  moves to the fastest source measured so far.
+- A mirror that fails for good is dropped: the unfinished part of its range goes back to the queue and
+  the connection carries on with another source. Only when no source is left does the download fail.
+- Shared by the thread engine (one thread per connection) and the asyncio engine (one coroutine per
+  connection); nothing here blocks or awaits.
+"""
+
+# Ranges expected to finish sooner than this are left alone: the bytes the victim's server has already
+# sent past the split are wasted, and a new request would barely start before the victim is done
+MIN_TIME_LEFT = 0.5
+
+
+class Source:
+    """One URL serving the file: the main URL or a mirror checked to have the same content."""
+
+    __slots__ = ("url", "validator", "alive", "connections", "bytes", "speed")
+
+    def __init__(self, url, validator=""):
+        """
+        Args:
+            url (str): Where to send range requests.
+            validator (str): This server's ETag / Last-Modified, sent as If-Range.
+        """
+        self.url = url
+        self.validator = validator
+        self.alive = True
+        self.connections = 0
+        # Bytes fetched from it by finished assignments, and their bytes/sec per connection (0 = not measured)
+        self.bytes = 0
+        self.speed = 0.0
+
+
+class Assignment:
+    """A range one connection is fetching from one source. writer.stop shrinks when another connection steals."""
+
+    __slots__ = ("source", "start", "stop", "writer", "began", "base")
+
+    def __init__(self, source, start, stop):
+        self.source = source
+        self.start = start
+        self.stop = stop
+        self.writer = None
+        self.began = None
+        self.base = start
+
+    def current_speed(self, now):
+        if self.writer is None or self.began is None or now <= self.began:
+            return 0.0
+        return (self.writer.position - self.base) / (now - self.began)
+
+
+class SegmentPlanner:
+
+    def __init__(self, ranges, sources, alignment=0, min_split=256 * 1024):
+        """
+        Args:
+            ranges (list): [(start, stop), ...] to fetch, already cut into one piece per connection.
+            sources (list): Source objects; the first one is the main URL.
+            alignment (int): If set, split points are rounded up to multiples of it (checksum pieces).
+            min_split (int): A steal must take at least this many bytes, or it isn't worth a new request.
+        """
+        self.sources = sources
+        self.alignment = alignment
+        self.min_split = min_split
+        self._pending = deque(ranges)
+        self._active = []
+        self._lock = threading.Lock()
+
+    def take(self, previous=None):
+        """
+        Next range for a connection.
+        Args:
+            previous (Assignment): What this connection just finished, if anything.
+        Returns:
+            Assignment: The range to fetch, or None when the connection can stop.
+        """
+        with self._lock:
+            source = self._pick_source(previous)
+            if source is None:
+                return None
+            if self._pending:
+                start, stop = self._pending.popleft()
+                return self._assign(source, start, stop)
+            return self._steal(source)
+
+    def begin(self, assignment, writer):
+        """Makes a started range visible to thieves."""
+        with self._lock:
+            assignment.writer = writer
+            assignment.began = time.monotonic()
+            assignment.base = writer.position
+            self._active.append(assignment)
+
+    def finish(self, assignment):
+        """The connection is done with this range (fetched, stolen down to nothing, paused or cancelled)."""
+        with self._lock:
+            self._release(assignment)
+            source = assignment.source
+            speed = assignment.current_speed(time.monotonic())
+            if assignment.writer is not None:
+                source.bytes += assignment.writer.position - assignment.base
+            if speed:
+                # Smoothed, so one range slowed by a reconnect doesn't make a good source look bad
+                source.speed = speed if not source.speed else (source.speed + speed) / 2
+
+    def fail(self, assignment):
+        """
+        The source of this range failed for good.
+        Returns:
+            bool: True if other sources remain (the unfinished part is queued again and the connection
+                  may continue), False if this was the last one and the download has to fail.
+        """
+        with self._lock:
+            self._release(assignment)
+            source = assignment.source
+            others = [other for other in self.sources if other.alive and other is not source]
+            if not others:
+                return False
+            source.alive = False
+            writer = assignment.writer
+            start = writer.position if writer is not None else assignment.start
+            stop = writer.stop if writer is not None else assignment.stop
+            if stop > start:
+                self._pending.appendleft((start, stop))
+            return True
+
+    def _release(self, assignment):
+        if assignment in self._active:
+            self._active.remove(assignment)
+        assignment.source.connections -= 1
+
+    def _pick_source(self, previous):
+        alive = [source for source in self.sources if source.alive]
+        if not alive:
+            return None
+        measured = [source for source in alive if source.speed]
+        if previous is not None and measured:
+            # Carry on with the fastest source seen so far
+            return max(measured, key=lambda source: source.speed)
+        if previous is not None and previous.source.alive:
+            return previous.source
+        # First range of a connection: fewest connections first, in list order (the main URL wins ties)
+        return min(alive, key=lambda source: source.connections)
+
+    def _assign(self, source, start, stop):
+        source.connections += 1
+        return Assignment(source, start, stop)
+
+    def _steal(self, source):
+        """Splits the active range with the most expected time left; None if no split is worth making."""
+        now = time.monotonic()
+        speed = source.speed
+        best = None
+        for victim in self._active:
+            writer = victim.writer
+            left = writer.stop - writer.position
+            # A range that just started has no speed of its own yet: assume its source's
+            victim_speed = victim.current_speed(now) or victim.source.speed
+            # Equal finishing times: the thief takes left * its speed / (both speeds)
+            share = left * speed / (speed + victim_speed) if speed and victim_speed else left / 2
+            at = writer.stop - int(share)
+            if self.alignment:
+                at = -(-at // self.alignment) * self.alignment
+            time_left = left / victim_speed if victim_speed else float("inf")
+            if writer.stop - at < self.min_split or time_left < MIN_TIME_LEFT:
+                continue
+            if best is None or time_left > best[0]:
+                best = (time_left, victim, at)
+        if best is None:
+            return None
+
+        _, victim, at = best
+        stop = victim.writer.stop
+        start = victim.writer.split(at, self.alignment)
+        if start >= stop:
+            return None
+        return self._assign(source, start, stop)
@@ -1,55 +1,287 @@
 import json
 import os
+import sqlite3
+import threading
+import time
 from pathlib import Path
 
 HISTORY_FILE = "history.json"
+HISTORY_DB = "history.db"
 SETTINGS_FILE = "settings.json"
 
-"""Storage module for managing data files."""
+"""
+Storage module for managing data files.
+- Download history lives in SQLite (history.db): appending is one INSERT, lookups use indexes,
+  and WAL journaling keeps the file intact if the app dies mid-write.
+- A legacy history.json is imported once, the first time the database is opened.
+- Settings are parsed once into a shared Settings object (storage.settings) that tracks settings.json's mtime.
+"""
 
-def load_history():
-    """Returns the list of downloaded files from JSON."""
+_db_lock = threading.Lock()
+_db = None
+_db_path = None
+
+def _connect():
+    """Returns the shared history connection, creating and migrating the database on first use."""
+    global _db, _db_path
+    if _db is not None and _db_path == HISTORY_DB:
+        return _db
+
+    db = sqlite3.connect(HISTORY_DB, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            url TEXT,
+            path TEXT,
+            status TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            completed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS history_url ON history(url);
+        CREATE INDEX IF NOT EXISTS history_name ON history(name COLLATE NOCASE);
+        CREATE INDEX IF NOT EXISTS history_completed ON history(completed_at);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """)
+    _migrate_json(db)
+    _db, _db_path = db, HISTORY_DB
+    return db
+
+def _migrate_json(db):
+    """Imports the old history.json once. The JSON file is left untouched."""
+    if db.execute("SELECT 1 FROM meta WHERE key = 'migrated_json'").fetchone():
+        return
+    rows = []
     if os.path.exists(HISTORY_FILE):
         try:
             with open(HISTORY_FILE, "r") as f:
-                return json.load(f)
+                legacy = json.load(f)
         except (json.JSONDecodeError, IOError):
-            return []
-    return []
-
-def save_entry(name, size_bytes):
-    """Formats and appends a new download entry to the history."""
-    data = load_history()
-    
-    # Format size to MB
-    size_mb = f"{size_bytes // (1024 * 1024)} MB"
-    
-    new_entry = {
-        "Name": name,
-        "Status": "Finished",
-        "Size": size_mb,
+            legacy = []
+        # Old entries only kept "N MB", so their byte sizes are approximate
+        migrated_at = os.path.getmtime(HISTORY_FILE)
+        for entry in legacy:
+            try:
+                size_bytes = int(float(str(entry.get("Size", "0")).split()[0]) * 1024 * 1024)
+            except ValueError:
+                size_bytes = 0
+            rows.append((entry.get("Name", "Unknown"), entry.get("Status", "Finished"), size_bytes, migrated_at))
+    with db:
+        db.executemany("INSERT INTO history (name, status, size_bytes, completed_at) VALUES (?, ?, ?, ?)", rows)
+        db.execute("INSERT INTO meta (key, value) VALUES ('migrated_json', ?)", (str(len(rows)),))
+
+def format_size(size_bytes):
+    """Formats a byte count the way the download table shows it, e.g. "12.34 MB"."""
+    return f"{size_bytes / (1024 * 1024):.2f} MB"
+
+def save_entry(name, size_bytes, url=None, path=None, status="Finished"):
+    """Appends a finished download to the history with its exact size in bytes."""
+    with _db_lock:
+        db = _connect()
+        with db:
+            db.execute(
+                "INSERT INTO history (name, url, path, status, size_bytes, completed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (name, url, path, status, size_bytes, time.time()))
+
+def query_history(offset=0, limit=100, search=None, newest_first=True):
+    """
+    Returns one page of history entries.
+    Args:
+        offset (int): Number of matching entries to skip.
+        limit (int): Page size.
+        search (str): Optional text matched against the file name and URL.
+        newest_first (bool): Order by completion time, newest first (default) or oldest first.
+    Returns:
+        list: dicts with id, name, url, path, status, size_bytes and completed_at.
+    """
+    where, params = _search_clause(search)
+    order = "DESC" if newest_first else "ASC"
+    with _db_lock:
+        rows = _connect().execute(
+            f"SELECT * FROM history {where} ORDER BY completed_at {order}, id {order} LIMIT ? OFFSET ?",
+            params + [limit, offset]).fetchall()
+    return [dict(row) for row in rows]
+
+def count_history(search=None):
+    """Returns how many history entries match `search` (all of them if None)."""
+    where, params = _search_clause(search)
+    with _db_lock:
+        return _connect().execute(f"SELECT COUNT(*) FROM history {where}", params).fetchone()[0]
+
+def _search_clause(search):
+    if not search:
+        return "", []
+    pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return "WHERE name LIKE ? ESCAPE '\\' OR url LIKE ? ESCAPE '\\'", [pattern, pattern]
+
+def load_history():
+    """Returns every history entry, oldest first, in the table's display format."""
+    entries = query_history(limit=-1, newest_first=False)
+    return [{
+        "Name": entry["name"],
+        "Status": entry["status"],
+        "Size": format_size(entry["size_bytes"]),
         "Progress": "100%"
-    }
-    
-    data.append(new_entry)
-    
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+    } for entry in entries]
+
+
+DEFAULT_SETTINGS = {
+    "save_path": os.path.join(Path.home(), "Downloads"),
+    "open_on_finish": False,
+    # Engine tunables
+    "engine": "thread",
+    "segments": 4,
+    "connections_per_host": 16,
+    "max_active_downloads": 5,
+    "max_downloads_per_host": 4,
+    "global_rate_limit": 0,
+    "download_rate_limit": 0,
+    "chunk_size": 0,
+    # Reconnects after network errors, 5xx and 429: failures in a row allowed, backoff bounds in seconds
+    "retry_attempts": 5,
+    "retry_base_delay": 1.0,
+    "retry_max_delay": 30.0,
+    # Append a metrics snapshot as a JSON line to this file every metrics_interval seconds ("" = off)
+    "metrics_log": "",
+    "metrics_interval": 10,
+    # Ended downloads the engine remembers (progress, metrics, resume); older ones are forgotten
+    "finished_retention": 1000,
+    # Look for <url>.meta4 / .sha256 / .md5 next to each download and verify against it
+    "checksum_sidecar": False,
+    # Headless daemon
+    "daemon_host": "127.0.0.1",
+    "daemon_port": 8765
+}
+
+
+class Settings:
+    """
+    In-memory settings shared by the engine, the UI and the daemon.
+    - settings.json is parsed once; afterwards it is re-read only when its mtime changes
+      (checked at most every CHECK_INTERVAL seconds), e.g. after a hand edit.
+    - update() writes the file and notifies subscribers with the keys that changed.
+    """
+
+    # Seconds between two stat() calls on settings.json
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = None
+        self._path = None
+        self._stamp = None
+        self._checked = 0.0
+        self._subscribers = []
+
+    def get(self, key, default=None):
+        return self._current().get(key, default)
+
+    def __getitem__(self, key):
+        return self._current()[key]
+
+    def snapshot(self):
+        """Returns a copy of every setting, defaults included."""
+        return dict(self._current())
+
+    def update(self, changes):
+        """Merges `changes` into the settings, saves them and notifies subscribers."""
+        with self._lock:
+            values = dict(self._load_locked())
+            values.update(changes)
+            changed = self._store_locked(values)
+        self._notify(changed)
+
+    def replace(self, values):
+        """Saves `values` as the whole settings file (missing keys fall back to the defaults)."""
+        with self._lock:
+            self._load_locked()
+            changed = self._store_locked(values)
+        self._notify(changed)
+
+    def subscribe(self, callback):
+        """callback(changed) is called with {key: new value} after each save or reload that changed something."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _current(self):
+        changed = {}
+        with self._lock:
+            now = time.monotonic()
+            if self._values is None or self._path != SETTINGS_FILE or now - self._checked >= Settings.CHECK_INTERVAL:
+                self._checked = now
+                if self._values is not None and self._path == SETTINGS_FILE and self._stamp != self._file_stamp():
+                    changed = self._reload_locked()
+                else:
+                    self._load_locked()
+            values = self._values
+        self._notify(changed)
+        return values
+
+    def _load_locked(self):
+        """Loads the file the first time, or again when SETTINGS_FILE points somewhere else."""
+        if self._values is None or self._path != SETTINGS_FILE:
+            self._reload_locked()
+        return self._values
+
+    def _reload_locked(self):
+        old = self._values or {}
+        self._path = SETTINGS_FILE
+        self._stamp = self._file_stamp()
+        values = dict(DEFAULT_SETTINGS)
+        if self._stamp is not None:
+            try:
+                with open(SETTINGS_FILE, "r") as f:
+                    values.update(json.load(f))
+            except (json.JSONDecodeError, IOError):
+                # Half-written by another program: keep what we had, retry on the next change
+                if self._values is not None:
+                    return {}
+        self._values = values
+        return {key: value for key, value in values.items() if old and old.get(key) != value}
+
+    def _store_locked(self, values):
+        old = self._values
+        merged = dict(DEFAULT_SETTINGS)
+        merged.update(values)
+        # Write a temp file and rename it, so readers never see a half-written settings.json
+        temp_path = SETTINGS_FILE + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(values, f)
+        os.replace(temp_path, SETTINGS_FILE)
+        self._values = merged
+        self._stamp = self._file_stamp()
+        return {key: value for key, value in merged.items() if old.get(key) != value}
+
+    def _notify(self, changed):
+        if not changed:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(changed)
+
+    @staticmethod
+    def _file_stamp():
+        try:
+            stat = os.stat(SETTINGS_FILE)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
 
+settings = Settings()
 
 def save_settings(settings_dict):
-    """Saves user preferences to a JSON file."""
-    with open(SETTINGS_FILE, "w") as f:
-        json.dump(settings_dict, f)
+    """Saves user preferences to the JSON file (through the shared Settings object)."""
+    settings.replace(settings_dict)
 
 def load_settings():
-    """Loads user preferences or returns defaults from config.py."""
-    if os.path.exists(SETTINGS_FILE):
-        with open(SETTINGS_FILE, "r") as f:
-            return json.load(f)
-    
-    # Fallback to config.py defaults if no settings file exists
-    return {
-        "save_path": os.path.join(Path.home(), "Downloads"),
-        "open_on_finish": False
-    }
\ No newline at end of file
+    """Returns a copy of the user preferences, with defaults for anything settings.json doesn't set."""
+    return settings.snapshot()
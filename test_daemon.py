@@ -0,0 +1,71 @@
+import json
+import unittest
+import urllib.error
+import urllib.request
+
+import bench
+import daemon
+from bench_server import BenchServer, random_payload
+from test_downloads import DownloadTestCase
+
+"""
+Checks of the daemon's HTTP API: what it accepts, and that bad input gets a 400 rather than a wrong
+status or no reply. The daemon runs on a free local port with a throwaway settings file.
+"""
+
+
+class DaemonApiTests(DownloadTestCase):
+
+    def setUp(self):
+        super().setUp()
+        bench.use_temp_settings(self.work_dir)
+        self.app = daemon.DownloadDaemon(port=0)
+        self.app.start()
+
+    def tearDown(self):
+        self.app.shutdown()
+        super().tearDown()
+
+    def post(self, path, body):
+        """Returns (status, decoded JSON reply)."""
+        request = urllib.request.Request(self.app.address + path, data=json.dumps(body).encode(),
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_move_offset_is_validated(self):
+        # Port 9 (discard) refuses connections: the job stays around without downloading anything
+        status, job = self.post("/downloads", {"url": "http://127.0.0.1:9/file.bin"})
+        self.assertEqual(status, 201)
+        for offset in ("abc", [1], {"by": 1}, 1.5, True, None):
+            with self.subTest(offset=offset):
+                status, reply = self.post(f"/downloads/{job['id']}/move", {"offset": offset})
+                self.assertEqual(status, 400, reply)
+        for offset in (-1, 2):
+            with self.subTest(offset=offset):
+                self.assertEqual(self.post(f"/downloads/{job['id']}/move", {"offset": offset})[0], 200)
+        self.assertEqual(self.post("/downloads/999/move", {"offset": 1})[0], 404)
+
+    def test_priority_reorders_the_queue(self):
+        payload = random_payload(4 * bench.MB)
+        files = {f"file_{i}.bin": payload for i in range(3)}
+        with BenchServer(files, rate_per_connection=64 * bench.KB) as server:
+            self.assertEqual(self.post("/limits", {"max_active": 1})[0], 200)
+            jobs = [self.post("/downloads", {"url": server.url(name)})[1] for name in files]
+            status, job = self.post(f"/downloads/{jobs[2]['id']}/priority", {"priority": "high"})
+            self.assertEqual((status, job["priority"]), (200, 0))
+            # The first job holds the only slot; the high one now waits ahead of the normal one
+            pids = [self.app._job(job["id"]).pid for job in jobs]
+            self.assertEqual(self.app.engine.scheduler.snapshot()["queued"], [pids[2], pids[1]])
+            self.assertEqual(self.post(f"/downloads/{jobs[1]['id']}/priority", {"priority": "urgent"})[0], 400)
+            self.assertEqual(self.post("/downloads", {"url": server.url("file_0.bin") + "?again",
+                                                      "priority": "low"})[1]["priority"], 2)
+            for job in jobs:
+                self.post(f"/downloads/{job['id']}/cancel", {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,368 @@
+import asyncio
+import gc
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import unittest
+import weakref
+
+import async_downloader
+import bench
+import downloader
+import integrity
+import lifecycle
+import storage
+from bench_server import BenchServer, random_payload
+
+"""
+Pass/fail checks of both download engines against the local bench server (no network, no Tk).
+- The scenarios the benches print as ok / FAIL, as assertions; bench.py stays for timings and throughput.
+- Every test runs once per engine, as a subTest.
+- Run with: python -m unittest test_downloads
+"""
+
+MB = bench.MB
+KB = bench.KB
+ENGINES = {"thread": downloader.DownloadEngine, "async": async_downloader.AsyncDownloadEngine}
+# Short waits keep the run quick; the backoff shape is the same as with the defaults
+RETRY_SETTINGS = {"retry_attempts": 6, "retry_base_delay": 0.05, "retry_max_delay": 0.5}
+
+
+class DownloadTestCase(unittest.TestCase):
+    """Gives every test a throwaway download folder and settings file."""
+
+    def setUp(self):
+        self._settings_file = storage.SETTINGS_FILE
+        self._work_dir = tempfile.TemporaryDirectory()
+        self.work_dir = self._work_dir.name
+
+    def tearDown(self):
+        storage.SETTINGS_FILE = self._settings_file
+        self._work_dir.cleanup()
+
+    def download(self, engine_name, urls, mirrors=None, **settings):
+        """
+        Runs `urls` to the end on a new engine with the given settings.
+        Returns:
+            tuple: (seconds, results) as in bench.run_engine.
+        """
+        self.clear()
+        bench.use_temp_settings(self.work_dir, **settings)
+        engine = ENGINES[engine_name]()
+        try:
+            return bench.run_engine(engine, urls, mirrors)
+        finally:
+            engine.close()
+
+    def clear(self):
+        """Empties the download folder, so each run starts from nothing."""
+        for name in os.listdir(self.work_dir):
+            os.remove(os.path.join(self.work_dir, name))
+
+    def leftovers(self):
+        return sorted(name for name in os.listdir(self.work_dir) if name != "settings.json")
+
+    def assertSaved(self, name, payload, result):
+        self.assertNotIn("error", result)
+        with open(os.path.join(self.work_dir, name), "rb") as f:
+            self.assertTrue(f.read() == payload, f"{name} differs from what the server sent")
+
+
+class DownloadTests(DownloadTestCase):
+    """Plain single-stream and segmented downloads (bench.py segments)."""
+
+    def test_segments_reassemble_the_file(self):
+        payload = random_payload(4 * MB)
+        for engine_name in ENGINES:
+            for segments in (1, 4, 8):
+                with self.subTest(engine=engine_name, segments=segments), \
+                        BenchServer({"file.bin": payload}) as server:
+                    _, results = self.download(engine_name, [server.url("file.bin")], segments=segments)
+                    self.assertSaved("file.bin", payload, results[0])
+                    self.assertEqual(self.leftovers(), ["file.bin"])
+
+    def test_empty_file_is_saved(self):
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name), BenchServer({"empty.bin": b""}) as server:
+                _, results = self.download(engine_name, [server.url("empty.bin")])
+                self.assertEqual(results[0].get("size"), 0, results[0].get("error"))
+                self.assertSaved("empty.bin", b"", results[0])
+
+    def test_async_process_start_blocks_until_done(self):
+        payload = random_payload(2 * MB)
+        with BenchServer({"file.bin": payload}) as server:
+            bench.use_temp_settings(self.work_dir)
+            engine = async_downloader.AsyncDownloadEngine()
+            try:
+                result = {}
+                callbacks = {'on_status': lambda t: None, 'on_finish': lambda f, p, s: result.update(size=s),
+                             'on_error': lambda e: result.update(error=e)}
+                process = engine._create_process(server.url("file.bin"), callbacks, 0)
+                process.start()
+                self.assertEqual(result.get("size"), len(payload), result.get("error"))
+                self.assertSaved("file.bin", payload, result)
+
+                async def start_on_the_loop():
+                    process.start()
+                # Waiting on the loop from the loop itself would never return
+                with self.assertRaises(RuntimeError):
+                    asyncio.run_coroutine_threadsafe(start_on_the_loop(), engine.loop).result(timeout=5)
+            finally:
+                engine.close()
+
+
+class FaultTests(DownloadTestCase):
+    """Retries, backoff and reconnects (bench.py faults)."""
+
+    def setUp(self):
+        super().setUp()
+        self.payload = random_payload(4 * MB)
+
+    def test_dropped_connections_are_resumed(self):
+        for engine_name in ENGINES:
+            for accept_ranges in (True, False):
+                with self.subTest(engine=engine_name, ranged=accept_ranges), \
+                        BenchServer({"flaky.bin": self.payload}, accept_ranges=accept_ranges) as server:
+                    server.drop_connections(0.3, seed=len(engine_name))
+                    _, results = self.download(engine_name, [server.url("flaky.bin")], **RETRY_SETTINGS)
+                    self.assertSaved("flaky.bin", self.payload, results[0])
+
+    def test_transient_statuses_are_retried(self):
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name), BenchServer({"file.bin": self.payload}) as server:
+                server.fail(503, 502, 500)
+                _, results = self.download(engine_name, [server.url("file.bin")], **RETRY_SETTINGS)
+                self.assertSaved("file.bin", self.payload, results[0])
+
+    def test_retry_after_is_honoured(self):
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name), BenchServer({"file.bin": self.payload}) as server:
+                server.fail(429, retry_after=1)
+                elapsed, results = self.download(engine_name, [server.url("file.bin")], **RETRY_SETTINGS)
+                self.assertSaved("file.bin", self.payload, results[0])
+                self.assertGreaterEqual(elapsed, 1)
+
+    def test_retry_budget_runs_out(self):
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name), BenchServer({"file.bin": self.payload}) as server:
+                server.fail(*[503] * (RETRY_SETTINGS["retry_attempts"] + 1))
+                _, results = self.download(engine_name, [server.url("file.bin")], **RETRY_SETTINGS)
+                self.assertIn("error", results[0])
+
+    def test_error_page_is_not_saved(self):
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name), BenchServer({"file.bin": self.payload}) as server:
+                _, results = self.download(engine_name, [server.url("missing.bin")], **RETRY_SETTINGS)
+                self.assertIn("HTTP 404", results[0].get("error", ""))
+                self.assertEqual(self.leftovers(), [])
+
+
+class RateLimitTests(DownloadTestCase):
+    """Achieved rates against global and per-download caps on an unthrottled server (bench.py ratelimit)."""
+
+    TOLERANCE = 0.1
+
+    def setUp(self):
+        super().setUp()
+        self.files = {f"rate_{i}.bin": random_payload(2 * MB) for i in range(3)}
+
+    def assertRate(self, engine_name, count, global_rate=0, download_rate=0):
+        self.clear()
+        with BenchServer(self.files) as server:
+            target, achieved, results = bench.measure_rate(server, ENGINES[engine_name], list(self.files)[:count],
+                                                           self.work_dir, global_rate, download_rate)
+        self.assertFalse([result for result in results if "error" in result])
+        self.assertLessEqual(abs(achieved / target - 1), self.TOLERANCE,
+                             f"achieved {achieved / MB:.2f} MB/s, target {target / MB:.2f} MB/s")
+
+    def test_global_cap_is_shared(self):
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name):
+                self.assertRate(engine_name, 3, global_rate=6 * MB)
+
+    def test_per_download_cap(self):
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name):
+                self.assertRate(engine_name, 1, download_rate=2 * MB)
+
+    def test_tighter_of_both_caps_wins(self):
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name):
+                self.assertRate(engine_name, 3, global_rate=3 * MB, download_rate=2 * MB)
+
+
+class ChecksumTests(DownloadTestCase):
+    """End-to-end verification (bench.py verify)."""
+
+    def setUp(self):
+        super().setUp()
+        self.payload = random_payload(4 * MB)
+        self.files = {"file.bin": self.payload,
+                      "file.bin.meta4": bench._metalink("file.bin", self.payload, 256 * KB)}
+
+    def test_wrong_digest_fails_after_one_download_again(self):
+        for engine_name in ENGINES:
+            for segments in (1, 4):
+                with self.subTest(engine=engine_name, segments=segments), BenchServer(self.files) as server:
+                    _, results = self.download(engine_name, [server.url("file.bin") + "#sha256=" + "0" * 64],
+                                               segments=segments)
+                    self.assertIn("mismatch", results[0].get("error", ""))
+                    # Neither the .part file nor the journal is kept
+                    self.assertEqual(self.leftovers(), [])
+                    self.assertLess(server.httpd.bytes_sent, 2.5 * len(self.payload))
+
+    def test_corrupted_byte_is_fetched_again(self):
+        digest = hashlib.sha256(self.payload).hexdigest()
+        for engine_name in ENGINES:
+            for segments in (1, 4):
+                with self.subTest(engine=engine_name, segments=segments), BenchServer(self.files) as server:
+                    server.corrupt("file.bin", len(self.payload) // 3)
+                    _, results = self.download(engine_name, [server.url("file.bin") + f"#sha256={digest}"],
+                                               segments=segments)
+                    self.assertSaved("file.bin", self.payload, results[0])
+
+    def test_bad_piece_is_the_only_range_fetched_again(self):
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name), BenchServer(self.files) as server:
+                server.corrupt("file.bin", len(self.payload) // 3)
+                _, results = self.download(engine_name, [server.url("file.bin")], segments=4,
+                                           checksum_sidecar=True)
+                self.assertSaved("file.bin", self.payload, results[0])
+                self.assertLess(server.httpd.bytes_sent, len(self.payload) + 2 * 256 * KB)
+
+    def test_malformed_metalink_is_ignored(self):
+        sha = hashlib.sha256(self.payload).hexdigest()
+        entry = '<metalink xmlns="urn:ietf:params:xml:ns:metalink"><file name="file.bin">{}</file></metalink>'
+        malformed = {
+            "empty hash": '<hash type="sha-256"/>',
+            "not hex": '<hash type="sha-256">not a digest</hash>',
+            "pieces without length": f'<pieces type="sha-256"><hash>{sha}</hash></pieces>',
+            "empty piece hash": '<pieces type="sha-256" length="1024"><hash/></pieces>',
+            "truncated xml": '<hash type="sha-256">',
+        }
+        for label, body in malformed.items():
+            with self.subTest(label):
+                self.assertIsNone(integrity.parse_sidecar(".meta4", entry.format(body), "file.bin"))
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name), \
+                    BenchServer({"file.bin": self.payload,
+                                 "file.bin.meta4": entry.format(malformed["pieces without length"]).encode()}) as server:
+                _, results = self.download(engine_name, [server.url("file.bin")], checksum_sidecar=True)
+                self.assertSaved("file.bin", self.payload, results[0])
+
+
+class MirrorTests(DownloadTestCase):
+    """Mirrors that must be left out or given up on (bench.py mirrors)."""
+
+    def setUp(self):
+        super().setUp()
+        self.payload = random_payload(4 * MB)
+        self.files = {"file.bin": self.payload}
+
+    def test_impostor_and_unreachable_mirrors_are_skipped(self):
+        # Same size, different bytes: its ETag differs, so it must not be used
+        impostor = {"file.bin": random_payload(len(self.payload))}
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name), BenchServer(self.files) as main, BenchServer(impostor) as other:
+                _, results = self.download(engine_name, [main.url("file.bin")],
+                                           [other.url("file.bin"), "http://127.0.0.1:9/file.bin"],
+                                           segments=4, retry_attempts=2, retry_base_delay=0.05)
+                self.assertSaved("file.bin", self.payload, results[0])
+
+    def test_ranges_move_off_a_mirror_that_dies(self):
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name), BenchServer(self.files, rate_per_connection=4 * MB) as main, \
+                    BenchServer(dict(self.files), rate_per_connection=4 * MB) as dying:
+                # Every body is cut short, then the file disappears: its ranges must move to the main URL
+                dying.drop_connections(1.0, seed=1)
+                threading.Timer(0.5, dying.httpd.files.clear).start()
+                _, results = self.download(engine_name, [main.url("file.bin")], [dying.url("file.bin")],
+                                           segments=4, retry_attempts=2, retry_base_delay=0.05)
+                self.assertSaved("file.bin", self.payload, results[0])
+
+
+class LifecycleTests(DownloadTestCase):
+    """What the engine keeps after downloads end (bench.py lifecycle)."""
+
+    def test_ended_downloads_leave_only_records(self):
+        files = {f"done_{i}.bin": random_payload(KB) for i in range(20)}
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name), BenchServer(files) as server:
+                self.clear()
+                bench.use_temp_settings(self.work_dir, max_active_downloads=8, max_downloads_per_host=8,
+                                        finished_retention=5)
+                engine = ENGINES[engine_name]()
+                try:
+                    _, results = bench.run_engine(engine, [server.url(name) for name in files])
+                    self.assertTrue(all("size" in result for result in results))
+                    # Let the last workers leave their finally blocks
+                    time.sleep(0.2)
+                    self.assertLessEqual(len(engine.processes), 5)
+                    self.assertFalse([process for process in engine.processes.values()
+                                      if not isinstance(process, lifecycle.ProcessRecord)])
+                finally:
+                    engine.close()
+
+    def test_many_downloads_keep_bounded_state(self):
+        count, retention = 2000, 100
+        payload = random_payload(KB)
+        files = {f"done_{i}.bin": payload for i in range(count)}
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name), BenchServer(files) as server:
+                self.clear()
+                bench.use_temp_settings(self.work_dir, max_active_downloads=32, max_downloads_per_host=32,
+                                        finished_retention=retention)
+                engine = ENGINES[engine_name]()
+                # Every Process that ends, without keeping any of them alive
+                ended, ends = weakref.WeakSet(), []
+
+                def tracer(event, process, value):
+                    if event == "end":
+                        ended.add(process)
+                        ends.append(value)
+
+                engine.set_tracer(tracer)
+                try:
+                    _, results = bench.run_engine(engine, [server.url(name) for name in files])
+                    self.assertEqual(sum(1 for result in results if "size" in result), count)
+                    self.assertEqual(len(ends), count)
+                    time.sleep(0.2)
+                    gc.collect()
+                    self.assertLessEqual(len(engine.processes), retention)
+                    self.assertEqual(len(ended), 0, f"{len(ended)} of {count} Process objects still alive")
+                finally:
+                    engine.close()
+
+    def test_cancel_after_pause_removes_partial_files(self):
+        payload = random_payload(8 * MB)
+        for engine_name in ENGINES:
+            with self.subTest(engine=engine_name), \
+                    BenchServer({"slow.bin": payload}, rate_per_connection=256 * KB) as server:
+                self.clear()
+                bench.use_temp_settings(self.work_dir, segments=4)
+                engine = ENGINES[engine_name]()
+                paused = threading.Event()
+                callbacks = {'on_status': lambda t: None, 'on_finish': lambda f, p, s: None,
+                             'on_error': lambda e: None, 'on_pause': paused.set, 'on_cancel': lambda: None}
+                try:
+                    pid = engine.start_download(server.url("slow.bin"), callbacks)
+                    while engine.processes[pid].downloaded == 0:
+                        time.sleep(0.05)
+                    engine.pause_download(pid)
+                    # A pause must let go of the slow server's sockets at once, not at its next block
+                    self.assertTrue(paused.wait(1))
+                    self.assertEqual(self.leftovers(), ["slow.bin.part", "slow.bin.part.journal"])
+                    engine.cancel_download(pid)
+                    # Nothing reports a cancelled pause: wait for the files to go
+                    deadline = time.monotonic() + 5
+                    while self.leftovers() and time.monotonic() < deadline:
+                        time.sleep(0.05)
+                    self.assertEqual(self.leftovers(), [])
+                finally:
+                    engine.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,25 +8,54 @@ from pathlib import Path
 # Import custom logic modules
 import storage
 import downloader
+import progress
 
 """
 This class manages the graphical user interface for the download manager.
 - This class contains all UI elements, event handlers, and integrates with the DownloadEngine.
 - All meet-in-the-middle logic between UI and backend is handled here.
+- URL lists can be imported in bulk, and Start/Pause/Cancel act on every selected row.
 """
 
 class ASPU_DownloadManager_UI:
-    def __init__(self, root):
+    # Progress, speed and ETA are redrawn at most this often, however fast the downloads run
+    FRAME_MS = 100
+    # History rows are fetched from storage this many at a time, as the user scrolls
+    HISTORY_PAGE = 200
+    # Typing in the search box waits this long for a pause before querying
+    SEARCH_DELAY_MS = 250
+
+    def __init__(self, root, engine=None):
+        """
+        Args:
+            root (tk.Tk): Main window.
+            engine: A DownloadEngine, or a daemon.RemoteEngine to drive a running daemon. Defaults to the settings' engine.
+        """
         self.root = root
         self.root.title("ASPU Download Manager - IDM Pro (Modular)")
         self.root.geometry("850x550")
         self.root.configure(bg="#f0f0f0")
 
-        self.engine = downloader.DownloadEngine()
+        self.engine = engine or downloader.create_engine()
         self.current_url = "" # Stores the last added URL for convenience
 
+        # Progress pipeline: workers only bump counters, one timer draws the rows that changed
+        self.progress_tracker = progress.ProgressTracker(self.engine)
+        self.rows_by_pid = {}   # engine pid -> tree item
+        self.rows_by_url = {}   # url -> tree item, so adding a URL twice finds the existing row
+        self._bulk_items = set() # rows started as part of a batch: no pop-up when they end
+        self._shown = {}        # tree item -> {column: text currently displayed}
+
+        # History paging state: rows loaded so far for the current search, and whether more exist
+        self._history_search = ""
+        self._history_offset = 0
+        self._history_done = False
+        self._page_pending = False
+        self._search_job = None
+
         self._setup_ui()
         self._load_history_to_view()
+        self.root.after(self.FRAME_MS, self._refresh_progress)
 
     def _setup_ui(self):
         style = ttk.Style()
@@ -40,18 +69,28 @@ class ASPU_DownloadManager_UI:
         btn_style = {"bg": "#ffffff", "relief": "flat", "font": ("Segoe UI", 9), "padx": 12}
 
         tk.Button(toolbar, text="➕ Add URL", command=self.add_url_popup, **btn_style).pack(side="left", padx=5, pady=5)
+        tk.Button(toolbar, text="📋 Import", command=self.import_urls_popup, **btn_style).pack(side="left", padx=5)
         tk.Button(toolbar, text="▶ Start", command=self.start_selected_in_GUI, **btn_style).pack(side="left", padx=5)
         tk.Button(toolbar, text="⏸ Pause", command=self.pause_selected_in_GUI, **btn_style).pack(side="left", padx=5)
         tk.Button(toolbar, text="🛑 Cancel", command=self.cancel_selected_in_GUI, **btn_style).pack(side="left", padx=5)
+        tk.Button(toolbar, text="⬆ Up", command=lambda: self.move_selected_in_queue(-1), **btn_style).pack(side="left", padx=5)
+        tk.Button(toolbar, text="⬇ Down", command=lambda: self.move_selected_in_queue(1), **btn_style).pack(side="left", padx=5)
         tk.Button(toolbar, text="⚙️ Settings", command=self.open_settings , **btn_style).pack(side="left", padx=5)
 
+        # Search filters the history in storage, not the rows already in the table
+        self.var_search = tk.StringVar()
+        self.var_search.trace_add("write", self._on_search_changed)
+        tk.Entry(toolbar, textvariable=self.var_search, width=22).pack(side="right", padx=(0, 10))
+        tk.Label(toolbar, text="🔍", bg="#ffffff").pack(side="right")
+
         self.tree_frame = tk.Frame(self.root)
         self.tree_frame.pack(fill="both", expand=True, padx=10, pady=10)
 
-        cols = ("Name", "Status", "Size", "Progress")
+        cols = ("Name", "Status", "Size", "Progress", "Speed", "ETA")
         self.tree = ttk.Treeview(self.tree_frame, columns=cols, show="headings")
         # Bind selection event: Calls update_task_control whenever a user clicks a row
         self.tree.bind("<<TreeviewSelect>>", self.update_task_control)
+        self.tree.bind("<Control-a>", self.select_all)
         
         self.tree.heading("Name", text="File Name")
         self.tree.column("Name", width=250, stretch=True)
@@ -61,12 +100,16 @@ class ASPU_DownloadManager_UI:
         self.tree.column("Size", width=100, anchor="center")
         self.tree.heading("Progress", text="Progress")
         self.tree.column("Progress", width=200, stretch=True) 
+        self.tree.heading("Speed", text="Speed")
+        self.tree.column("Speed", width=90, anchor="center")
+        self.tree.heading("ETA", text="ETA")
+        self.tree.column("ETA", width=70, anchor="center")
         
         self.tree.pack(fill="both", expand=True, side="left")
         
-        scroller = ttk.Scrollbar(self.tree_frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscroll=scroller.set)
-        scroller.pack(side="right", fill="y")
+        self.scroller = ttk.Scrollbar(self.tree_frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscroll=self._on_tree_scroll)
+        self.scroller.pack(side="right", fill="y")
 
         self.status_frame = tk.LabelFrame(self.root, text=" Task Control ", bg="#ffffff", padx=10, pady=10)
         self.status_frame.pack(fill="x", padx=10, pady=10)
@@ -80,62 +123,181 @@ class ASPU_DownloadManager_UI:
     def add_url_popup(self):
         url = simpledialog.askstring("New Download", "URL Address:")
         if url:
-            filename = url.split('/')[-1] if '/' in url else "Unknown_File"
-            # Requirement: When URL is added, it shows up in treeview immediately
-            # We store the URL in a custom 'tag' named 'url' for later retrieval
-            item_id = self.tree.insert("", "end", values=(filename, "Queued", "---", "[░░░░░░░░░░] 0%"), tags=("url_storage",))
-            # Tag the item with the actual URL so Start can find it later
-            self.tree.item(item_id, values=(filename, "Queued", "---", "[░░░░░░░░░░] 0%"))
-            # Storing the URL in the item's private data (tags aren't just for PIDs!)
-            self.tree.set(item_id, "Name", filename)
-            self.tree.item(item_id, tags=("queued", url)) 
-            self.lbl_status.config(text=f"Added to list: {filename}")
+            url = url.strip()
+            if self._find_row(url) is not None:
+                # Already listed: show that row instead of adding a second one
+                item_id = self.rows_by_url[url]
+                self.tree.selection_set(item_id)
+                self.tree.see(item_id)
+                self.lbl_status.config(text=f"Already in list: {self.tree.set(item_id, 'Name')}")
+                return
+            item_id = self._add_url_row(url)
+            self.lbl_status.config(text=f"Added to list: {self.tree.set(item_id, 'Name')}")
+
+    def import_urls_popup(self):
+        """Dialog to paste (or load from a file) a list of URLs, one per line, and add them all at once."""
+        import_win = tk.Toplevel(self.root)
+        import_win.title("Import URLs")
+        import_win.geometry("560x420")
+        import_win.configure(bg="#f0f0f0", padx=15, pady=15)
+        import_win.transient(self.root)
+        import_win.grab_set()
+
+        tk.Label(import_win, text="One URL per line (lines starting with # are ignored):",
+                 font=("Segoe UI", 10, "bold"), bg="#f0f0f0").pack(anchor="w")
+        text_frame = tk.Frame(import_win)
+        text_frame.pack(fill="both", expand=True, pady=5)
+        txt_urls = tk.Text(text_frame, wrap="none", font=("Consolas", 9))
+        text_scroller = ttk.Scrollbar(text_frame, orient="vertical", command=txt_urls.yview)
+        txt_urls.configure(yscrollcommand=text_scroller.set)
+        text_scroller.pack(side="right", fill="y")
+        txt_urls.pack(side="left", fill="both", expand=True)
+        var_start_now = tk.BooleanVar(value=True)
+
+        def load_file():
+            path = filedialog.askopenfilename(parent=import_win, filetypes=[("Text files", "*.txt"), ("All files", "*.*")])
+            if path:
+                try:
+                    with open(path, "r", encoding="utf-8", errors="replace") as f:
+                        txt_urls.insert("end", f.read().rstrip("\n") + "\n")
+                except OSError as e:
+                    messagebox.showerror("Error", f"Could not read {path}: {e}", parent=import_win)
+
+        def import_and_close():
+            urls = downloader.parse_url_list(txt_urls.get("1.0", "end").splitlines())
+            import_win.destroy()
+            self.import_urls(urls, var_start_now.get())
+
+        buttons = tk.Frame(import_win, bg="#f0f0f0")
+        buttons.pack(fill="x")
+        tk.Button(buttons, text="From file...", command=load_file).pack(side="left")
+        tk.Checkbutton(buttons, text="Start now", variable=var_start_now, bg="#f0f0f0").pack(side="left", padx=10)
+        tk.Button(buttons, text="Add", command=import_and_close, bg="#2ecc71", fg="white", width=12).pack(side="right")
+
+    def import_urls(self, urls, start=True):
+        """
+        Adds a row for every URL not already listed and optionally starts them as one batch.
+        Args:
+            urls (list): URLs to add, in order (already cleaned by downloader.parse_url_list).
+            start (bool): Queue them in the engine right away instead of waiting for Start.
+        """
+        new_items = []
+        for url in urls:
+            if self._find_row(url) is None:
+                # The batch goes on top in list order, above earlier downloads
+                new_items.append(self._add_url_row(url, len(new_items)))
+        if start and new_items:
+            self._start_items(new_items)
+        skipped = len(urls) - len(new_items)
+        self.lbl_status.config(text=f"Imported {len(new_items)} URL(s)" +
+                               (f", {skipped} already in list" if skipped else ""))
+
+    def _add_url_row(self, url, index=0):
+        filename = url.split('/')[-1] if '/' in url else "Unknown_File"
+        # Requirement: When URL is added, it shows up in treeview immediately
+        # Live rows go on top (newest first, like the history); history pages are appended below them
+        # Tag the item with the actual URL so Start can find it later (tags aren't just for PIDs!)
+        item_id = self.tree.insert("", index, values=(filename, "Queued", "---", "[░░░░░░░░░░] 0%"),
+                                   tags=("queued", url))
+        self.rows_by_url[url] = item_id
+        return item_id
+
+    def _find_row(self, url):
+        """The row already listing `url`, or None (O(1) through rows_by_url)."""
+        item_id = self.rows_by_url.get(url)
+        if item_id is not None and not self.tree.exists(item_id):
+            del self.rows_by_url[url]
+            return None
+        return item_id
+
+    def _forget_row(self, item_id):
+        """Deletes a download row and everything indexed by it."""
+        tags = self.tree.item(item_id, "tags")
+        if len(tags) > 1 and self.rows_by_url.get(tags[1]) == item_id:
+            del self.rows_by_url[tags[1]]
+        if len(tags) > 2:
+            self.rows_by_pid.pop(tags[2], None)
+        self._shown.pop(item_id, None)
+        self._bulk_items.discard(item_id)
+        self.tree.delete(item_id)
+
+    def select_all(self, event=None):
+        self.tree.selection_set(self.tree.get_children())
+        return "break"
 
     def start_selected_in_GUI(self):
         selected_item = self.tree.selection()
         if not selected_item:
             messagebox.showwarning("System", "Please select a file from the list to start!")
             return
+        self._start_items(selected_item)
+
+    def _start_items(self, item_ids):
+        """Starts (or resumes) the given rows with one engine call; history rows are skipped."""
+        # 1. Collect the URL of each download row
+        # We assume the second tag is the URL (based on _add_url_row)
+        rows = [(item_id, self.tree.item(item_id, "tags")) for item_id in item_ids]
+        rows = [(item_id, tags) for item_id, tags in rows if len(tags) > 1]
+        if not rows:
+            return
 
-        item_id = selected_item[0]
-        item_tags = self.tree.item(item_id, "tags")
-        
-        # Retrieve the URL from our storage tag
-        # We assume the second tag is the URL (based on add_url_popup)
-        url = item_tags[1] 
-
-        # Define Callbacks
-        callbacks = {
-            'on_progress': lambda p: self.root.after(0, lambda: self._update_row_progress(item_id, p)),
-            'on_status': lambda t: self.root.after(0, lambda: self.tree.set(item_id, "Status", t)),
+        # 2. Send work to engine; a batch is reported in the status bar instead of one pop-up per file
+        if len(rows) > 1:
+            self._bulk_items.update(item_id for item_id, _ in rows)
+        pids = self.engine.start_downloads([(tags[1], self._callbacks_for(item_id)) for item_id, tags in rows])
+
+        # 3. Update tags to include the live PID so Pause/Cancel can work
+        for (item_id, tags), pid in zip(rows, pids):
+            if len(tags) > 2:
+                self.rows_by_pid.pop(tags[2], None)
+            self.rows_by_pid[pid] = item_id
+            self.tree.item(item_id, tags=("active", tags[1], pid))
+            self.tree.set(item_id, "Status", "Downloading...")
+
+    def _callbacks_for(self, item_id):
+        # No on_progress: _refresh_progress polls the engine instead
+        return {
+            'on_status': lambda t: self.root.after(0, lambda: self.tree.exists(item_id) and self.tree.set(item_id, "Status", t)),
             'on_finish': lambda f, p, s: self._on_finish_callback(item_id, f, p, s),
             'on_error': lambda e: self._on_error_callback(item_id, e),
-            'on_pause': lambda: self.tree.set(item_id, "Status", "Paused"),
+            'on_pause': lambda: self.root.after(0, lambda: self.tree.exists(item_id) and self.tree.set(item_id, "Status", "Paused")),
             'on_cancel': lambda: self._on_cancel_callback(item_id)
         }
 
-        # Send work to engine
-        pid = self.engine.start_download(url, callbacks)
-
-        # Update tags to include the live PID so Pause/Cancel can work
-        self.tree.item(item_id, tags=("active", url, pid))
-        self.tree.set(item_id, "Status", "Downloading...")
-
-    def _update_row_progress(self, item_id, percent):
-        """Calculates text bar and updates the specific row."""
+    def _refresh_progress(self):
+        """One UI frame: reads every download's counters once and redraws only what changed."""
+        selected = self.tree.selection()
+        focused = selected[0] if len(selected) == 1 else None
+        for sample in self.progress_tracker.poll():
+            item_id = self.rows_by_pid.get(sample.pid)
+            if item_id is not None and self.tree.exists(item_id):
+                self._update_row_progress(item_id, sample, item_id == focused)
+        self.root.after(self.FRAME_MS, self._refresh_progress)
+
+    def _update_row_progress(self, item_id, sample, focused=False):
+        """Calculates text bar, speed and ETA and updates the cells of the row that changed."""
         bar_length = 10
-        filled = int(percent / 10)
+        filled = int(sample.percent / 10)
         bar_str = "█" * filled + "░" * (bar_length - filled)
-        display_text = f"[{bar_str}] {int(percent)}%"
-        
-        # 1. Always update the table row
-        self.tree.set(item_id, "Progress", display_text)
+        cells = {
+            "Progress": f"[{bar_str}] {int(sample.percent)}%",
+            "Speed": progress.format_speed(sample.speed) if sample.speed else "",
+            "ETA": progress.format_eta(sample.eta) if sample.speed else ""
+        }
+        if sample.total:
+            cells["Size"] = f"{sample.total / (1024*1024):.2f} MB"
+
+        # 1. Update only the table cells whose text changed since the last frame
+        shown = self._shown.setdefault(item_id, {})
+        for column, text in cells.items():
+            if shown.get(column) != text:
+                self.tree.set(item_id, column, text)
+                shown[column] = text
         
         # 2. Update the Task Bar ONLY if this row is the one the user is looking at
-        selected = self.tree.selection()
-        if selected and selected[0] == item_id:
-            self.progress.configure(value=percent)
-            self.lbl_status.config(text=f"Downloading: {int(percent)}%")
+        if focused:
+            self.progress.configure(value=sample.percent)
+            self.lbl_status.config(text=f"Downloading: {int(sample.percent)}% - {cells['Speed'] or '...'} - ETA {cells['ETA'] or '--'}")
 
     def update_task_control(self, event=None):
         """Updates the bottom Task Bar based on the currently selected row."""
@@ -145,6 +307,10 @@ class ASPU_DownloadManager_UI:
             self.progress.configure(value=0)
             self.lbl_status.config(text="System Ready")
             return
+        if len(selected) > 1:
+            self.progress.configure(value=0)
+            self.lbl_status.config(text=f"{len(selected)} items selected")
+            return
 
         item_id = selected[0]
         item_data = self.tree.item(item_id, "values")
@@ -170,15 +336,11 @@ class ASPU_DownloadManager_UI:
             messagebox.showinfo("Selection", "Please select a download to cancel.")
             return
         
-        item_id = selected_item[0]
-        tags = self.tree.item(item_id, "tags")
-        
-        # If it's active, it will have a PID at index 2
-        if len(tags) > 2:
-            pid = tags[2]
-            self.engine.cancel_download(pid)
-        
-        self.tree.delete(item_id)
+        # If a row is active, it will have a PID at index 2
+        tags = [self.tree.item(item_id, "tags") for item_id in selected_item]
+        self.engine.cancel_downloads([item_tags[2] for item_tags in tags if len(item_tags) > 2])
+        for item_id in selected_item:
+            self._forget_row(item_id)
 
     def pause_selected_in_GUI(self):
         selected_item = self.tree.selection() 
@@ -186,39 +348,65 @@ class ASPU_DownloadManager_UI:
             messagebox.showinfo("Selection", "Please select a download to pause.")
             return
         
-        item_id = selected_item[0]
-        tags = self.tree.item(item_id, "tags")
-        
-        if len(tags) > 2:
-            pid = tags[2]
-            self.engine.pause_download(pid)
+        rows = [(item_id, self.tree.item(item_id, "tags")) for item_id in selected_item]
+        rows = [(item_id, tags[2]) for item_id, tags in rows if len(tags) > 2]
+        self.engine.pause_downloads([pid for _, pid in rows])
+        for item_id, _ in rows:
             self.tree.set(item_id, "Status", "Paused")
 
+    def move_selected_in_queue(self, offset):
+        """Moves the selected queued download earlier or later in the engine's queue."""
+        selected_item = self.tree.selection()
+        if not selected_item:
+            return
+
+        tags = self.tree.item(selected_item[0], "tags")
+        if len(tags) > 2:
+            self.engine.move_download(tags[2], offset)
+
     # --- UI Update Helpers ---
     
     def _on_finish_callback(self, item_id, filename, save_path, total_size):
         def _update():
+            if not self.tree.exists(item_id):
+                return
+            self._shown.pop(item_id, None)
             self.tree.set(item_id, "Status", "Finished")
             self.tree.set(item_id, "Progress", "[██████████] 100%")
+            self.tree.set(item_id, "Speed", "")
+            self.tree.set(item_id, "ETA", "")
             # Formatting size to MB for better readability
-            self.tree.set(item_id, "Size", f"{total_size / (1024*1024):.2f} MB")
+            self.tree.set(item_id, "Size", storage.format_size(total_size))
             
-            storage.save_entry(filename, total_size)
-            if storage.load_settings().get("open_on_finish", True):
+            if not self.engine.records_history:
+                url = self.tree.item(item_id, "tags")[1]
+                storage.save_entry(filename, total_size, url=url, path=save_path)
+            if item_id in self._bulk_items:
+                # Part of a batch: a pop-up (or a viewer window) per file would bury the user
+                self._bulk_items.discard(item_id)
+                self.lbl_status.config(text=f"Download Finished: {filename}")
+                return
+            if storage.settings.get("open_on_finish", True):
                 self.open_file(save_path)
             messagebox.showinfo("Success", f"Download Finished: {filename}")
         self.root.after(0, _update)
 
     def _on_error_callback(self, item_id, error_msg):
         def _update():
+            if not self.tree.exists(item_id):
+                return
             self.tree.set(item_id, "Status", "Error")
+            if item_id in self._bulk_items:
+                self._bulk_items.discard(item_id)
+                self.lbl_status.config(text=f"Failed: {self.tree.set(item_id, 'Name')}: {error_msg}")
+                return
             messagebox.showerror("Error", f"Failed: {error_msg}")
         self.root.after(0, _update)
 
     def _on_cancel_callback(self, item_id):
         def _update():
             if self.tree.exists(item_id):
-                self.tree.delete(item_id)
+                self._forget_row(item_id)
             self.progress.configure(value=0)
             self.lbl_status.config(text="Download Canceled & Deleted")
         self.root.after(0, _update)
@@ -226,17 +414,28 @@ class ASPU_DownloadManager_UI:
     def open_settings(self):
         settings_win = tk.Toplevel(self.root)
         settings_win.title("Settings")
-        settings_win.geometry("400x300")
+        settings_win.geometry("400x720")
         settings_win.configure(bg="#f0f0f0", padx=20, pady=20)
         settings_win.transient(self.root)
         settings_win.grab_set()
 
-        # 1. Load current settings from JSON to show in the UI
-        current_data = storage.load_settings()
+        # 1. Current settings from the shared in-memory copy (no file read)
+        current_data = storage.settings.snapshot()
         
         # Create local UI variables
         var_open_finish = tk.BooleanVar(value=current_data.get("open_on_finish", False))
         var_save_path = tk.StringVar(value=current_data.get("save_path", os.path.join(Path.home(), "Downloads")))
+        var_engine = tk.StringVar(value=current_data.get("engine", "thread"))
+        var_max_active = tk.IntVar(value=current_data.get("max_active_downloads", 5))
+        var_max_per_host = tk.IntVar(value=current_data.get("max_downloads_per_host", 4))
+        var_segments = tk.IntVar(value=current_data.get("segments", 4))
+        var_retries = tk.IntVar(value=current_data.get("retry_attempts", 5))
+        var_sidecar = tk.BooleanVar(value=current_data.get("checksum_sidecar", False))
+        # Stored in bytes, edited in KB (0 = adaptive)
+        var_chunk_size = tk.IntVar(value=current_data.get("chunk_size", 0) // 1024)
+        # Stored in bytes/sec, edited in KB/s
+        var_global_rate = tk.IntVar(value=current_data.get("global_rate_limit", 0) // 1024)
+        var_download_rate = tk.IntVar(value=current_data.get("download_rate_limit", 0) // 1024)
 
         # --- UI Elements ---
         tk.Label(settings_win, text="Post-Download Action:", font=("Segoe UI", 10, "bold"), bg="#f0f0f0").pack(anchor="w")
@@ -256,13 +455,55 @@ class ASPU_DownloadManager_UI:
                 
         tk.Button(path_frame, text="Browse...", command=browse_path).pack(side="right")
 
+        tk.Frame(settings_win, height=1, bg="#cccccc").pack(fill="x", pady=15)
+        tk.Label(settings_win, text="Download Engine (applies after restart):", font=("Segoe UI", 10, "bold"), bg="#f0f0f0").pack(anchor="w")
+        tk.Radiobutton(settings_win, text="Thread pool", variable=var_engine, value="thread", bg="#f0f0f0").pack(anchor="w")
+        tk.Radiobutton(settings_win, text="Asyncio (many concurrent downloads)", variable=var_engine, value="async", bg="#f0f0f0").pack(anchor="w")
+
+        tk.Frame(settings_win, height=1, bg="#cccccc").pack(fill="x", pady=15)
+        tk.Label(settings_win, text="Queue Limits:", font=("Segoe UI", 10, "bold"), bg="#f0f0f0").pack(anchor="w")
+        limits_frame = tk.Frame(settings_win, bg="#f0f0f0")
+        limits_frame.pack(fill="x", pady=5)
+        tk.Label(limits_frame, text="Active downloads:", bg="#f0f0f0").grid(row=0, column=0, sticky="w")
+        tk.Spinbox(limits_frame, from_=1, to=500, width=6, textvariable=var_max_active).grid(row=0, column=1, padx=5)
+        tk.Label(limits_frame, text="Per server:", bg="#f0f0f0").grid(row=0, column=2, sticky="w")
+        tk.Spinbox(limits_frame, from_=1, to=500, width=6, textvariable=var_max_per_host).grid(row=0, column=3, padx=5)
+        tk.Label(limits_frame, text="Segments:", bg="#f0f0f0").grid(row=1, column=0, sticky="w", pady=(5, 0))
+        tk.Spinbox(limits_frame, from_=1, to=32, width=6, textvariable=var_segments).grid(row=1, column=1, padx=5, pady=(5, 0))
+        tk.Label(limits_frame, text="Read KB (0 = auto):", bg="#f0f0f0").grid(row=1, column=2, sticky="w", pady=(5, 0))
+        tk.Spinbox(limits_frame, from_=0, to=4096, width=6, textvariable=var_chunk_size).grid(row=1, column=3, padx=5, pady=(5, 0))
+        tk.Label(limits_frame, text="Retries:", bg="#f0f0f0").grid(row=2, column=0, sticky="w", pady=(5, 0))
+        tk.Spinbox(limits_frame, from_=0, to=100, width=6, textvariable=var_retries).grid(row=2, column=1, padx=5, pady=(5, 0))
+        tk.Checkbutton(settings_win, text="Verify against published checksums (.sha256 / .md5 / .meta4)",
+                       variable=var_sidecar, bg="#f0f0f0").pack(anchor="w")
+
+        tk.Frame(settings_win, height=1, bg="#cccccc").pack(fill="x", pady=15)
+        tk.Label(settings_win, text="Speed Limits (KB/s, 0 = unlimited):", font=("Segoe UI", 10, "bold"), bg="#f0f0f0").pack(anchor="w")
+        rates_frame = tk.Frame(settings_win, bg="#f0f0f0")
+        rates_frame.pack(fill="x", pady=5)
+        tk.Label(rates_frame, text="All downloads:", bg="#f0f0f0").grid(row=0, column=0, sticky="w")
+        tk.Spinbox(rates_frame, from_=0, to=10_000_000, increment=100, width=8, textvariable=var_global_rate).grid(row=0, column=1, padx=5)
+        tk.Label(rates_frame, text="Each download:", bg="#f0f0f0").grid(row=0, column=2, sticky="w")
+        tk.Spinbox(rates_frame, from_=0, to=10_000_000, increment=100, width=8, textvariable=var_download_rate).grid(row=0, column=3, padx=5)
+
         # 2. Updated Save Logic
         def save_and_exit():
-            new_settings = {
+            # Keys this dialog doesn't edit are kept by update()
+            storage.settings.update({
                 "open_on_finish": var_open_finish.get(),
-                "save_path": var_save_path.get()
-            }
-            storage.save_settings(new_settings)
+                "save_path": var_save_path.get(),
+                "engine": var_engine.get(),
+                "max_active_downloads": var_max_active.get(),
+                "max_downloads_per_host": var_max_per_host.get(),
+                "segments": var_segments.get(),
+                "retry_attempts": var_retries.get(),
+                "checksum_sidecar": var_sidecar.get(),
+                "chunk_size": var_chunk_size.get() * 1024,
+                "global_rate_limit": var_global_rate.get() * 1024,
+                "download_rate_limit": var_download_rate.get() * 1024
+            })
+            # The engine is subscribed to the settings: queue and speed limits apply immediately,
+            # segments and read size from the next download on
             self.lbl_status.config(text="Settings updated successfully.")
             settings_win.destroy()
 
@@ -270,17 +511,54 @@ class ASPU_DownloadManager_UI:
                   bg="#2ecc71", fg="white", width=15).pack(pady=20)
     
     def _load_history_to_view(self):
-        """Fetches data from storage.py and updates the table."""
-        for row in self.tree.get_children():
+        """Replaces the history rows with the first page for the current search. Live downloads stay."""
+        for row in self.tree.tag_has("history"):
             self.tree.delete(row)
-        
+        self._history_offset = 0
+        self._history_done = False
+        self._load_history_page()
+
+    def _load_history_page(self):
+        """Appends the next HISTORY_PAGE history rows, newest first, from storage.py."""
+        self._page_pending = False
+        if self._history_done:
+            return
+
         # Load safely from storage module
         try:
-            history = storage.load_history()
-            for item in history:
-                self.tree.insert("", "end", values=(item["Name"], item["Status"], item["Size"], item["Progress"]))
+            entries = storage.query_history(self._history_offset, self.HISTORY_PAGE, self._history_search)
         except Exception as e:
             print(f"Error loading history: {e}")
+            self._history_done = True
+            return
+
+        for entry in entries:
+            self.tree.insert("", "end", values=(entry["name"], entry["status"],
+                                                storage.format_size(entry["size_bytes"]), "100%"),
+                             tags=("history",))
+        self._history_offset += len(entries)
+        self._history_done = len(entries) < self.HISTORY_PAGE
+
+    def _on_tree_scroll(self, first, last):
+        """Scrollbar update hook: fetches the next history page once the view nears the bottom."""
+        self.scroller.set(first, last)
+        # While the loaded rows don't fill the view, last stays at 1.0 and pages keep coming
+        if float(last) > 0.9 and not self._history_done and not self._page_pending:
+            self._page_pending = True
+            self.root.after_idle(self._load_history_page)
+
+    def _on_search_changed(self, *args):
+        # Wait for a pause in typing instead of querying on every keystroke
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+        self._search_job = self.root.after(self.SEARCH_DELAY_MS, self._apply_search)
+
+    def _apply_search(self):
+        self._search_job = None
+        search = self.var_search.get().strip()
+        if search != self._history_search:
+            self._history_search = search
+            self._load_history_to_view()
 
     def open_file(self, path):
         if sys.platform == "win32":